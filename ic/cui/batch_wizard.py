@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Пакетный (неинтерактивный) режим инсталляции/деинсталляции.
+
+Сценарий строится из описания программ (config.PROGRAMM) и
+необязательного файла ответов без создания страниц визарда.
+Модуль не импортирует библиотеки urwid и pythondialog,
+поэтому не требует терминала и может запускаться из cron
+и систем оркестрации.
+
+Файл ответов - INI файл. Имя секции - имя программы ('name'),
+параметры секции заменяют соответствующие ключи описания программы.
+Например:
+    [icservices]
+    check = True
+    dir = /opt/icservices
+"""
+
+import copy
+import os.path
+import time
+
+from . import wizard
+from . import uninstall_manager
+
+try:
+    from ..utils import util
+    from ..utils import log
+    from ..utils import tools
+    from ..utils import ini
+    from ..utils import utils
+except Exception:
+    from ic.utils import util
+    from ic.utils import log
+    from ic.utils import tools
+    from ic.utils import ini
+    from ic.utils import utils
+
+__version__ = (0, 1, 1, 1)
+
+# Коды завершения пакетного режима
+EXIT_OK = 0
+EXIT_ERROR = 1
+
+
+class icBatchPage:
+    """
+    Заместитель страницы визарда для пакетного режима.
+    Передается в функции сценария именованным аргументом 'page'.
+    """
+    def __init__(self, Wizard, lProgramms=None):
+        """
+        Конструктор.
+        @param Wizard: Пакетный визард.
+        @param lProgramms: Описание программ.
+        """
+        self.wizard = Wizard
+        self._programms = lProgramms
+
+    def getWizard(self):
+        return self.wizard
+
+    def getData(self):
+        return self._programms
+
+
+class icBatchWizard(wizard.icCUIWizard):
+    """
+    Визард пакетного режима.
+    """
+    def __init__(self, *args, **kwargs):
+        wizard.icCUIWizard.__init__(self, *args, **kwargs)
+
+        # Внутренне окружение визарда инсталяции
+        self.environment = {}
+
+        # Регистратор-менеджер инсталляции
+        self._install_log_manager = uninstall_manager.icInstallLogManager()
+        # Регистратор-менеджер деинсталляции
+        self._uninstall_log_manager = uninstall_manager.icUninstallLogManager()
+
+        # Отчет о выполнении сценария располагается в папке install.log
+        self.scenario_report_filename = self._install_log_manager.get_scenario_report_file_name()
+
+    def getInstallLogManager(self):
+        """
+        Регистратор-менеджер инсталляции.
+        """
+        return self._install_log_manager
+
+    def getUninstallLogManager(self):
+        """
+        Регистратор-менеджер деинсталляции.
+        """
+        return self._uninstall_log_manager
+
+    def check_root(self):
+        """
+        Функция проверки прав администратора.
+        """
+        ok = util.is_root_user()
+        if not ok:
+            log.error(u'Запуск инсталяции возможен только с правами root!', bForcePrint=True)
+        return ok
+
+    def checkPackages(self, dPackages):
+        """
+        Проверка установленных пакетов и их версий.
+        @param dPackages: Описательная структура проверки наличия пакетов.
+        @return: True/False.
+        """
+        self.setPackagesCheck(*util.check_packages(dPackages))
+        return self.packages_result
+
+    def addProgrammScenario(self, lProgramms, sNameKey='name'):
+        """
+        Добавить шаги сценария по описанию программ.
+        @param lProgramms: Описание программ.
+        @param sNameKey: Ключ имени шага в описании программы.
+        """
+        page = icBatchPage(self, lProgramms)
+        for i, programm in enumerate(lProgramms or ()):
+            name = programm.get(sNameKey, 'programm_%d' % i)
+            func = tools.getFuncStr(programm.get('script', None))
+            kwargs = {}
+            kwargs.update(programm)
+            kwargs.update({'page': page})
+            self.addScenarioScript(name, func, (), kwargs, programm.get('check', False))
+
+    def getReport(self, bResult, fStartTime=None):
+        """
+        Отчет о выполнении пакетного режима.
+        @param bResult: Общий результат.
+        @param fStartTime: Время запуска.
+        @return: Словарь отчета.
+        """
+        report = dict(title=self.title, result=bool(bResult),
+                      packages_result=self.packages_result, packages=self.packages,
+                      steps=self.scenario_results, report_filename=self.scenario_report_filename)
+        if fStartTime is not None:
+            report['time'] = time.time() - fStartTime
+        return report
+
+
+def load_answers(sAnswersFileName=None):
+    """
+    Загрузить файл ответов.
+    @param sAnswersFileName: Полное имя INI файла ответов.
+    @return: Словарь {Имя программы: {Ключ: Значение}}.
+    """
+    if not sAnswersFileName:
+        return {}
+    answers = ini.INI2Dict(sAnswersFileName)
+    if answers is None:
+        log.warning(u'Пакетный режим. Файл ответов <%s> не загружен' % sAnswersFileName, bForcePrint=True)
+        return {}
+    return answers
+
+
+def apply_answers(lProgramms, dAnswers, sNameKey='name'):
+    """
+    Применить ответы к описанию программ.
+    @param lProgramms: Описание программ.
+    @param dAnswers: Словарь ответов (см. load_answers).
+    @param sNameKey: Ключ имени программы.
+    @return: Копия описания программ с примененными ответами.
+    """
+    programms = copy.deepcopy(lProgramms or [])
+    names = [programm.get(sNameKey, None) for programm in programms]
+    for section, values in (dAnswers or {}).items():
+        if section not in names:
+            log.warning(u'Пакетный режим. Программа <%s> файла ответов не найдена' % section, bForcePrint=True)
+            continue
+        programms[names.index(section)].update(values)
+    return programms
+
+
+def install(lProgramms, dPackages=None, sAnswersFileName=None):
+    """
+    Инсталляция в пакетном режиме.
+    @param lProgramms: Описание инсталлируемых программ (config.PROGRAMM).
+    @param dPackages: Описание контролируемых пакетов (config.PACKAGES).
+    @param sAnswersFileName: Файл ответов.
+    @return: Словарь отчета.
+    """
+    start_time = time.time()
+    wiz = icBatchWizard(u'Инсталляция программного обеспечения')
+    wiz.createScenarioJournal()
+    wiz.createScenarioDurations()
+
+    if not wiz.check_root():
+        return wiz.getReport(False, start_time)
+
+    if not wiz.checkPackages(dPackages):
+        log.error(u'Пакетный режим. Не пройден контроль установленных пакетов', bForcePrint=True)
+        return wiz.getReport(False, start_time)
+
+    programms = apply_answers(lProgramms, load_answers(sAnswersFileName))
+    wiz.addProgrammScenario(programms)
+    result = wiz.doScenario()
+    log.debug(u'Инсталяция. Код результата <%s>' % result)
+    save_plan_filename = utils.get_var('SAVE_PLAN_FILENAME')
+    if save_plan_filename and result:
+        from . import install_plan
+        install_plan.save_plan(save_plan_filename, wiz, dPackages)
+    return wiz.getReport(result, start_time)
+
+
+def uninstall(lProgramms, sAnswersFileName=None):
+    """
+    Деинсталляция в пакетном режиме.
+    @param lProgramms: Описание деинсталлируемых программ (config.UNINSTALL_PROGRAMM).
+    @param sAnswersFileName: Файл ответов. Имена секций - наименования пакетов install.log.
+    @return: Словарь отчета.
+    """
+    start_time = time.time()
+    wiz = icBatchWizard(u'Деинсталляция программного обеспечения')
+    report_filename = wiz.getInstallLogManager().get_scenario_report_file_name(uninstall_manager.UNINSTALL_REPORT_FILE_NAME)
+    wiz.scenario_report_filename = report_filename
+
+    programms = []
+    if os.path.exists(wiz.getInstallLogManager().get_install_log_file_name()):
+        programms = uninstall_manager.get_installed_programms(wiz.getInstallLogManager(), lProgramms)
+    programms = apply_answers(programms, load_answers(sAnswersFileName), sNameKey='programm')
+    wiz.addProgrammScenario(programms, sNameKey='programm')
+    result = wiz.doScenario()
+    log.debug(u'Деинсталяция. Код результата <%s>' % result)
+    return wiz.getReport(result, start_time)
+
+
+def get_exit_code(dReport):
+    """
+    Код завершения процесса по отчету пакетного режима.
+    """
+    return EXIT_OK if dReport and dReport.get('result', False) else EXIT_ERROR
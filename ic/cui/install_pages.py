@@ -9,6 +9,7 @@ from . import cui_dialog
 from . import urwid_dialog
 from . import pydlg_dialog
 from . import wizard_page
+from . import step_durations
 
 try:
     from ..utils import util
@@ -90,44 +91,10 @@ class icPackageControlPage(icInstallCUIWizardPage):
         """
         Инициализация списка пакетов.
         """
-        package_list = []
         # Данные списка пакетов
-        self.result = True
-        if dPackages:
-            log.debug(u'Список контролируемых пакетов:')
-            for package_name, package_misc in dPackages.items():
-                if 'type' in package_misc:
-                    package_type = package_misc['type']
-                else:
-                    package_type = 'py'
-
-                # Определение версии
-                if 'ver' in package_misc:
-                    package_ver = package_misc['ver']
-                else:
-                    package_ver = ''
-                if 'compare' in package_misc:
-                    package_compare = package_misc['compare']
-                else:
-                    package_compare = '=='
-
-                # Проверка наличия пакетов
-                result = False
-                if package_type == 'py':
-                    result = util.check_python_library_version(package_name, package_ver, package_compare)
-                    # Если пакет не установлен, 
-                    # то попытаться поставить его из пакетов инсталлятора
-                    if not result:
-                        autoinstall_pack = package_misc.get('auto', None)
-                        result = util.targz_install_python_package(autoinstall_pack)
-                elif package_type == 'pkg':
-                    result = util.check_linux_package(package_name, package_ver, package_compare)
-                    
-                self.result = self.result and result
-                check_package_ver = package_ver if result else u'Не установлен/Не сооответствует версии %s' % package_ver
-                line = (package_name, check_package_ver, result)
-                log.debug(u'\t%s\tver: (%s)\t[%s]' % (package_name, check_package_ver, result))
-                package_list += list(line)
+        self.result, package_list = util.check_packages(dPackages)
+        # Результат проверки сохраняется в плане инсталляции
+        self.getWizard().setPackagesCheck(self.result, package_list)
 
         # Создание списка пакетов
         self.dlg = self.create_dialog(sDialogType=utils.get_var('DIALOG_MODE'), items=package_list)
@@ -199,18 +166,31 @@ class icProgrammInstallPage(icInstallCUIWizardPage):
         
         # Создание списка инсталируемых программ
         programm_list = []
+        # Ориентировочные длительности инсталляции отмеченных программ
+        estimates = []
         if self._programms:
             log.debug(u'Список инсталлируемых программ:')
-            for programm in self._programms:
+            for i, programm in enumerate(self._programms):
+                name = programm.get('name', 'programm_%d' % i)
+                description = programm.get('description', programm.get('programm', '-'))
+                estimate = self.wizard.getStepEstimate(name, programm)
+                if estimate is not None:
+                    description = u'%s [~%s]' % (description, step_durations.format_duration(estimate))
+                    if programm.get('check', False):
+                        estimates.append(estimate)
                 line = [programm.get('name', programm.get('programm', '-')),
-                        programm.get('description', programm.get('programm', '-')),
+                        description,
                         'on' if programm.get('check', False) else 'off']
                 log.debug(u'\t%s\t(%s)\t[%s]' % (line[0], line[1], line[2]))
                 programm_list += line
 
-        self.dlg = self.create_dialog(sDialogType=utils.get_var('DIALOG_MODE'), items=programm_list)
+        title = u'Выбор программ'
+        total_estimate = step_durations.estimate_scenario_time(estimates, utils.get_var('SCENARIO_THREADS'))
+        if total_estimate is not None:
+            title = u'%s. Ориентировочное время ~%s' % (title, step_durations.format_duration(total_estimate))
+        self.dlg = self.create_dialog(sDialogType=utils.get_var('DIALOG_MODE'), items=programm_list, sTitle=title)
 
-    def create_dialog(self, sDialogType=wizard_page.URWID_DIALOG_TYPE, items=None):
+    def create_dialog(self, sDialogType=wizard_page.URWID_DIALOG_TYPE, items=None, sTitle=u'Выбор программ'):
         """
         Создать диалог.
         """
@@ -218,10 +198,10 @@ class icProgrammInstallPage(icInstallCUIWizardPage):
             log.warning(u'Не определены элементы страницы устанавливаемых программ')
             return None
         if sDialogType == wizard_page.URWID_DIALOG_TYPE:
-            return urwid_dialog.do_checklist(u'Выбор программ', cui_dialog.DEFAULT_DLG_HEIGHT, cui_dialog.DEFAULT_DLG_WIDTH,
+            return urwid_dialog.do_checklist(sTitle, cui_dialog.DEFAULT_DLG_HEIGHT, cui_dialog.DEFAULT_DLG_WIDTH,
                                              cui_dialog.DEFAULT_DLG_HEIGHT, *items)
         elif sDialogType == wizard_page.PYDLG_DIALOG_TYPE:
-            return pydlg_dialog.do_checklist(u'Выбор программ', cui_dialog.DEFAULT_DLG_HEIGHT, cui_dialog.DEFAULT_DLG_WIDTH,
+            return pydlg_dialog.do_checklist(sTitle, cui_dialog.DEFAULT_DLG_HEIGHT, cui_dialog.DEFAULT_DLG_WIDTH,
                                              cui_dialog.DEFAULT_DLG_HEIGHT, *items)
         else:
             log.warning(u'Не поддерживаемый тип диалога <%s>' % sDialogType)
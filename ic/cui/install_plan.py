@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Скомпилированный план инсталляции.
+
+План - результат разбора конфигурации и страниц визарда, сохраненный
+в JSON файл (install.py --save_plan=FILE). Повторная инсталляция
+по плану (install.py --plan=FILE) выполняется без построения страниц,
+определения функций сценария через exec/eval и без проверки пакетов,
+если ничего не изменилось.
+
+Формат файла плана:
+{
+'version': <Версия формата плана>,
+'title': <Заголовок визарда>,
+'time': <Время создания плана>,
+'steps': [{'name': <Идентификатор шага>,
+           'func': <Путь импорта функции шага: пакет.модуль.функция>,
+           'args': <Аргументы>,
+           'kwargs': <Именованные аргументы без страницы визарда>,
+           'enable': <Вкл.>}, ...],
+'modules': {<Имя модуля>: <Идентификация файла модуля>, ...},
+'packages': {'result': <Результат проверки пакетов>,
+             'list': [{'name': ..., 'ver': ..., 'result': ...}, ...],
+             'key': <Ключ актуальности проверки пакетов>},
+}
+План считается устаревшим, если изменились файлы модулей функций
+сценария или модуль конфигурации. Результат проверки пакетов
+используется повторно, пока не изменились описание проверяемых пакетов,
+база установленных DEB пакетов и версия Python.
+"""
+
+import sys
+import os.path
+import json
+import time
+import hashlib
+import importlib
+
+from . import batch_wizard
+
+try:
+    from ..utils import log
+    from ..utils import util
+except Exception:
+    from ic.utils import log
+    from ic.utils import util
+
+__version__ = (0, 1, 1, 1)
+
+PLAN_VERSION = 1
+
+# База установленных DEB пакетов
+DPKG_STATUS_FILE_NAME = '/var/lib/dpkg/status'
+
+# Именованные аргументы шагов, определяемые во время выполнения
+RUNTIME_KWARGS = ('page', 'log_manager', 'mirror_extracted', 'mirror_manifest', 'mirror_dirs', 'root')
+
+# Модуль конфигурации
+CONFIG_MODULE_NAME = 'config'
+
+
+def get_func_path(fFunc):
+    """
+    Путь импорта функции.
+    @param fFunc: Объект функции.
+    @return: Строка 'пакет.модуль.функция' или None,
+        если функция не может быть импортирована по пути.
+    """
+    module_name = getattr(fFunc, '__module__', None)
+    qualname = getattr(fFunc, '__qualname__', None)
+    if not module_name or not qualname or '<' in qualname or module_name == '__main__':
+        return None
+    return '%s.%s' % (module_name, qualname)
+
+
+def import_func(sFuncPath):
+    """
+    Импортировать функцию по пути импорта.
+    @param sFuncPath: Строка 'пакет.модуль.функция'.
+    @return: Объект функции.
+    """
+    names = sFuncPath.split('.')
+    for i in range(len(names) - 1, 0, -1):
+        try:
+            obj = importlib.import_module('.'.join(names[:i]))
+        except ImportError:
+            continue
+        for name in names[i:]:
+            obj = getattr(obj, name)
+        return obj
+    raise ImportError(u'Не найден модуль функции <%s>' % sFuncPath)
+
+
+def get_module_identity(sModuleName):
+    """
+    Идентификация файла модуля.
+    @param sModuleName: Имя модуля.
+    @return: Словарь идентификации (см. util.get_file_identity) или None.
+    """
+    module = sys.modules.get(sModuleName, None)
+    if module is None:
+        try:
+            module = importlib.import_module(sModuleName)
+        except ImportError:
+            return None
+    return util.get_file_identity(getattr(module, '__file__', None))
+
+
+def get_packages_key(dPackages):
+    """
+    Ключ актуальности результата проверки пакетов.
+    @param dPackages: Описание проверяемых пакетов.
+    """
+    packages = json.dumps(dPackages, sort_keys=True, default=str).encode('utf-8')
+    dpkg_status = util.get_file_identity(DPKG_STATUS_FILE_NAME)
+    return dict(packages=hashlib.sha256(packages).hexdigest(),
+                dpkg=[dpkg_status['size'], dpkg_status['mtime']] if dpkg_status else None,
+                python=sys.version)
+
+
+class icInstallPlan:
+    """
+    План инсталляции.
+    """
+    def __init__(self, sPlanFileName):
+        """
+        Конструктор.
+        @param sPlanFileName: Полное имя файла плана.
+        """
+        self._plan_file_name = sPlanFileName
+        self.title = None
+        self.steps = []
+        self.modules = {}
+        self.packages = None
+
+    def get_plan_file_name(self):
+        """
+        Полное имя файла плана.
+        """
+        return self._plan_file_name
+
+    def build(self, sTitle, lScenario, bPackagesResult=None, lPackages=None, dPackages=None):
+        """
+        Построить план по сценарию.
+        @param sTitle: Заголовок визарда.
+        @param lScenario: Сценарий-список шагов сценария.
+        @param bPackagesResult: Результат проверки пакетов.
+        @param lPackages: Результаты проверки пакетов.
+        @param dPackages: Описание проверяемых пакетов.
+        @return: True - план построен, False - сценарий не может быть сохранен.
+        """
+        self.title = sTitle
+        self.steps = []
+        self.modules = {CONFIG_MODULE_NAME: get_module_identity(CONFIG_MODULE_NAME)}
+        for step in lScenario:
+            if not step:
+                continue
+            name, func, args, kwargs, enable = step[:5]
+            func_path = get_func_path(func) if func else None
+            if func and func_path is None:
+                log.warning(u'План инсталляции. Функция шага <%s> не может быть импортирована по пути' % name)
+                return False
+            kwargs = dict([(key, value) for key, value in (kwargs or {}).items() if key not in RUNTIME_KWARGS])
+            try:
+                json.dumps([args, kwargs])
+            except (TypeError, ValueError):
+                log.warning(u'План инсталляции. Аргументы шага <%s> не могут быть сохранены' % name)
+                return False
+            if func_path:
+                module_name = func.__module__
+                self.modules[module_name] = get_module_identity(module_name)
+            self.steps.append(dict(name=name, func=func_path, args=list(args or ()), kwargs=kwargs,
+                                   enable=bool(enable)))
+
+        self.packages = None
+        if bPackagesResult is not None:
+            self.packages = dict(result=bPackagesResult, list=lPackages or [],
+                                 key=get_packages_key(dPackages))
+        return True
+
+    def save(self):
+        """
+        Сохранить план.
+        @return: True/False.
+        """
+        plan = dict(version=PLAN_VERSION, title=self.title, time=time.time(),
+                    steps=self.steps, modules=self.modules, packages=self.packages)
+        tmp_file_name = self._plan_file_name + '.tmp'
+        try:
+            path = os.path.dirname(self._plan_file_name)
+            if path and not os.path.exists(path):
+                os.makedirs(path)
+            with open(tmp_file_name, 'wt') as plan_file:
+                json.dump(plan, plan_file, indent=1, ensure_ascii=False)
+            os.replace(tmp_file_name, self._plan_file_name)
+            log.info(u'План инсталляции сохранен в <%s>' % self._plan_file_name)
+            return True
+        except:
+            log.fatal(u'Ошибка сохранения плана инсталляции <%s>' % self._plan_file_name)
+        return False
+
+    def load(self):
+        """
+        Загрузить план.
+        @return: True/False.
+        """
+        try:
+            with open(self._plan_file_name, 'rt') as plan_file:
+                plan = json.load(plan_file)
+        except:
+            log.fatal(u'Ошибка загрузки плана инсталляции <%s>' % self._plan_file_name)
+            return False
+        if plan.get('version', None) != PLAN_VERSION:
+            log.warning(u'План инсталляции. Не поддерживаемая версия плана <%s>' % plan.get('version', None))
+            return False
+        self.title = plan.get('title', None)
+        self.steps = plan.get('steps', [])
+        self.modules = plan.get('modules', {})
+        self.packages = plan.get('packages', None)
+        return True
+
+    def is_valid(self):
+        """
+        План актуален?
+        Проверяется неизменность модулей функций сценария и конфигурации.
+        """
+        for module_name, identity in self.modules.items():
+            if get_module_identity(module_name) != identity:
+                log.info(u'План инсталляции. Изменился модуль <%s>' % module_name)
+                return False
+        return True
+
+    def is_packages_valid(self, dPackages):
+        """
+        Сохраненный результат проверки пакетов актуален?
+        @param dPackages: Описание проверяемых пакетов.
+        """
+        if not self.packages:
+            return False
+        return self.packages.get('key', None) == get_packages_key(dPackages)
+
+    def get_scenario(self, Page=None):
+        """
+        Сценарий по плану.
+        @param Page: Страница, передаваемая функциям шагов именованным аргументом 'page'.
+        @return: Сценарий-список шагов сценария.
+        """
+        scenario = []
+        for step in self.steps:
+            func = import_func(step['func']) if step.get('func', None) else None
+            kwargs = dict(step.get('kwargs', None) or {})
+            kwargs['page'] = Page
+            scenario.append((step['name'], func, tuple(step.get('args', None) or ()), kwargs,
+                             step.get('enable', True)))
+        return scenario
+
+    def get_programms(self):
+        """
+        Описание программ плана.
+        """
+        return [dict(step.get('kwargs', None) or {}) for step in self.steps]
+
+
+def save_plan(sPlanFileName, Wizard, dPackages=None):
+    """
+    Сохранить план инсталляции по выполненному сценарию визарда.
+    @param sPlanFileName: Полное имя файла плана.
+    @param Wizard: Визард инсталляции.
+    @param dPackages: Описание проверяемых пакетов.
+    @return: True/False.
+    """
+    plan = icInstallPlan(sPlanFileName)
+    if not plan.build(Wizard.title, Wizard.scenario, Wizard.packages_result, Wizard.packages, dPackages):
+        log.warning(u'План инсталляции не сохранен')
+        return False
+    return plan.save()
+
+
+def install(sPlanFileName, dPackages=None):
+    """
+    Инсталляция по плану.
+    @param sPlanFileName: Полное имя файла плана.
+    @param dPackages: Описание проверяемых пакетов (config.PACKAGES).
+    @return: Словарь отчета (см. batch_wizard) или None, если план
+        не загружен или устарел.
+    """
+    plan = icInstallPlan(sPlanFileName)
+    if not plan.load() or not plan.is_valid():
+        log.warning(u'План инсталляции <%s> не актуален' % sPlanFileName, bForcePrint=True)
+        return None
+
+    start_time = time.time()
+    wiz = batch_wizard.icBatchWizard(plan.title or u'Инсталляция программного обеспечения')
+    wiz.createScenarioJournal()
+    wiz.createScenarioDurations()
+
+    if not wiz.check_root():
+        return wiz.getReport(False, start_time)
+
+    if plan.is_packages_valid(dPackages):
+        log.info(u'План инсталляции. Используется сохраненный результат проверки пакетов')
+        wiz.setPackagesCheck(plan.packages['result'], plan.packages['list'])
+    else:
+        wiz.checkPackages(dPackages)
+    if not wiz.packages_result:
+        log.error(u'План инсталляции. Не пройден контроль установленных пакетов', bForcePrint=True)
+        return wiz.getReport(False, start_time)
+
+    page = batch_wizard.icBatchPage(wiz, plan.get_programms())
+    wiz.scenario = plan.get_scenario(page)
+    result = wiz.doScenario()
+    log.debug(u'Инсталяция по плану. Код результата <%s>' % result)
+    return wiz.getReport(result, start_time)
@@ -47,6 +47,9 @@ class icInstallCUIWizard(wizard.icCUIWizard):
         # Регистратор-менеджер деинсталляции
         self._uninstall_log_manager = uninstall_manager.icUninstallLogManager()
 
+        # Отчет о выполнении сценария располагается в папке install.log
+        self.scenario_report_filename = self._install_log_manager.get_scenario_report_file_name()
+
         # Папка настроек
         self.settings_path = None
         # файл настроек
@@ -56,6 +59,18 @@ class icInstallCUIWizard(wizard.icCUIWizard):
         self.settings = None
         self.loadSettings()
 
+    def showScenarioSummary(self, sTitle=u'Результат выполнения'):
+        """
+        Показать сводную таблицу показателей выполнения шагов сценария.
+        Таблица показывается, только если сценарий выполнялся.
+        @param sTitle: Заголовок окна.
+        """
+        if not [step for step in self.scenario_results if step.get('stats', None)]:
+            return None
+        summary = self.getScenarioSummary()
+        log.info(u'Показатели выполнения сценария:\n%s' % summary)
+        return cui_message.MessageBox(summary, sTitle, sDialogType=utils.get_var('DIALOG_MODE'))
+
     def getInstallDir(self):
         return self._install_dir
 
@@ -154,6 +169,9 @@ def install(fInstallScript=None, fPrevInstallScript=None, fPostInstallScript=Non
     В качестве аргумента функция должна принимать объект визарда.
     """
     wiz = icInstallCUIWizard(u'Инсталляция программного обеспечения')
+    # Контрольные точки для продолжения прерванной инсталляции
+    wiz.createScenarioJournal()
+    wiz.createScenarioDurations()
 
     if fPrevInstallScript:
         fPrevInstallScript(wiz, *args, **kwargs)
@@ -167,6 +185,11 @@ def install(fInstallScript=None, fPrevInstallScript=None, fPostInstallScript=Non
     if script_ok:
         wiz_result_code = wiz.runFirstPage()
         log.debug(u'Инсталяция. Код результата <%s>' % wiz_result_code)
+        wiz.showScenarioSummary(u'Результат инсталляции')
+        save_plan_filename = utils.get_var('SAVE_PLAN_FILENAME')
+        if save_plan_filename and wiz.scenario_result:
+            from . import install_plan
+            install_plan.save_plan(save_plan_filename, wiz, config.PACKAGES)
 
     if fPostInstallScript:
         fPostInstallScript(wiz, *args, **kwargs)
@@ -185,6 +208,8 @@ def uninstall(fUninstallScript=None, fPrevUninstallScript=None, fPostUninstallSc
     from . import uninstall_pages
     
     wiz = icInstallCUIWizard(u'Деинсталляция программного обеспечения')
+    report_filename = wiz.getInstallLogManager().get_scenario_report_file_name(uninstall_manager.UNINSTALL_REPORT_FILE_NAME)
+    wiz.scenario_report_filename = report_filename
     
     if fPrevUninstallScript:
         fPrevUninstallScript(wizard, *args, **kwargs)
@@ -201,6 +226,7 @@ def uninstall(fUninstallScript=None, fPrevUninstallScript=None, fPostUninstallSc
     if script_ok:
         wiz_result_code = wiz.runFirstPage()
         log.debug(u'Деинсталяция. Код результата <%d>' % wiz_result_code)
+        wiz.showScenarioSummary(u'Результат деинсталляции')
 
     if fPostUninstallScript:
         fPostUninstallScript(wizard, *args, **kwargs)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Инсталляция одного набора программ в несколько корневых папок
+(chroot, корневые файловые системы контейнеров).
+
+Сценарий инсталляции переписывается для каждой корневой папки:
+    - идентификаторы шагов получают суффикс '@<Корневая папка>',
+      зависимости 'depends'/'after' ссылаются на шаги той же корневой папки;
+    - пути 'dir', 'remove' и папка стандартных библиотек Python
+      для pth файлов получают префикс корневой папки.
+      Путь, записываемый в pth файл, остается путем внутри корневой папки;
+    - для каждой корневой папки ведется свой install.log
+      (<Корневая папка>/<Папка настроек пользователя>/install.log).
+      Пути пакетов в нем записываются относительно корневой папки,
+      а менеджеры журналирования корневой папки (см. create_root_log_manager,
+      create_root_uninstall_log_manager) при деинсталляции и переносе
+      в корзину снова соединяют их с корневой папкой;
+    - DEB пакеты устанавливаются командой dpkg --root.
+
+Архив программы читается и распаковывается один раз:
+шаг первой корневой папки разворачивает его сразу во все корневые папки
+(ключ 'mirror_dirs'), а шаги остальных корневых папок зависят от него и
+только регистрируют инсталляцию, сохраняя общий манифест файлов пакета
+(ключ 'mirror_manifest') со своей инсталляционной папкой.
+Если шаг первой корневой папки не распаковывал архив (например, программа
+там уже установлена), то шаги остальных корневых папок выполняют
+инсталляцию полностью.
+"""
+
+import os
+import os.path
+import copy
+import sysconfig
+
+from . import uninstall_manager
+from . import scenario_executor
+
+try:
+    from ..utils import util
+    from ..utils import log
+    from ..utils import manifest
+except Exception:
+    from ic.utils import util
+    from ic.utils import log
+    from ic.utils import manifest
+
+__version__ = (0, 1, 1, 1)
+
+# Разделитель идентификатора шага и корневой папки
+ROOT_STEP_DELIMETER = '@'
+
+
+def get_root_path(sRoot, sPath):
+    """
+    Путь внутри корневой папки.
+    @param sRoot: Корневая папка.
+    @param sPath: Путь относительно корня системы.
+    @return: Полный путь.
+    """
+    return os.path.normpath(os.path.join(sRoot, util.normpath(sPath).lstrip(os.sep)))
+
+
+def get_root_step_name(sName, sRoot):
+    """
+    Идентификатор шага корневой папки.
+    @param sName: Идентификатор шага сценария.
+    @param sRoot: Корневая папка.
+    """
+    return '%s%s%s' % (sName, ROOT_STEP_DELIMETER, sRoot)
+
+
+def create_root_log_manager(sRoot):
+    """
+    Создать менеджер журналирования инсталляции корневой папки.
+    @param sRoot: Корневая папка.
+    """
+    install_log_file_name = uninstall_manager.icInstallLogManager().get_install_log_file_name()
+    return uninstall_manager.icInstallLogManagerPrototype(get_root_path(sRoot, install_log_file_name), sRoot)
+
+
+def create_root_uninstall_log_manager(sRoot, bTrash=True):
+    """
+    Создать менеджер деинсталляции пакетов корневой папки.
+    Файлы пакетов удаляются/переносятся в корзину внутри корневой папки.
+    @param sRoot: Корневая папка.
+    @param bTrash: Переносить папки пакетов в корзину вместо удаления?
+    """
+    install_log_file_name = uninstall_manager.icInstallLogManager().get_install_log_file_name()
+    return uninstall_manager.icUninstallLogManager(get_root_path(sRoot, install_log_file_name), bTrash, sRoot)
+
+
+def _is_archive_programm(dProgramm):
+    """
+    Программа устанавливается разархивированием в папку?
+    """
+    programm = (dProgramm.get('programm', None) or '').lower()
+    return bool(dProgramm.get('dir', None)) and programm.endswith(scenario_executor.ARCHIVE_PROGRAMM_EXT)
+
+
+def rewrite_programm(dProgramm, sRoot, LogManager=None):
+    """
+    Переписать описание программы для инсталляции в корневую папку.
+    @param dProgramm: Описание программы (именованные аргументы шага).
+    @param sRoot: Корневая папка.
+    @param LogManager: Менеджер журналирования инсталляции корневой папки.
+    @return: Новое описание программы.
+    """
+    programm = dict(dProgramm)
+    programm['root'] = sRoot
+    if LogManager is not None:
+        programm['log_manager'] = LogManager
+
+    if programm.get('dir', None):
+        programm['dir'] = get_root_path(sRoot, programm['dir'])
+
+    if programm.get('remove', None):
+        # Пути удаляемых файлов/папок. Имена DEB пакетов не изменяются
+        programm['remove'] = [get_root_path(sRoot, name) if os.path.sep in name else name
+                              for name in programm['remove']]
+
+    if programm.get('pth', None):
+        pth = copy.deepcopy(programm['pth'])
+        if pth.get('dir', None) is None and dProgramm.get('dir', None):
+            # Путь в pth файле должен быть путем внутри корневой папки
+            pth['dir'] = os.path.normpath(os.path.join(util.normpath(dProgramm['dir']), pth.get('package', '')))
+        pth['stdlib_path'] = get_root_path(sRoot, pth.get('stdlib_path', None) or sysconfig.get_path('stdlib'))
+        programm['pth'] = pth
+
+    for key in ('depends', 'after'):
+        if key in programm:
+            names = scenario_executor._get_name_list(programm[key])
+            programm[key] = [get_root_step_name(name, sRoot) for name in names]
+    return programm
+
+
+def rewrite_scenario(lScenario, lRoots):
+    """
+    Переписать сценарий инсталляции для нескольких корневых папок.
+    @param lScenario: Сценарий-список шагов сценария.
+    @param lRoots: Список корневых папок.
+    @return: Новый сценарий.
+    """
+    roots = [os.path.abspath(root) for root in lRoots]
+    log_managers = dict([(root, create_root_log_manager(root)) for root in roots])
+    log.info(u'Инсталляция в корневые папки %s' % roots)
+
+    scenario = []
+    for step in lScenario:
+        if not step:
+            continue
+        name, func, args, kwargs, enable = step[:5]
+        kwargs = kwargs or {}
+        programms = [rewrite_programm(kwargs, root, log_managers[root]) for root in roots]
+
+        if len(roots) > 1 and _is_archive_programm(kwargs):
+            # Архив разворачивается один раз шагом первой корневой папки
+            mirror_extracted = set()
+            mirror_manifest = manifest.icPackageManifest(kwargs.get('programm', kwargs.get('name', '-')))
+            primary_name = get_root_step_name(name, roots[0])
+            programms[0]['mirror_dirs'] = [programm['dir'] for programm in programms[1:]]
+            for programm in programms:
+                programm['mirror_extracted'] = mirror_extracted
+                programm['mirror_manifest'] = mirror_manifest
+            for programm in programms[1:]:
+                programm['depends'] = list(programm.get('depends', None) or ()) + [primary_name]
+
+        for root, programm in zip(roots, programms):
+            scenario.append((get_root_step_name(name, root), func, args, programm, enable))
+    return scenario
@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Исполнитель сценария визарда.
+
+Шаги сценария выполняются как граф зависимостей (DAG).
+Зависимости шага указываются в описании программы (config.PROGRAMM)
+ключами:
+    'depends' - имя или список имен шагов, которые должны успешно
+        выполниться до запуска шага. Если один из них завершился с ошибкой,
+        то шаг не запускается и считается не выполненным.
+    'after' - имя или список имен шагов, после завершения которых
+        (не важно успешного или нет) можно запускать шаг.
+Независимые шаги выполняются параллельно в ограниченном пуле потоков.
+
+Кроме того каждый шаг относится к ресурсным полосам (lanes),
+ограничивающим количество одновременно выполняемых шагов,
+конкурирующих за один ресурс:
+    'dpkg' - установка/удаление DEB пакетов (блокировка dpkg). Всегда 1 шаг.
+    'io:<устройство>' - разархивирование на файловую систему
+        инсталляционной папки. Ограничение задается SCENARIO_IO_LANE_LIMIT.
+    'cpu' - остальные шаги. Ограничение - количество ядер.
+Полоса определяется автоматически по типу инсталляционного пакета
+программы или явно ключом 'lane' описания программы.
+
+Для каждого выполняемого шага измеряются затраченные ресурсы
+(время, процессорное время, ввод/вывод, подпроцессы, созданные файлы,
+см. модуль instrument). Показатели возвращаются в результатах шагов.
+
+Если задана база длительностей шагов (см. step_durations), то
+длительности выполненных шагов регистрируются в ней, а при параллельном
+выполнении первыми запускаются шаги с самой длинной цепочкой
+зависимых от них шагов (критический путь).
+
+Время выполнения шага может быть ограничено ключом 'timeout' (сек)
+описания программы. По истечении времени дерево внешних процессов шага
+принудительно завершается (см. watchdog), а шаг считается не выполненным.
+Если шаг завис не во внешнем процессе, то исполнитель перестает
+его ожидать. При прерывании сценария пользователем (Ctrl-C) выполняемые
+шаги прерываются, а не запущенные шаги отменяются.
+"""
+
+import os
+import os.path
+import sys
+import time
+import concurrent.futures
+
+try:
+    from ..utils import log
+    from ..utils import util
+    from ..utils import instrument
+    from ..utils import watchdog
+    from ..utils import archive_format
+except Exception:
+    from ic.utils import log
+    from ic.utils import util
+    from ic.utils import instrument
+    from ic.utils import watchdog
+    from ic.utils import archive_format
+
+__version__ = (0, 1, 1, 1)
+
+# Количество потоков исполнения сценария по умолчанию.
+# 1 - последовательное выполнение шагов в порядке сценария
+DEFAULT_MAX_WORKERS = 1
+
+# Состояния шага сценария
+STEP_WAIT = 'wait'
+STEP_RUN = 'run'
+STEP_DONE = 'done'
+STEP_FAIL = 'fail'
+STEP_SKIP = 'skip'
+STEP_CANCEL = 'cancel'
+
+FINISH_STEP_STATES = (STEP_DONE, STEP_FAIL, STEP_SKIP, STEP_CANCEL)
+
+# Время ожидания завершения шага после прерывания его процессов (сек).
+# По истечении этого времени исполнитель перестает ожидать шаг
+ABANDON_STEP_TIME = watchdog.KILL_GRACE_TIME + 5.0
+
+# Ресурсные полосы
+DPKG_LANE = 'dpkg'
+IO_LANE = 'io'
+CPU_LANE = 'cpu'
+
+# Количество одновременных шагов разархивирования на одну файловую систему
+DEFAULT_IO_LANE_LIMIT = 2
+
+ARCHIVE_PROGRAMM_EXT = archive_format.get_archive_extensions()
+DEB_PROGRAMM_EXT = ('.deb', )
+
+
+def _get_name_list(value):
+    """
+    Привести указание имен шагов к списку.
+    @param value: Имя шага или список/кортеж имен.
+    @return: Список имен шагов.
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return [name for name in value if name]
+
+
+def _get_fs_id(sPath):
+    """
+    Идентификатор файловой системы, на которой находится путь.
+    Если путь еще не существует, то берется ближайшая существующая
+    родительская папка.
+    @param sPath: Путь.
+    @return: Номер устройства файловой системы.
+    """
+    path = util.normpath(sPath)
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    try:
+        return os.stat(path or os.getcwd()).st_dev
+    except OSError:
+        return None
+
+
+def classify_step_lanes(dKWArgs):
+    """
+    Определить ресурсные полосы шага сценария по описанию программы.
+    @param dKWArgs: Именованные аргументы шага (описание программы).
+    @return: Список имен полос.
+    """
+    if not dKWArgs:
+        return [CPU_LANE]
+    if dKWArgs.get('lane', None):
+        return _get_name_list(dKWArgs['lane'])
+
+    lanes = []
+    programm = (dKWArgs.get('programm', None) or '').lower()
+    # Удаление DEB пакетов перед установкой (см. util.remove_programm)
+    remove_deb = [name for name in dKWArgs.get('remove', ()) if os.path.sep not in name and not os.path.exists(name)]
+    if programm.endswith(DEB_PROGRAMM_EXT) or remove_deb:
+        lanes.append(DPKG_LANE)
+    if programm.endswith(ARCHIVE_PROGRAMM_EXT):
+        install_dir = dKWArgs.get('dir', None) or util.get_temp_dir()
+        lanes.append('%s:%s' % (IO_LANE, _get_fs_id(install_dir)))
+    if not lanes:
+        lanes.append(CPU_LANE)
+    return lanes
+
+
+class icScenarioStep:
+    """
+    Шаг сценария.
+    """
+    def __init__(self, iIndex, sName, fFunc, tArgs, dKWArgs, bEnable=True):
+        """
+        Конструктор.
+        @param iIndex: Порядковый номер шага в сценарии.
+        @param sName: Идентификатор шага.
+        @param fFunc: Функция обработки шага сценария.
+        @param tArgs: Аргументы.
+        @param dKWArgs: Именованные аргументы.
+        @param bEnable: Включен шаг?
+        """
+        self.index = iIndex
+        self.name = sName
+        self.func = fFunc
+        self.args = tArgs if tArgs is not None else ()
+        self.kwargs = dKWArgs if dKWArgs is not None else {}
+        self.enable = bEnable
+
+        # Зависимости шага
+        self.depends = _get_name_list(self.kwargs.get('depends', None))
+        self.after = _get_name_list(self.kwargs.get('after', None))
+        # Ресурсные полосы шага
+        self.lanes = classify_step_lanes(self.kwargs)
+        # Ограничение времени выполнения шага (сек)
+        self.timeout = None
+        try:
+            self.timeout = float(self.kwargs['timeout']) if self.kwargs.get('timeout', None) else None
+        except (TypeError, ValueError):
+            log.warning(u'Сценарий. Шаг <%s>. Не корректное ограничение времени <%s>' % (sName,
+                                                                                        self.kwargs['timeout']))
+        # Контекст выполнения шага (watchdog.icStepContext)
+        self.context = None
+
+        self.state = STEP_WAIT
+        self.result = None
+        self.error = None
+        # Шаг пропущен, т.к. уже выполнен в прерванном запуске
+        self.resumed = False
+        # Показатели затраченных ресурсов
+        self.stats = None
+
+    def is_finished(self):
+        """
+        Шаг завершен?
+        """
+        return self.state in FINISH_STEP_STATES
+
+    def is_active(self):
+        """
+        Шаг необходимо выполнять?
+        """
+        return bool(self.func and self.enable)
+
+
+class icScenarioExecutor:
+    """
+    Исполнитель сценария.
+    Сценарий - это список кортежей:
+        [(Идентификатор,
+        Функция обработки шага сценария,
+        Аргументы,
+        Именованные аргументы,
+        Вкл.),
+        ...]
+    """
+    def __init__(self, lScenario, iMaxWorkers=DEFAULT_MAX_WORKERS, bRaiseError=False,
+                 iIOLaneLimit=DEFAULT_IO_LANE_LIMIT, dLaneLimits=None,
+                 Journal=None, bResume=False, Durations=None, fStepTimeout=None):
+        """
+        Конструктор.
+        @param lScenario: Сценарий-список шагов сценария.
+        @param iMaxWorkers: Максимальное количество одновременно выполняемых шагов.
+        @param bRaiseError: Прервать выполнение сценария при первой ошибке
+            и передать исключение дальше (режим отладки).
+        @param iIOLaneLimit: Ограничение одновременных шагов на одну файловую систему.
+        @param dLaneLimits: Явно заданные ограничения полос {'имя полосы': ограничение}.
+        @param Journal: Журнал контрольных точек выполнения сценария (scenario_journal.icScenarioJournal).
+        @param bResume: Продолжить прерванное выполнение сценария.
+            Шаги, зарегистрированные в журнале, не выполняются.
+        @param Durations: База длительностей выполнения шагов (step_durations.icStepDurations).
+        @param fStepTimeout: Ограничение времени выполнения шагов (сек),
+            для которых оно не задано ключом 'timeout'.
+        """
+        self.steps = [icScenarioStep(i, *step[:5]) for i, step in enumerate(lScenario) if step]
+        self.max_workers = max(int(iMaxWorkers or DEFAULT_MAX_WORKERS), 1)
+        self.raise_error = bRaiseError
+        self.journal = Journal
+        self.resume = bResume
+        self.durations = Durations
+        # Сценарий прерван пользователем?
+        self.cancelled = False
+        # Зависшие шаги, которые исполнитель перестал ожидать
+        self._abandoned = []
+
+        if fStepTimeout:
+            for step in self.steps:
+                if step.timeout is None:
+                    step.timeout = float(fStepTimeout)
+        # Приоритеты запуска шагов {Порядковый номер шага: Длительность критического пути}
+        self._priorities = {}
+
+        # Ограничения ресурсных полос
+        self.io_lane_limit = max(int(iIOLaneLimit or DEFAULT_IO_LANE_LIMIT), 1)
+        self.lane_limits = {DPKG_LANE: 1, CPU_LANE: os.cpu_count() or 1}
+        if dLaneLimits:
+            self.lane_limits.update(dLaneLimits)
+
+        # Шаги по именам. Имена шагов могут повторяться
+        self._step_names = {}
+        for step in self.steps:
+            self._step_names.setdefault(step.name, []).append(step)
+
+        self._check_dependencies()
+
+    def _check_dependencies(self):
+        """
+        Проверка указания зависимостей шагов.
+        Ссылки на не существующие шаги игнорируются.
+        """
+        for step in self.steps:
+            for attr in ('depends', 'after'):
+                names = getattr(step, attr)
+                unknown = [name for name in names if name not in self._step_names or name == step.name]
+                if unknown:
+                    log.warning(u'Сценарий. Шаг <%s>. Не найдены шаги зависимостей %s' % (step.name, unknown))
+                    setattr(step, attr, [name for name in names if name not in unknown])
+
+    def _get_steps(self, lNames):
+        """
+        Список шагов по списку имен.
+        """
+        return [step for name in lNames for step in self._step_names.get(name, [])]
+
+    def _is_ready(self, step):
+        """
+        Можно запускать шаг?
+        """
+        return all([dep_step.is_finished() for dep_step in self._get_steps(step.depends + step.after)])
+
+    def _is_depends_failed(self, step):
+        """
+        Один из обязательных шагов завершился с ошибкой?
+        """
+        return any([dep_step.state == STEP_FAIL for dep_step in self._get_steps(step.depends)])
+
+    def _get_ready_steps(self, lPending):
+        """
+        Список шагов готовых к запуску в порядке запуска.
+        @param lPending: Список ожидающих шагов.
+        """
+        ready_steps = [step for step in lPending if self._is_ready(step)]
+        if self._priorities:
+            ready_steps.sort(key=lambda step: -self._priorities.get(step.index, 0))
+        return ready_steps
+
+    def _calc_priorities(self):
+        """
+        Расчет приоритетов запуска шагов по базе длительностей.
+        Приоритет шага - ориентировочная длительность самой длинной
+        цепочки шагов, начинающейся с него.
+        Используется только при параллельном выполнении.
+        """
+        self._priorities = {}
+        if not self.durations or self.max_workers <= 1:
+            return self._priorities
+
+        estimates = dict([(step.index, self.durations.get_step_estimate(step) or 0.0) for step in self.steps
+                          if step.is_active() and not step.resumed])
+        # Шаги, ожидающие завершения шага
+        followers = dict([(step.index, []) for step in self.steps])
+        for step in self.steps:
+            for dep_step in self._get_steps(step.depends + step.after):
+                followers[dep_step.index].append(step)
+
+        def get_priority(step, lPath=()):
+            if step.index in self._priorities:
+                return self._priorities[step.index]
+            if step.index in lPath:
+                # Циклическая зависимость
+                return 0.0
+            path = tuple(lPath) + (step.index,)
+            priority = estimates.get(step.index, 0.0) + max([get_priority(follower, path)
+                                                             for follower in followers[step.index]] or [0.0])
+            self._priorities[step.index] = priority
+            return priority
+
+        for step in self.steps:
+            get_priority(step)
+        return self._priorities
+
+    def _can_start(self, step, lRunning):
+        """
+        Можно ли запустить шаг при текущих выполняемых шагах.
+        @param step: Шаг сценария.
+        @param lRunning: Список выполняемых шагов.
+        """
+        if len(lRunning) >= self.max_workers:
+            return False
+        for lane in step.lanes:
+            busy = len([running_step for running_step in lRunning if lane in running_step.lanes])
+            if busy >= self.get_lane_limit(lane):
+                return False
+        return True
+
+    def get_lane_limit(self, sLane):
+        """
+        Ограничение количества одновременных шагов в полосе.
+        @param sLane: Имя полосы.
+        """
+        if sLane in self.lane_limits:
+            return self.lane_limits[sLane]
+        if sLane.startswith(IO_LANE + ':'):
+            return self.io_lane_limit
+        # Для не известных полос ограничение только общим количеством потоков
+        return self.max_workers
+
+    def _on_start(self, step):
+        """
+        Обработчик запуска шага.
+        """
+        pass
+
+    def _on_finish(self, step):
+        """
+        Обработчик завершения шага.
+        """
+        if self.journal and step.state == STEP_DONE and step.result is not False and not step.resumed:
+            self.journal.log_step(step)
+        if self.durations and step.state == STEP_DONE and step.stats and not step.resumed:
+            self.durations.record_step(step)
+
+    def _prepare_journal(self):
+        """
+        Подготовка журнала контрольных точек перед запуском сценария.
+        """
+        if not self.journal:
+            return
+        if not self.resume:
+            self.journal.clear()
+            return
+        self.journal.load()
+        for step in self.steps:
+            if step.is_active() and self.journal.is_done_step(step):
+                log.info(u'Сценарий. Шаг <%s> уже выполнен' % step.name)
+                step.resumed = True
+
+    def _run_step(self, step):
+        """
+        Выполнение шага сценария.
+        @return: Результат выполнения функции шага.
+        """
+        log.info(u'Выполнение сценария %s args: %s kwargs: %s' % (step.func.__name__, step.args, step.kwargs))
+        step_instrument = instrument.icStepInstrument()
+        try:
+            with step_instrument:
+                return step.func(*step.args, **step.kwargs)
+        finally:
+            step.stats = step_instrument.get_stats()
+            log.info(u'Сценарий. Шаг <%s>. Время %.3f сек. CPU %.3f сек.' % (step.name, step.stats['wall'],
+                                                                          step.stats['cpu']))
+
+    def _exec_step(self, step):
+        """
+        Выполнение шага сценария с перехватом ошибок.
+        Функция выполняется в потоке пула.
+        @return: Кортеж (Результат выполнения, Исключение или None).
+        """
+        watchdog.set_context(step.context)
+        try:
+            return self._run_step(step), None
+        except:
+            log.fatal(u'Ошибка выполнения функции сценария <%s>' % step.func)
+            return False, sys.exc_info()[1]
+        finally:
+            watchdog.set_context(None)
+
+    def _start_step(self, pool, step):
+        """
+        Запустить шаг в потоке пула.
+        @return: Объект Future шага.
+        """
+        step.state = STEP_RUN
+        step.context = watchdog.icStepContext(step.name, step.timeout)
+        self._on_start(step)
+        step.context.start()
+        return pool.submit(self._exec_step, step)
+
+    def _complete_step(self, step, future):
+        """
+        Обработка завершения выполнения шага.
+        """
+        step.result, step.error = future.result()
+        if step.error is None and step.context.is_interrupted():
+            # Функция шага не обнаружила прерывание своих процессов
+            step.result = False
+            step.error = watchdog.icStepInterrupt(step.name, step.context.reason)
+        step.state = STEP_DONE if step.error is None else STEP_FAIL
+        self._on_finish(step)
+
+    def _abandon_step(self, step, sState=STEP_FAIL):
+        """
+        Прекратить ожидание зависшего шага.
+        Поток шага продолжает выполняться, но его результат не учитывается.
+        """
+        log.error(u'Сценарий. Шаг <%s> не завершился после прерывания' % step.name)
+        self._abandoned.append(step)
+        self._finish_step(step, sState, False, watchdog.icStepInterrupt(step.name, step.context.reason))
+
+    def _get_wait_timeout(self, lRunning):
+        """
+        Время ожидания завершения выполняемых шагов до следующей
+        проверки ограничений времени.
+        @return: Время в секундах или None, если ограничений нет.
+        """
+        timeouts = []
+        for step in lRunning:
+            remaining = step.context.get_remaining_time()
+            if remaining is not None and step.context.is_interrupted():
+                remaining += ABANDON_STEP_TIME
+            if remaining is not None:
+                timeouts.append(remaining)
+        return max(min(timeouts), 0.1) if timeouts else None
+
+    def _check_deadlines(self, dRunning):
+        """
+        Проверка ограничений времени выполняемых шагов.
+        Процессы шагов с истекшим временем принудительно завершаются.
+        @param dRunning: Словарь выполняемых шагов {Future: Шаг}.
+        """
+        for future, step in list(dRunning.items()):
+            if not step.context.is_expired():
+                continue
+            if not step.context.is_interrupted():
+                log.error(u'Сценарий. Шаг <%s>. Истекло время выполнения %s сек' % (step.name, step.timeout))
+                # Если шаг выполняется один, то все процессы-потомки инсталлятора принадлежат ему
+                step.context.interrupt(watchdog.TIMEOUT_REASON, bKillUnregistered=len(dRunning) == 1)
+            elif time.time() >= step.context.deadline + ABANDON_STEP_TIME:
+                dRunning.pop(future)
+                self._abandon_step(step)
+
+    def _cancel(self, lPending, dRunning):
+        """
+        Отмена выполнения сценария.
+        Процессы выполняемых шагов принудительно завершаются,
+        не запущенные шаги отменяются.
+        @param lPending: Список ожидающих шагов.
+        @param dRunning: Словарь выполняемых шагов {Future: Шаг}.
+        """
+        self.cancelled = True
+        for step in dRunning.values():
+            step.context.interrupt(watchdog.CANCEL_REASON, bKillUnregistered=True)
+        if dRunning:
+            done, not_done = concurrent.futures.wait(list(dRunning.keys()), timeout=ABANDON_STEP_TIME)
+            for future in done:
+                self._complete_step(dRunning.pop(future), future)
+            for step in dRunning.values():
+                self._abandon_step(step, STEP_CANCEL)
+        for step in lPending:
+            log.warning(u'Сценарий. Шаг <%s> отменен' % step.name)
+            self._finish_step(step, STEP_CANCEL, None)
+
+    def _finish_step(self, step, sState, vResult=None, error=None):
+        """
+        Завершить шаг без выполнения.
+        """
+        step.state = sState
+        step.result = vResult
+        step.error = error
+        self._on_finish(step)
+
+    def run(self):
+        """
+        Запуск сценария на выполнение.
+        @return: Общий результат выполнения сценария True/False.
+        """
+        self._prepare_journal()
+        self._calc_priorities()
+
+        pending = list(self.steps)
+        running = {}
+        stop = False
+
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while (pending and not stop) or running:
+                for step in self._get_ready_steps(pending) if not stop else ():
+                    if step.resumed:
+                        pending.remove(step)
+                        self._finish_step(step, STEP_DONE, True)
+                        continue
+                    if not step.is_active():
+                        pending.remove(step)
+                        self._finish_step(step, STEP_SKIP)
+                        continue
+                    if self._is_depends_failed(step):
+                        pending.remove(step)
+                        log.warning(u'Сценарий. Шаг <%s> не выполнен. Ошибка в шагах зависимостей %s' % (step.name,
+                                                                                                         step.depends))
+                        self._finish_step(step, STEP_FAIL, False)
+                        continue
+                    if not self._can_start(step, list(running.values())):
+                        continue
+                    pending.remove(step)
+                    running[self._start_step(pool, step)] = step
+
+                if not running:
+                    if pending and not stop and not self._get_ready_steps(pending):
+                        # Остались шаги, которые никогда не смогут запуститься
+                        for step in pending:
+                            log.error(u'Сценарий. Шаг <%s> не выполнен. Циклическая зависимость шагов' % step.name)
+                            self._finish_step(step, STEP_FAIL, False)
+                        pending = []
+                    continue
+
+                done, not_done = concurrent.futures.wait(list(running.keys()),
+                                                         timeout=self._get_wait_timeout(running.values()),
+                                                         return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    self._complete_step(step, future)
+                    if step.error is not None and self.raise_error:
+                        stop = True
+                self._check_deadlines(running)
+        except KeyboardInterrupt:
+            log.warning(u'Сценарий. Выполнение прервано пользователем')
+            self._cancel(pending, running)
+        finally:
+            # Зависшие шаги не ожидаются
+            pool.shutdown(wait=not self._abandoned, cancel_futures=True)
+
+        if stop:
+            errors = [step.error for step in self.steps if step.error is not None]
+            raise errors[0]
+        result = self.get_result() and not self.cancelled
+        if self.journal and result:
+            # Сценарий выполнен полностью. Продолжать нечего
+            self.journal.clear()
+        return result
+
+    def get_result(self):
+        """
+        Общий результат выполнения сценария.
+        Результаты выполненных шагов объединяются по И.
+        """
+        result = True
+        for step in self.steps:
+            if step.state in (STEP_DONE, STEP_FAIL):
+                result = result and step.result
+        return result
+
+    def get_step_results(self):
+        """
+        Результаты выполнения шагов сценария.
+        @return: Список словарей:
+            [{'name': Идентификатор шага,
+              'state': Состояние шага,
+              'result': Результат выполнения,
+              'error': Текст ошибки или None,
+              'resumed': Шаг выполнен в прерванном запуске,
+              'lanes': Ресурсные полосы шага,
+              'timeout': Ограничение времени выполнения шага или None,
+              'interrupted': Причина прерывания шага или None,
+              'stats': Показатели затраченных ресурсов или None}, ...]
+        """
+        return [dict(name=step.name, state=step.state, result=step.result,
+                     error=str(step.error) if step.error is not None else None,
+                     resumed=step.resumed, lanes=step.lanes, timeout=step.timeout,
+                     interrupted=step.context.reason if step.context else None,
+                     stats=step.stats) for step in self.steps]
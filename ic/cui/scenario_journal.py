@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Журнал контрольных точек выполнения сценария.
+
+Журнал позволяет продолжить прерванную инсталляцию (режим --resume)
+с первого не выполненного шага.
+Файл журнала - текстовый файл, каждая строка которого
+JSON запись завершенного шага:
+{"name": <Идентификатор шага>,
+ "archive": <Идентификация инсталляционного файла (см. util.get_file_identity)>,
+ "time": <Время завершения>}
+Записи только добавляются в конец файла и сразу сбрасываются на диск,
+поэтому журнал остается корректным при аварийном завершении.
+"""
+
+import os
+import os.path
+import json
+import time
+import threading
+
+try:
+    from ..utils import log
+    from ..utils import util
+except Exception:
+    from ic.utils import log
+    from ic.utils import util
+
+__version__ = (0, 1, 1, 1)
+
+
+class icScenarioJournal:
+    """
+    Журнал контрольных точек выполнения сценария.
+    """
+    def __init__(self, sJournalFileName):
+        """
+        Конструктор.
+        @param sJournalFileName: Полное имя файла журнала.
+        """
+        self._journal_file_name = sJournalFileName
+        # Завершенные шаги {Идентификатор шага: Идентификация инсталляционного файла}
+        self._done_steps = None
+        self._lock = threading.Lock()
+
+    def get_journal_file_name(self):
+        """
+        Полное имя файла журнала.
+        """
+        return self._journal_file_name
+
+    def get_step_identity(self, step):
+        """
+        Идентификация входного архива шага сценария.
+        @param step: Шаг сценария.
+        """
+        return util.get_file_identity(util.get_programm_filename(step.kwargs))
+
+    def load(self):
+        """
+        Загрузить завершенные шаги из журнала.
+        @return: Словарь завершенных шагов.
+        """
+        self._done_steps = {}
+        if not os.path.exists(self._journal_file_name):
+            return self._done_steps
+
+        journal_file = None
+        try:
+            journal_file = open(self._journal_file_name, 'rt')
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Не дописанная при аварийном завершении запись
+                    log.warning(u'Журнал сценария. Не корректная запись <%s>' % line.strip())
+                    continue
+                self._done_steps[record['name']] = record.get('archive', None)
+            journal_file.close()
+            journal_file = None
+        except:
+            if journal_file:
+                journal_file.close()
+            log.fatal(u'Ошибка чтения журнала сценария <%s>' % self._journal_file_name)
+        return self._done_steps
+
+    def is_done_step(self, step):
+        """
+        Шаг уже выполнен с тем же инсталляционным файлом?
+        @param step: Шаг сценария.
+        @return: True/False.
+        """
+        if self._done_steps is None:
+            self.load()
+        if step.name not in self._done_steps:
+            return False
+        return self._done_steps[step.name] == self.get_step_identity(step)
+
+    def log_step(self, step):
+        """
+        Зарегистрировать завершенный шаг.
+        @param step: Шаг сценария.
+        @return: True/False.
+        """
+        record = dict(name=step.name, archive=self.get_step_identity(step), time=time.time())
+        journal_file = None
+        with self._lock:
+            try:
+                path = os.path.dirname(self._journal_file_name)
+                if path and not os.path.exists(path):
+                    os.makedirs(path)
+                journal_file = open(self._journal_file_name, 'at')
+                journal_file.write(json.dumps(record) + '\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+                journal_file.close()
+                journal_file = None
+                if self._done_steps is not None:
+                    self._done_steps[step.name] = record['archive']
+                return True
+            except:
+                if journal_file:
+                    journal_file.close()
+                log.fatal(u'Ошибка записи в журнал сценария <%s>' % self._journal_file_name)
+        return False
+
+    def clear(self):
+        """
+        Очистить журнал.
+        """
+        self._done_steps = {}
+        if os.path.exists(self._journal_file_name):
+            try:
+                os.remove(self._journal_file_name)
+                return True
+            except OSError:
+                log.fatal(u'Ошибка удаления журнала сценария <%s>' % self._journal_file_name)
+        return False
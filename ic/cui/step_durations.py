@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+База длительностей выполнения шагов сценария.
+
+Длительности предыдущих запусков используются для:
+    - вывода ориентировочного времени инсталляции на странице выбора программ;
+    - запуска в первую очередь самых длинных цепочек шагов
+      при параллельном выполнении сценария;
+    - предупреждения о шагах, выполняющихся значительно дольше обычного
+      (например, при деградации диска).
+
+Файл базы - JSON файл следующего формата:
+{<Имя программы>:<Размер архива>:<Время изменения архива>: {
+    'name': <Имя программы>,
+    'durations': [<Длительность выполнения шага в сек>, ...],
+    'write_bytes': <Объем записи последнего выполнения>,
+    'time': <Время последнего выполнения>}, ...}
+Хранятся длительности последних HISTORY_SIZE выполнений.
+Длительности шагов, которые ничего не выполнили (например, программа
+уже инсталлирована из того же архива, см. watchdog.mark_skipped),
+не регистрируются, т.к. занижают ориентировочное время.
+"""
+
+import os
+import os.path
+import json
+import time
+import threading
+
+try:
+    from ..utils import log
+    from ..utils import util
+except Exception:
+    from ic.utils import log
+    from ic.utils import util
+
+__version__ = (0, 1, 1, 1)
+
+# Количество хранимых длительностей выполнения шага
+HISTORY_SIZE = 5
+
+# Во сколько раз шаг должен выполняться дольше обычного для предупреждения
+SLOW_STEP_FACTOR = 3.0
+# Минимальная длительность шага (сек) для предупреждения
+MIN_SLOW_STEP_TIME = 5.0
+
+
+def format_duration(fSeconds):
+    """
+    Длительность в удобочитаемом виде.
+    @param fSeconds: Длительность в секундах.
+    """
+    if fSeconds is None:
+        return u'?'
+    seconds = int(round(fSeconds))
+    if seconds < 60:
+        return u'%d сек' % max(seconds, 1)
+    if seconds < 3600:
+        return u'%d мин %d сек' % (seconds // 60, seconds % 60)
+    return u'%d ч %d мин' % (seconds // 3600, seconds % 3600 // 60)
+
+
+def estimate_scenario_time(lDurations, iMaxWorkers=1):
+    """
+    Ориентировочное время выполнения набора шагов.
+    @param lDurations: Список длительностей шагов.
+    @param iMaxWorkers: Количество одновременно выполняемых шагов.
+    @return: Время в секундах. Для параллельного выполнения
+        время не меньше самого длинного шага.
+    """
+    durations = [duration for duration in lDurations if duration is not None]
+    if not durations:
+        return None
+    return max(max(durations), sum(durations) / max(int(iMaxWorkers or 1), 1))
+
+
+class icStepDurations:
+    """
+    База длительностей выполнения шагов сценария.
+    """
+    def __init__(self, sDurationsFileName):
+        """
+        Конструктор.
+        @param sDurationsFileName: Полное имя файла базы.
+        """
+        self._durations_file_name = sDurationsFileName
+        self._durations = None
+        self._lock = threading.RLock()
+
+    def get_durations_file_name(self):
+        """
+        Полное имя файла базы.
+        """
+        return self._durations_file_name
+
+    def load(self):
+        """
+        Загрузить базу.
+        """
+        with self._lock:
+            self._durations = {}
+            if os.path.exists(self._durations_file_name):
+                try:
+                    with open(self._durations_file_name, 'rt') as durations_file:
+                        self._durations = json.load(durations_file)
+                except:
+                    log.fatal(u'Ошибка загрузки базы длительностей шагов <%s>' % self._durations_file_name)
+            return self._durations
+
+    def save(self):
+        """
+        Сохранить базу.
+        """
+        with self._lock:
+            if self._durations is None:
+                return False
+            tmp_file_name = self._durations_file_name + '.tmp'
+            try:
+                path = os.path.dirname(self._durations_file_name)
+                if path and not os.path.exists(path):
+                    os.makedirs(path)
+                with open(tmp_file_name, 'wt') as durations_file:
+                    json.dump(self._durations, durations_file, indent=1)
+                os.replace(tmp_file_name, self._durations_file_name)
+                return True
+            except:
+                log.fatal(u'Ошибка сохранения базы длительностей шагов <%s>' % self._durations_file_name)
+        return False
+
+    def _get_durations(self):
+        if self._durations is None:
+            self.load()
+        return self._durations
+
+    def get_programm_key(self, sName, dProgramm):
+        """
+        Ключ записи базы.
+        @param sName: Имя программы (идентификатор шага).
+        @param dProgramm: Описание программы.
+        """
+        identity = util.get_file_identity(util.get_programm_filename(dProgramm)) if dProgramm else None
+        if identity is None:
+            return sName
+        return '%s:%s:%s' % (sName, identity['size'], identity['mtime'])
+
+    def get_estimate(self, sName, dProgramm=None):
+        """
+        Ориентировочная длительность выполнения шага.
+        Если архив программы изменился, то используются
+        длительности выполнения шага с другими архивами.
+        @param sName: Имя программы (идентификатор шага).
+        @param dProgramm: Описание программы.
+        @return: Длительность в секундах или None, если шаг еще не выполнялся.
+        """
+        with self._lock:
+            durations = self._get_durations()
+            record = durations.get(self.get_programm_key(sName, dProgramm), None)
+            if record:
+                step_durations = record['durations']
+            else:
+                step_durations = [duration for record in durations.values() if record.get('name', None) == sName
+                                  for duration in record['durations']]
+        if not step_durations:
+            return None
+        return sum(step_durations) / len(step_durations)
+
+    def get_step_estimate(self, step):
+        """
+        Ориентировочная длительность выполнения шага сценария.
+        @param step: Шаг сценария.
+        """
+        return self.get_estimate(step.name, step.kwargs)
+
+    def record_step(self, step):
+        """
+        Зарегистрировать длительность выполненного шага сценария.
+        @param step: Шаг сценария. Длительность берется из показателей шага.
+        @return: True/False.
+        """
+        if not step.stats:
+            return False
+        if getattr(step, 'context', None) is not None and step.context.skipped:
+            log.debug(u'Шаг <%s> ничего не выполнил. Длительность не регистрируется' % step.name)
+            return False
+        wall = step.stats['wall']
+        estimate = self.get_step_estimate(step)
+        if estimate and wall >= MIN_SLOW_STEP_TIME and wall > estimate * SLOW_STEP_FACTOR:
+            log.warning(u'Шаг <%s> выполнялся %s вместо обычных %s. Проверьте состояние диска' % (step.name,
+                                                                                              format_duration(wall),
+                                                                                              format_duration(estimate)))
+        key = self.get_programm_key(step.name, step.kwargs)
+        with self._lock:
+            durations = self._get_durations()
+            record = durations.setdefault(key, dict(name=step.name, durations=[]))
+            record['durations'] = (record['durations'] + [wall])[-HISTORY_SIZE:]
+            record['write_bytes'] = step.stats.get('write_bytes', None)
+            record['time'] = time.time()
+            return self.save()
@@ -7,132 +7,220 @@
 # --- Imports ---
 import os
 import os.path
-import shutil
 import time
+import threading
 
 try:
     from ..utils import log
     from ..utils import util
+    from ..utils import fingerprint
+    from ..utils import manifest
+    from ..utils import remove
+    from ..utils import trash
+    from ..utils import dedup
 except Exception:
     from ic.utils import log
     from ic.utils import util
+    from ic.utils import fingerprint
+    from ic.utils import manifest
+    from ic.utils import remove
+    from ic.utils import trash
+    from ic.utils import dedup
 
 __version__ = (0, 1, 1, 1)
 
 INSTALLATOR_SETTINGS_DIR = '.iccuiinstallator'
 INSTALL_LOG_FILE_NAME = 'install.log'
 UNINSTALL_LOG_FILE_NAME = 'uninstall.log'
+SCENARIO_JOURNAL_FILE_NAME = 'install.journal'
+STEP_DURATIONS_FILE_NAME = 'durations.json'
+INSTALL_REPORT_FILE_NAME = 'install_report.json'
+UNINSTALL_REPORT_FILE_NAME = 'uninstall_report.json'
 
 
 class icInstallLogManagerPrototype:
     """
     Прототип класса управления инсталляционным логом.
     """
-    def __init__(self, sInstallLogFileName=None):
+    def __init__(self, sInstallLogFileName=None, sRoot=None):
         """
         Конструктор.
         @param sInstallLogFileName: Имя файла инсталляционного лога.
+        @param sRoot: Корневая папка (chroot), в которую инсталлируются пакеты.
+            Пути пакетов в журнале корневой папки записываются относительно нее.
         """
         self._install_log_file_name = sInstallLogFileName
-        
+        self.root = os.path.normpath(sRoot) if sRoot else None
+        # Кеш отпечатков инсталлированных программ
+        self._fingerprint_cache = None
+        # Загруженные манифесты пакетов
+        self._package_manifests = {}
+        # Блокировка чтения/записи install.log шагами сценария,
+        # выполняемыми параллельно
+        self._lock = threading.RLock()
+
     def get_install_log_file_name(self):
         """
         Полное имя файла install.log.
         """
         return self._install_log_file_name
 
+    def get_root_path(self, sPath):
+        """
+        Путь пакета из журнала в файловой системе.
+        @param sPath: Путь пакета, записанный в журнале.
+            Для DEB пакетов это имя пакета, а не путь.
+        @return: Путь внутри корневой папки или sPath без изменений,
+            если корневая папка не задана.
+        """
+        if self.root and sPath and sPath.startswith(os.sep):
+            return os.path.normpath(os.path.join(self.root, sPath.lstrip(os.sep)))
+        return sPath
+
+    def get_log_path(self, sPath):
+        """
+        Путь пакета для записи в журнал.
+        @param sPath: Путь пакета в файловой системе.
+        @return: Путь относительно корневой папки или sPath без изменений,
+            если корневая папка не задана или путь вне ее.
+        """
+        root = self.root.rstrip(os.sep) if self.root else None
+        if root and sPath.startswith(root + os.sep):
+            return sPath[len(root):]
+        return sPath
+
+    def get_fingerprint_cache(self):
+        """
+        Кеш отпечатков инсталлированных программ.
+        Файл кеша располагается рядом с install.log.
+        """
+        with self._lock:
+            if self._fingerprint_cache is None:
+                cache_file_name = os.path.join(os.path.dirname(self.get_install_log_file_name()),
+                                               fingerprint.FINGERPRINT_CACHE_FILE_NAME)
+                self._fingerprint_cache = fingerprint.icFingerprintCache(cache_file_name)
+            return self._fingerprint_cache
+
+    def get_manifests_dir(self):
+        """
+        Папка манифестов инсталлированных пакетов.
+        Папка располагается рядом с install.log.
+        """
+        return os.path.join(os.path.dirname(self.get_install_log_file_name()), manifest.MANIFESTS_DIR_NAME)
+
+    def get_dedup_store_dir(self):
+        """
+        Папка хранилища содержимого файлов пакетов (см. dedup).
+        Папка располагается рядом с install.log.
+        """
+        return dedup.get_store_dir(os.path.dirname(self.get_install_log_file_name()))
+
+    def get_package_manifest_file_name(self, sPackageName):
+        """
+        Полное имя файла манифеста пакета.
+        @param sPackageName: Наименование пакета.
+        """
+        return manifest.get_manifest_file_name(self.get_manifests_dir(), sPackageName)
+
+    def save_package_manifest(self, sPackageName, Manifest, sBaseDir=None):
+        """
+        Сохранить манифест инсталлированного пакета.
+        @param sPackageName: Наименование пакета.
+        @param Manifest: Манифест пакета (manifest.icPackageManifest).
+        @param sBaseDir: Папка, в которую развернут пакет.
+        @return: True/False.
+        """
+        self._package_manifests.pop(sPackageName.strip(), None)
+        return Manifest.save(self.get_package_manifest_file_name(sPackageName), sBaseDir)
+
+    def get_package_manifest(self, sPackageName):
+        """
+        Манифест инсталлированного пакета.
+        Элементы манифеста загружаются при первом обращении к ним.
+        @param sPackageName: Наименование пакета.
+        @return: Объект manifest.icPackageManifest или None,
+            если манифест пакета не сохранен.
+        """
+        package_name = sPackageName.strip()
+        if package_name not in self._package_manifests:
+            manifest_file_name = self.get_package_manifest_file_name(package_name)
+            if not os.path.exists(manifest_file_name):
+                return None
+            self._package_manifests[package_name] = manifest.icPackageManifest(sFileName=manifest_file_name)
+        return self._package_manifests[package_name]
+
+    def del_package_manifest(self, sPackageName):
+        """
+        Удалить манифест пакета.
+        @param sPackageName: Наименование пакета.
+        @return: True - манифест удален, False - манифест не найден.
+        """
+        self._package_manifests.pop(sPackageName.strip(), None)
+        manifest_file_name = self.get_package_manifest_file_name(sPackageName)
+        if os.path.exists(manifest_file_name):
+            os.remove(manifest_file_name)
+            return True
+        return False
+
     def is_installed_package(self, sPackageName):
         """
         Проверить проинсталлированн ли уже пакет с указанным именем.
         @return: Возвращает True/False.
         """
-        install_log_file = None
-        try:
+        with self._lock:
             if not os.path.exists(self.get_install_log_file_name()):
                 log.warning(u'Файл <%s> не найден' % self.get_install_log_file_name())
                 return False
-            
-            install_log_file = open(self.get_install_log_file_name(), 'rt')
-            lines = install_log_file.readlines()
-            package_names = [line.split(';')[0].strip() for line in lines]
-            install_log_file.close()
-            install_log_file = None
+            return bool(sPackageName.strip() in self.load_packages())
 
-            return bool(sPackageName.strip() in package_names)
-        except:
-            if install_log_file:
-                install_log_file.close()
-            raise            
-        
     def _create_install_log_file(self, sInstallLogFileName=None):
         """
         Создание файла install.log.
         """
         if sInstallLogFileName is None:
             sInstallLogFileName = self.get_install_log_file_name()
-            
-        install_log_file = None
-        try:
+
+        with self._lock:
             if not os.path.exists(sInstallLogFileName):
                 path = os.path.dirname(sInstallLogFileName)
                 if not os.path.exists(path):
                     os.makedirs(path)
-                install_log_file = open(sInstallLogFileName, 'wt')
-                install_log_file.close()
-                install_log_file = None
+                with open(sInstallLogFileName, 'wt'):
+                    pass
                 log.info(u'Создан файл <%s>' % sInstallLogFileName)
                 return True
             return False
-        except:
-            if install_log_file:
-                install_log_file.close()
-            raise
-        
+
     def log_install_package(self, sPackageName, sPackagePath):
         """
         Зарегистрировать проинсталлированный пакет в логе.
+        Запись переустановленного пакета заменяется на том же месте.
         @param sPackageName: Наименование пакета.
         @param sPackagePath: Папка пакета.
         @return: Возвращает True/False.
         """
-        install_log_file = None
-        try:
+        with self._lock:
             if not os.path.exists(self.get_install_log_file_name()):
                 self._create_install_log_file()
+            packages = self.load_packages()
+            packages[sPackageName.strip()] = self.get_log_path(sPackagePath.strip())
+            return self._save_packages(packages)
 
-            install_log_file = open(self.get_install_log_file_name(), 'at')
-            install_log_file.write(sPackageName.strip()+' ; '+sPackagePath.strip()+'\n')
-            install_log_file.close()
-            return True
-        except:
-            if install_log_file:
-                install_log_file.close()
-            raise            
-        return False
-    
     def get_install_package_path(self, sPackageName):
         """
         Определить путь проинсталлированного пакета по его имени.
         @param sPackageName: Наименование пакета.
         @return: Возвращает путь до папки/файла происнталлированного пакета
-        или None в случае ошибки.
+        (внутри корневой папки, если она задана) или None в случае ошибки.
         """
-        install_log_file = None
-        try:
+        with self._lock:
             if not os.path.exists(self.get_install_log_file_name()):
                 log.warning(u'Файл <%s> не найден' % self.get_install_log_file_name())
                 return None
-            
-            install_log_file = open(self.get_install_log_file_name(), 'rt')
-            lines = install_log_file.readlines()
-            packages = dict([(line.split(';')[0].strip(), line.split(';')[1].strip()) for line in lines])
-            install_log_file.close()
-            install_log_file = None
-            return packages[sPackageName]
-        except:
-            if install_log_file:
-                install_log_file.close()
-            return None
+            try:
+                return self.get_root_path(self.load_packages()[sPackageName])
+            except:
+                return None
 
     def del_install_package(self, sPackageName):
         """
@@ -142,31 +230,22 @@ class icInstallLogManagerPrototype:
         @return: True-удаление прошло нормально,
         False-удаление по каким то причинам не прошло.
         """
-        install_log_file = None
-        try:
+        with self._lock:
             if not os.path.exists(self.get_install_log_file_name()):
                 log.warning(u'Файл <%s> не найден' % self.get_install_log_file_name())
                 return False
-            
-            install_log_file = open(self.get_install_log_file_name(), 'rt')
-            lines = install_log_file.readlines()
-            packages = dict([(line.split(';')[0].strip(), line.split(';')[1].strip()) for line in lines])
-            package_names = [line.split(';')[0].strip() for line in lines]
-            install_log_file.close()
-            install_log_file = None
-            
-            if sPackageName.strip() in package_names:
+
+            packages = self.load_packages()
+            if sPackageName.strip() in packages:
                 del packages[sPackageName.strip()]
                 return self._save_packages(packages)
             return False
-        except:
-            if install_log_file:
-                install_log_file.close()
-            raise            
-        
+
     def _save_packages(self, dPackagesDict):
         """
         Сохранить в логе пакеты, определенные словарем пакетов.
+        Запись производится через временный файл, чтобы
+        прерванная запись не испортила лог.
         @param dPackageDict: Словарь пакетов:
         {
         <Наименование пакета> : <Инсталляционная папка проинсталлированного пакета>,
@@ -174,19 +253,35 @@ class icInstallLogManagerPrototype:
         }
         @return: True/False.
         """
-        install_log_file = None
-        try:
-            install_log_file = open(self.get_install_log_file_name(), 'wt')
-            for package_name, package_path in dPackagesDict.items():
-                package_line = package_name+' ; '+package_path+'\n'
-                install_log_file.write(package_line)
-            install_log_file.close()
-            install_log_file = None
+        with self._lock:
+            tmp_file_name = self.get_install_log_file_name() + '.tmp'
+            with open(tmp_file_name, 'wt') as install_log_file:
+                for package_name, package_path in dPackagesDict.items():
+                    install_log_file.write(package_name+' ; '+package_path+'\n')
+            os.replace(tmp_file_name, self.get_install_log_file_name())
             return True
-        except:
-            if install_log_file:
-                install_log_file.close()
-            raise
+
+    def get_scenario_journal_file_name(self):
+        """
+        Полное имя файла журнала контрольных точек сценария инсталляции.
+        Журнал располагается в папке install.log.
+        """
+        return os.path.join(os.path.dirname(self.get_install_log_file_name()), SCENARIO_JOURNAL_FILE_NAME)
+
+    def get_step_durations_file_name(self):
+        """
+        Полное имя файла базы длительностей выполнения шагов сценария инсталляции.
+        База располагается в папке install.log.
+        """
+        return os.path.join(os.path.dirname(self.get_install_log_file_name()), STEP_DURATIONS_FILE_NAME)
+
+    def get_scenario_report_file_name(self, sReportFileName=INSTALL_REPORT_FILE_NAME):
+        """
+        Полное имя файла отчета о выполнении сценария.
+        Отчет располагается в папке install.log.
+        @param sReportFileName: Имя файла отчета.
+        """
+        return os.path.join(os.path.dirname(self.get_install_log_file_name()), sReportFileName)
 
     def gen_install_log_file_name(self):
         """
@@ -205,18 +300,10 @@ class icInstallLogManagerPrototype:
         }
         @return: True/False.
         """
-        install_log_file = None
-        try:
-            install_log_file = open(self.get_install_log_file_name(), 'rt')
-            lines = install_log_file.readlines()
-            packages = dict([(line.split(';')[0].strip(), line.split(';')[1].strip()) for line in lines])
-            install_log_file.close()
-            install_log_file = None
-            return packages
-        except:
-            if install_log_file:
-                install_log_file.close()
-            raise
+        with self._lock:
+            with open(self.get_install_log_file_name(), 'rt') as install_log_file:
+                lines = install_log_file.readlines()
+            return dict([(line.split(';')[0].strip(), line.split(';')[1].strip()) for line in lines if line.strip()])
 
 
 class icInstallLogManager(icInstallLogManagerPrototype):
@@ -265,16 +352,20 @@ class icUninstallLogManager(icInstallLogManagerPrototype):
     Менеджер удаляет из файла install.log запись деинсталлированного пакета.
     Записи в файл uninstall.log только могут добавляться.
     Удяляется файл uninstall.log вручную при необходимости.    
+    Папки деинсталлированных пакетов переносятся в корзину (см. trash).
     """
-    def __init__(self, sInstallLogFileName=None):
+    def __init__(self, sInstallLogFileName=None, bTrash=True, sRoot=None):
         """
         Конструктор.
         @param sInstallLogFileName; Имя файла инсталляционного лога.
+        @param bTrash: Переносить папки пакетов в корзину вместо удаления?
+        @param sRoot: Корневая папка (chroot), в которую инсталлированы пакеты.
         """
         if sInstallLogFileName is None:
             sInstallLogFileName = self.gen_install_log_file_name()
-        icInstallLogManagerPrototype.__init__(self, sInstallLogFileName)
-        
+        icInstallLogManagerPrototype.__init__(self, sInstallLogFileName, sRoot)
+        self.use_trash = bTrash
+
         self._uninstall_log_file_name = self.gen_uninstall_log_file_name()
         
     def gen_uninstall_log_file_name(self):
@@ -308,10 +399,16 @@ class icUninstallLogManager(icInstallLogManagerPrototype):
             # Если пакет с таким наименованием точно был проинсталлирован,
             # то удалить его из списка
             self.del_install_package(sPackageName)
+            fingerprint_cache = self.get_fingerprint_cache()
+            archive_fingerprint = fingerprint_cache.get_programm_archive_fingerprint(sPackageName)
+            fingerprint_cache.remove(sPackageName)
             
             # удалить инсталляционную папку/файл физически
-            self._del_package(sPackageName, install_path)
-            
+            self._del_package(sPackageName, install_path, archive_fingerprint)
+            self.del_package_manifest(sPackageName)
+            # Объекты хранилища, на которые не осталось ссылок
+            dedup.purge_store(self.get_dedup_store_dir())
+
             # и прописать деинсталлированный пакет в логе uninstall.log
             return self._log_uninstall_package(sPackageName, install_path)
         return False
@@ -341,19 +438,23 @@ class icUninstallLogManager(icInstallLogManagerPrototype):
                 uninstall_log_file.close()
             raise
 
-    def _del_package_path(self, sPackagePath):
+    def _del_package_path(self, sPackagePath, Manifest=None):
         """
         Удаление инсталляционной папки пакета физически.
         @param sPackagePath: Инсталляционная папка/файл пакета.
+        @param Manifest: Манифест пакета (manifest.icPackageManifest).
+            Если указан, то удаляются только файлы пакета (см. remove),
+            иначе папка пакета удаляется целиком.
         @return: True-все ок, False-удаление не произошло по какой-то причине.
         """
         try:
+            if Manifest is not None:
+                return remove.remove_manifest_files(Manifest).is_ok()
             if not sPackagePath:
                 return False
             path=os.path.normpath(sPackagePath)
-            if os.path.exists(path):
-                shutil.rmtree(path, 1)
-                return True
+            if os.path.lexists(path):
+                return remove.remove_tree(path).is_ok()
             return False
         except:
             log.error(u'Ошибка удаления директории <%s>' % sPackagePath)
@@ -367,16 +468,85 @@ class icUninstallLogManager(icInstallLogManagerPrototype):
         """
         return sPackageName[-4:].lower() == '.deb'
     
-    def _del_package(self, sPackageName, sInstallDir):
+    def _trash_package(self, sPackageName, sInstallDir, dArchiveFingerprint=None):
+        """
+        Перенести папку пакета в корзину.
+        Файлы пакета вне папки пакета удаляются по манифесту.
+        Папка пакета, в которой есть файлы, не принадлежащие пакету
+        (например, данные пользователя), в корзину не переносится,
+        т.к. корзина очищается удалением элементов целиком.
+        @param sPackageName: Имя пакета.
+        @param sInstallDir: Папка инсталяции пакета.
+        @param dArchiveFingerprint: Отпечаток архива, из которого установлен пакет.
+        @return: True - папка перенесена в корзину, False - перенос не возможен.
+        """
+        package_path = os.path.normpath(sInstallDir)
+        package_manifest = self.get_package_manifest(sPackageName)
+        outside_entries = []
+        size = None
+        if package_manifest is not None:
+            foreign_paths = remove.get_foreign_paths(package_manifest, package_path)
+            if foreign_paths:
+                log.warning(u'Пакет <%s> не переносится в корзину. Файлы, не принадлежащие пакету: %s' % (sPackageName,
+                                                                                                       foreign_paths))
+                return False
+            entries = package_manifest.get_entries()
+            size = sum([entry.size for entry in entries])
+            rel_path = os.path.relpath(package_path, package_manifest.base_dir)
+            if rel_path != os.curdir:
+                outside_entries = [entry for entry in entries
+                                   if entry.path != rel_path and not entry.path.startswith(rel_path + os.sep)]
+        item_path = trash.move_to_trash(sPackageName, package_path, dArchiveFingerprint,
+                                        self.get_package_manifest_file_name(sPackageName), size,
+                                        not outside_entries)
+        if item_path is None:
+            return False
+        if outside_entries:
+            # Файлы папки пакета уже в корзине и считаются отсутствующими
+            remove.remove_manifest_files(package_manifest)
+        trash.purge_background(trash.get_trash_dir(package_path))
+        return True
+
+    def _del_package(self, sPackageName, sInstallDir, dArchiveFingerprint=None):
         """
         Удалить пакет.
         @param dPackageName: Имя пакета.
         @param sInstallDir: Папка инсталяции пакета.
+        @param dArchiveFingerprint: Отпечаток архива, из которого установлен пакет.
+            Сохраняется в корзине для восстановления пакета при повторной инсталляции.
         @return: True-все ок, False-удаление не произошло по какой-то причине.
         """
         if self._is_deb_package(sPackageName):
             # Это дебианский пакет  и удаление здесь не пойдет
-            return util.deb_pkg_uninstall(sInstallDir)
+            return util.deb_pkg_uninstall(sInstallDir, self.root)
+        elif self.use_trash and sInstallDir and self._trash_package(sPackageName, sInstallDir, dArchiveFingerprint):
+            return True
         else:
-            # Это обычная программа и тогда просто удаляем инсталяционную папку
-            return self._del_package_path(sInstallDir)
+            # Это обычная программа. Удаляем файлы пакета по манифесту
+            # или инсталяционную папку целиком, если манифеста нет
+            return self._del_package_path(sInstallDir, self.get_package_manifest(sPackageName))
+
+
+def get_installed_programms(InstallLogManager, lProgramms=None):
+    """
+    Список описаний проинсталлированных программ для деинсталляции.
+    @param InstallLogManager: Регистратор инсталлированных пакетов.
+    @param lProgramms: Описание инсталлируемых/деинсталлируемых программ.
+    @return: Список описаний программ, зарегистрированных в install.log:
+        [{'programm': Наименование пакета,
+          'dir': Инсталляционная папка,
+          'description': Описание,
+          'script': Скрипт деинсталляции,
+          'check': Отметка деинсталляции}, ...]
+    """
+    packages = InstallLogManager.load_packages()
+    programms = []
+    if packages:
+        dProgramms = dict([(prg.get('programm', prg.get('name', '-')),
+                            prg) for prg in lProgramms]) if lProgramms else {}
+        programms = [{'programm': package_name,
+                      'dir': package_dir,
+                      'description': dProgramms.get(package_name, {}).get('description', ''),
+                      'script': dProgramms.get(package_name, {}).get('script', None),
+                      'check': dProgramms.get(package_name, {}).get('check', True)} for package_name, package_dir in packages.items()]
+    return programms
@@ -9,6 +9,7 @@ from . import cui_dialog
 from . import urwid_dialog
 from . import pydlg_dialog
 from . import wizard_page
+from . import uninstall_manager
 
 try:
     from ..utils import util
@@ -114,16 +115,7 @@ def add_wizard_programm_uninstall_page(Wizard, lProgramms, *args, **kwargs):
     @param lProgramms; Описание инсталлируемы/Деинсталлируемых программ.
     @return: Созданный объект страницы или None в случае ошибки.
     """
-    packages = Wizard.getInstallLogManager().load_packages()
-    programms = []
-    if packages:
-        dProgramms = dict([(prg.get('programm', prg.get('name', '-')),
-                            prg) for prg in lProgramms]) if lProgramms else {}
-        programms = [{'programm': package_name,
-                      'dir': package_dir,
-                      'description': dProgramms.get(package_name, {}).get('description', ''),
-                      'script': dProgramms.get(package_name, {}).get('script', None),
-                      'check': dProgramms.get(package_name, {}).get('check', True)} for package_name, package_dir in packages.items()]
+    programms = uninstall_manager.get_installed_programms(Wizard.getInstallLogManager(), lProgramms)
     page = icProgrammUninstallPage(Wizard, u'Программы', programms, *args, **kwargs)
     Wizard.appendPage(page)
     return page    
@@ -5,12 +5,26 @@
 Консольный визард.
 """
 
+import time
+
 try:
     from .... import config
     from ..utils import log
+    from ..utils import utils
+    from ..utils import instrument
+    from . import scenario_executor
+    from . import scenario_journal
+    from . import step_durations
+    from . import multi_root
 except Exception:
     import config
     from ic.utils import log
+    from ic.utils import utils
+    from ic.utils import instrument
+    from ic.cui import scenario_executor
+    from ic.cui import scenario_journal
+    from ic.cui import step_durations
+    from ic.cui import multi_root
 
 __version__ = (0, 1, 1, 1)
 
@@ -38,6 +52,20 @@ class icCUIWizard:
         self.scenario = []
         # Альтернативная функция обработка сценариев
         self.do_scenario = None
+        # Общий результат выполнения сценария
+        self.scenario_result = None
+        # Результаты выполнения шагов сценария
+        self.scenario_results = []
+        # Журнал контрольных точек выполнения сценария
+        self.scenario_journal = None
+        # Результат проверки установленных пакетов
+        self.packages_result = None
+        self.packages = []
+        # База длительностей выполнения шагов сценария
+        self.scenario_durations = None
+        # Полное имя файла отчета о выполнении сценария.
+        # Если не определено, то отчет не сохраняется
+        self.scenario_report_filename = None
 
     def _initPage(self, Page):
         """
@@ -132,10 +160,13 @@ class icCUIWizard:
             [(Идентификатор,
             Функция обработки шага сценария,
             Аргументы,
-            Именованные аргументы),
+            Именованные аргументы,
+            Вкл.),
             ...]
             Исполнение сценария запускается по кнопке 
             <OK> на последней странице визарда.
+            Порядок выполнения шагов определяется ключами 'depends'/'after'
+            именованных аргументов шага (см. scenario_executor).
         """
         if lScenario is None:
             lScenario = self.scenario
@@ -144,28 +175,132 @@ class icCUIWizard:
         if self.do_scenario:
             return self.do_scenario(lScenario)
         else:
-            result = True
-            # обработка сценария по шагам
-            for step in lScenario:
-                if step:
-                    id = step[0]
-                    func = step[1]
-                    args = step[2]
-                    kwargs = step[3]
-                    enable = step[4]
-                    if func and enable:
-                        try:
-                            log.info(u'Выполнение сценария %s args: %s kwargs: %s' % (func.__name__, args, kwargs))
-                            step_result = func(*args, **kwargs)
-                        except:
-                            log.fatal(u'Ошибка выполнения функции сценария <%s>' % func)
-                            step_result = False
-                            if config.DEBUG_MODE:
-                                raise
-                        
-                        result = result and step_result
-            return result
+            # Шаги выполняются с учетом зависимостей 'depends'/'after'.
+            # Независимые шаги выполняются параллельно
+            executor = self.createScenarioExecutor(self.prepareScenario(lScenario))
+            start_time = time.time()
+            try:
+                self.scenario_result = executor.run()
+                return self.scenario_result
+            finally:
+                self.scenario_results = executor.get_step_results()
+                self.saveScenarioReport(executor.get_result(), start_time)
+
+    def setPackagesCheck(self, bResult, lPackages=None):
+        """
+        Запомнить результат проверки установленных пакетов.
+        @param bResult: Общий результат проверки.
+        @param lPackages: Результаты проверки пакетов. Список словарей
+            [{'name': ..., 'ver': ..., 'result': ...}, ...] или
+            плоский список [Имя, Версия, Результат, ...] (см. util.check_packages).
+        """
+        packages = list(lPackages or [])
+        if packages and not isinstance(packages[0], dict):
+            packages = [dict(name=packages[i], ver=packages[i + 1], result=packages[i + 2])
+                        for i in range(0, len(packages), 3)]
+        self.packages_result = bResult
+        self.packages = packages
+
+    def prepareScenario(self, lScenario):
+        """
+        Подготовка сценария к выполнению.
+        Если заданы корневые папки инсталляции (INSTALL_ROOTS),
+        то сценарий переписывается для каждой из них.
+        @param lScenario: Сценарий-список шагов сценария.
+        @return: Сценарий для выполнения.
+        """
+        roots = utils.get_var('INSTALL_ROOTS')
+        if roots:
+            return multi_root.rewrite_scenario(lScenario, roots)
+        return lScenario
+
+    def getInstallLogManager(self):
+        """
+        Регистратор-менеджер инсталляции.
+        Переопределяется в наследниках.
+        """
+        return None
+
+    def createScenarioDurations(self):
+        """
+        Создать базу длительностей выполнения шагов сценария инсталляции.
+        База располагается в папке install.log.
+        """
+        durations_filename = self.getInstallLogManager().get_step_durations_file_name()
+        self.scenario_durations = step_durations.icStepDurations(durations_filename)
+        return self.scenario_durations
+
+    def createScenarioJournal(self):
+        """
+        Создать журнал контрольных точек сценария инсталляции.
+        Журнал располагается в папке install.log.
+        """
+        journal_filename = self.getInstallLogManager().get_scenario_journal_file_name()
+        self.scenario_journal = scenario_journal.icScenarioJournal(journal_filename)
+        return self.scenario_journal
+
+    def createScenarioExecutor(self, lScenario):
+        """
+        Создать исполнителя сценария.
+        @param lScenario: Сценарий-список шагов сценария.
+        """
+        max_workers = utils.get_var('SCENARIO_THREADS') or scenario_executor.DEFAULT_MAX_WORKERS
+        io_lane_limit = utils.get_var('SCENARIO_IO_LANE_LIMIT') or scenario_executor.DEFAULT_IO_LANE_LIMIT
+        return scenario_executor.icScenarioExecutor(lScenario, iMaxWorkers=max_workers,
+                                                    bRaiseError=config.DEBUG_MODE,
+                                                    iIOLaneLimit=io_lane_limit,
+                                                    dLaneLimits=utils.get_var('SCENARIO_LANE_LIMITS'),
+                                                    Journal=self.getScenarioJournal(),
+                                                    bResume=bool(utils.get_var('SCENARIO_RESUME')),
+                                                    Durations=self.getScenarioDurations(),
+                                                    fStepTimeout=utils.get_var('SCENARIO_STEP_TIMEOUT'))
+
+    def getScenarioJournal(self):
+        """
+        Журнал контрольных точек выполнения сценария.
+        @return: Объект журнала или None, если журнал не ведется.
+        """
+        return self.scenario_journal
         
+    def getScenarioDurations(self):
+        """
+        База длительностей выполнения шагов сценария.
+        @return: Объект базы или None, если длительности не регистрируются.
+        """
+        return self.scenario_durations
+
+    def getStepEstimate(self, sName, dProgramm=None):
+        """
+        Ориентировочная длительность выполнения шага сценария.
+        @param sName: Идентификатор шага.
+        @param dProgramm: Описание программы шага.
+        @return: Длительность в секундах или None, если не известна.
+        """
+        if self.scenario_durations is None:
+            return None
+        return self.scenario_durations.get_estimate(sName, dProgramm)
+
+    def saveScenarioReport(self, bResult=None, fStartTime=None):
+        """
+        Сохранить отчет о выполнении шагов сценария с показателями
+        затраченных ресурсов в JSON файл.
+        @param bResult: Общий результат выполнения сценария.
+        @param fStartTime: Время запуска сценария.
+        @return: True/False.
+        """
+        if not self.scenario_report_filename:
+            return False
+        report = dict(title=self.title, result=bResult, start=fStartTime,
+                      time=time.time() - fStartTime if fStartTime is not None else None,
+                      steps=self.scenario_results)
+        return instrument.save_report(self.scenario_report_filename, report)
+
+    def getScenarioSummary(self):
+        """
+        Сводная таблица показателей выполнения шагов сценария в текстовом виде.
+        """
+        return instrument.format_summary_table([step for step in self.scenario_results if step.get('stats', None)])
+
     def addScenarioScript(self, sName, fFunc, tArgs, dKWArgs, bEnable=True):
         """
         Добавить скрипт сценария в  сценария.
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Определение формата инсталляционных пакетов.
+
+Формат определяется по сигнатуре (magic bytes) начала файла,
+а если файл не доступен или сигнатура не известна - по расширению имени.
+
+Реестр форматов FORMATS:
+{<Имя формата>: {'kind': <Вид пакета: 'tar', 'zip' или 'deb'>,
+                 'codec': <Способ сжатия tar архива (см. decompress) или None>,
+                 'ext': <Кортеж расширений имени файла>}, ...}
+Сигнатуры форматов MAGICS: [(<Смещение>, <Байты сигнатуры>, <Имя формата>), ...].
+Сигнатуры проверяются по порядку. Сигнатура tar проверяется последней,
+т.к. она находится не в начале файла.
+"""
+
+import os.path
+
+__version__ = (0, 1, 1, 1)
+
+# Виды пакетов
+TAR_KIND = 'tar'
+ZIP_KIND = 'zip'
+DEB_KIND = 'deb'
+
+# Способы сжатия tar архивов
+GZIP_CODEC = 'gzip'
+XZ_CODEC = 'xz'
+BZIP2_CODEC = 'bzip2'
+ZSTD_CODEC = 'zstd'
+LZ4_CODEC = 'lz4'
+
+# Форматы пакетов
+TAR_FORMAT = 'tar'
+TAR_GZ_FORMAT = 'tar.gz'
+TAR_XZ_FORMAT = 'tar.xz'
+TAR_BZ2_FORMAT = 'tar.bz2'
+TAR_ZST_FORMAT = 'tar.zst'
+TAR_LZ4_FORMAT = 'tar.lz4'
+ZIP_FORMAT = 'zip'
+DEB_FORMAT = 'deb'
+
+FORMATS = {
+    TAR_FORMAT: dict(kind=TAR_KIND, codec=None, ext=('.tar',)),
+    TAR_GZ_FORMAT: dict(kind=TAR_KIND, codec=GZIP_CODEC, ext=('.tar.gz', '.tgz')),
+    TAR_XZ_FORMAT: dict(kind=TAR_KIND, codec=XZ_CODEC, ext=('.tar.xz', '.txz')),
+    TAR_BZ2_FORMAT: dict(kind=TAR_KIND, codec=BZIP2_CODEC, ext=('.tar.bz2', '.tbz2', '.tbz')),
+    TAR_ZST_FORMAT: dict(kind=TAR_KIND, codec=ZSTD_CODEC, ext=('.tar.zst', '.tzst')),
+    TAR_LZ4_FORMAT: dict(kind=TAR_KIND, codec=LZ4_CODEC, ext=('.tar.lz4',)),
+    ZIP_FORMAT: dict(kind=ZIP_KIND, codec=None, ext=('.zip',)),
+    DEB_FORMAT: dict(kind=DEB_KIND, codec=None, ext=('.deb',)),
+}
+
+MAGICS = (
+    (0, b'!<arch>\ndebian-binary', DEB_FORMAT),
+    (0, b'PK\x03\x04', ZIP_FORMAT),
+    # Пустой zip архив
+    (0, b'PK\x05\x06', ZIP_FORMAT),
+    (0, b'\x1f\x8b', TAR_GZ_FORMAT),
+    (0, b'\xfd7zXZ\x00', TAR_XZ_FORMAT),
+    (0, b'BZh', TAR_BZ2_FORMAT),
+    (0, b'\x28\xb5\x2f\xfd', TAR_ZST_FORMAT),
+    (0, b'\x04\x22\x4d\x18', TAR_LZ4_FORMAT),
+    (257, b'ustar', TAR_FORMAT),
+)
+
+# Количество байт начала файла, достаточное для проверки всех сигнатур
+MAGIC_SIZE = 512
+
+
+def get_archive_extensions():
+    """
+    Кортеж расширений имен файлов архивов, разворачиваемых в папку (tar и zip).
+    """
+    return tuple([ext for archive_format in FORMATS.values()
+                  if archive_format['kind'] in (TAR_KIND, ZIP_KIND) for ext in archive_format['ext']])
+
+
+def detect_format_by_magic(sHeader):
+    """
+    Определить формат по сигнатуре.
+    @param sHeader: Байты начала файла.
+    @return: Имя формата или None, если формат не определен.
+    """
+    for offset, magic, format_name in MAGICS:
+        if sHeader[offset:offset + len(magic)] == magic:
+            return format_name
+    return None
+
+
+def detect_format_by_name(sFileName):
+    """
+    Определить формат по расширению имени файла.
+    @param sFileName: Имя файла.
+    @return: Имя формата или None, если формат не определен.
+    """
+    file_name = (sFileName or '').lower()
+    for format_name, archive_format in FORMATS.items():
+        if file_name.endswith(archive_format['ext']):
+            return format_name
+    return None
+
+
+def detect_format(sFileName):
+    """
+    Определить формат файла пакета.
+    Сначала проверяется сигнатура содержимого, затем расширение имени.
+    @param sFileName: Полное имя файла.
+    @return: Имя формата или None, если формат не определен.
+    """
+    if sFileName and os.path.isfile(sFileName):
+        try:
+            with open(sFileName, 'rb') as package_file:
+                format_name = detect_format_by_magic(package_file.read(MAGIC_SIZE))
+            if format_name:
+                return format_name
+        except OSError:
+            pass
+    return detect_format_by_name(sFileName)
+
+
+def get_format_kind(sFormatName):
+    """
+    Вид пакета формата: 'tar', 'zip', 'deb' или None.
+    """
+    return FORMATS[sFormatName]['kind'] if sFormatName in FORMATS else None
+
+
+def get_format_codec(sFormatName):
+    """
+    Способ сжатия tar архива формата или None.
+    """
+    return FORMATS[sFormatName]['codec'] if sFormatName in FORMATS else None
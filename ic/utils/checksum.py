@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Контроль целостности инсталляционных архивов.
+
+Контрольная сумма архива указывается в описании программы
+(config.PROGRAMM) ключом с именем алгоритма хеширования:
+    'sha256': <Контрольная сумма SHA-256 в шестнадцатеричном виде>
+или
+    'blake2b': <Контрольная сумма BLAKE2b в шестнадцатеричном виде>
+Контрольная сумма вычисляется в том же потоковом чтении архива,
+из которого выполняется разархивирование (см. icHashingReader),
+без дополнительного чтения файла.
+Файлы, которые не разархивируются (DEB пакеты), проверяются
+отдельным чтением до установки (см. icChecksum.check_file).
+"""
+
+import hashlib
+
+__version__ = (0, 1, 1, 1)
+
+# Поддерживаемые алгоритмы хеширования в порядке проверки ключей описания программы
+CHECKSUM_ALGORITHMS = ('sha256', 'blake2b')
+
+# Размер блока дочитывания архива
+DRAIN_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class icChecksum:
+    """
+    Ожидаемая контрольная сумма архива.
+    """
+    def __init__(self, sAlgorithm, sHexDigest):
+        """
+        Конструктор.
+        @param sAlgorithm: Имя алгоритма хеширования.
+        @param sHexDigest: Контрольная сумма в шестнадцатеричном виде.
+        """
+        self.algorithm = sAlgorithm
+        self.hexdigest = sHexDigest.strip().lower()
+
+    def create_hash(self):
+        """
+        Создать объект вычисления контрольной суммы.
+        """
+        return hashlib.new(self.algorithm)
+
+    def create_reader(self, src_file):
+        """
+        Создать объект чтения файла с вычислением контрольной суммы.
+        @param src_file: Файловый объект источника.
+        """
+        return icHashingReader(src_file, self.create_hash())
+
+    def is_valid(self, hash_obj):
+        """
+        Вычисленная контрольная сумма совпадает с ожидаемой?
+        @param hash_obj: Объект вычисления контрольной суммы или icHashingReader.
+        """
+        if isinstance(hash_obj, icHashingReader):
+            hash_obj = hash_obj.hash
+        return hash_obj.hexdigest() == self.hexdigest
+
+    def check_file(self, sFileName):
+        """
+        Проверить контрольную сумму файла, который не разархивируется
+        (например, DEB пакет), отдельным чтением файла.
+        @param sFileName: Полное имя файла.
+        @return: True - контрольная сумма совпадает, False - нет.
+        """
+        with open(sFileName, 'rb') as src_file:
+            reader = self.create_reader(src_file)
+            reader.drain()
+        return self.is_valid(reader)
+
+    def __str__(self):
+        return '%s:%s' % (self.algorithm, self.hexdigest)
+
+
+class icHashingReader:
+    """
+    Чтение файла с вычислением контрольной суммы прочитанных данных.
+    """
+    def __init__(self, src_file, hash_obj):
+        """
+        Конструктор.
+        @param src_file: Файловый объект источника.
+        @param hash_obj: Объект вычисления контрольной суммы (hashlib).
+        """
+        self._file = src_file
+        self.hash = hash_obj
+        self.size = 0
+
+    def read(self, iSize=-1):
+        data = self._file.read(iSize)
+        if data:
+            self.hash.update(data)
+            self.size += len(data)
+        return data
+
+    def readinto(self, buffer):
+        count = self._file.readinto(buffer)
+        if count:
+            self.hash.update(memoryview(buffer)[:count])
+            self.size += count
+        return count
+
+    def readable(self):
+        return True
+
+    def drain(self):
+        """
+        Дочитать файл до конца.
+        Разархивирование может завершиться раньше конца файла
+        (например, выравнивание в конце tar архива), но контрольная сумма
+        вычисляется по всему файлу.
+        """
+        while self.read(DRAIN_BLOCK_SIZE):
+            pass
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+
+def get_programm_checksum(dProgramm):
+    """
+    Ожидаемая контрольная сумма архива программы.
+    @param dProgramm: Описание программы.
+    @return: Объект icChecksum или None, если контрольная сумма не указана.
+    """
+    for algorithm in CHECKSUM_ALGORITHMS:
+        if dProgramm and dProgramm.get(algorithm, None):
+            return icChecksum(algorithm, dProgramm[algorithm])
+    return None
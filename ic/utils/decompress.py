@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Распаковка сжатых инсталляционных архивов.
+
+Поддерживаемые способы сжатия (codec): gzip, xz, bzip2, zstd, lz4
+(см. open_stream). zstd и lz4 распаковываются модулями zstandard и lz4,
+если они установлены, иначе внешними программами zstd и lz4.
+
+Поддерживаемые способы (backend) распаковки gzip:
+    'builtin' - модуль gzip в потоке разархивирования. Одно ядро;
+    'pigz' - внешняя программа параллельной распаковки pigz,
+        если она установлена в системе;
+    'bgzf' - параллельная распаковка блоков в пуле потоков.
+        Применяется для gzip файлов из множества независимых блоков
+        с указанием размера блока в заголовке (формат BGZF, bgzip);
+    'pipelined' - распаковка в одном отдельном потоке параллельно с разбором
+        архива и записью файлов. gzip блоки (members) распаковываются
+        последовательно, поэтому используется не больше одного
+        дополнительного ядра. Выбирается только явно
+        ('threaded' - прежнее имя способа).
+Если способ не указан явно, то он выбирается автоматически
+по размеру архива и количеству ядер процессора: pigz, если программа
+установлена, bgzf для файлов BGZF, иначе builtin.
+"""
+
+import os
+import os.path
+import gzip
+import zlib
+import lzma
+import bz2
+import queue
+import shutil
+import struct
+import threading
+import subprocess
+import collections
+import concurrent.futures
+
+from . import log
+from . import watchdog
+from . import archive_format
+
+__version__ = (0, 1, 1, 1)
+
+BUILTIN_BACKEND = 'builtin'
+PIGZ_BACKEND = 'pigz'
+BGZF_BACKEND = 'bgzf'
+PIPELINED_BACKEND = 'pipelined'
+# Прежнее имя способа PIPELINED_BACKEND
+THREADED_BACKEND = 'threaded'
+
+BACKENDS = (BUILTIN_BACKEND, PIGZ_BACKEND, BGZF_BACKEND, PIPELINED_BACKEND)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Минимальный размер архива для многопоточной распаковки
+PARALLEL_MIN_SIZE = 16 * 1024 * 1024
+
+# Размер блока чтения сжатых данных
+READ_BLOCK_SIZE = 1024 * 1024
+# Максимальное количество распакованных блоков в очереди
+QUEUE_SIZE = 16
+
+# Программа параллельной распаковки
+PIGZ_PROGRAMM = 'pigz'
+# Программы распаковки zstd и lz4, если не установлены модули Python
+ZSTD_PROGRAMM = 'zstd'
+LZ4_PROGRAMM = 'lz4'
+
+# Флаг наличия дополнительного поля в заголовке gzip
+GZIP_FEXTRA = 4
+
+
+def get_pigz_programm():
+    """
+    Полное имя программы pigz или None, если она не установлена.
+    """
+    return shutil.which(PIGZ_PROGRAMM)
+
+
+def is_gzip_file(sFileName):
+    """
+    Файл сжат gzip?
+    """
+    with open(sFileName, 'rb') as gzip_file:
+        return gzip_file.read(2) == GZIP_MAGIC
+
+
+def _get_bgzf_block_size(sHeader):
+    """
+    Размер блока BGZF по заголовку gzip блока.
+    @param sHeader: Байты начала блока (заголовок вместе с дополнительным полем).
+    @return: Полный размер блока в байтах или None, если это не блок BGZF.
+    """
+    if len(sHeader) < 12 or sHeader[:2] != GZIP_MAGIC or not sHeader[3] & GZIP_FEXTRA:
+        return None
+    xlen = struct.unpack('<H', sHeader[10:12])[0]
+    extra = sHeader[12:12 + xlen]
+    pos = 0
+    while pos + 4 <= len(extra):
+        slen = struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+        if extra[pos:pos + 2] == b'BC' and slen == 2:
+            return struct.unpack('<H', extra[pos + 4:pos + 6])[0] + 1
+        pos += 4 + slen
+    return None
+
+
+def is_bgzf_file(sFileName):
+    """
+    Файл в формате BGZF (gzip из независимых блоков с указанием размеров)?
+    """
+    with open(sFileName, 'rb') as gzip_file:
+        return _get_bgzf_block_size(gzip_file.read(64)) is not None
+
+
+def choose_backend(sFileName, iCPUCount=None):
+    """
+    Выбор способа распаковки gzip архива.
+    @param sFileName: Полное имя архива.
+    @param iCPUCount: Количество ядер. Если не указано, то определяется автоматически.
+    @return: Имя способа распаковки.
+    """
+    cpu_count = iCPUCount or os.cpu_count() or 1
+    if cpu_count < 2 or os.path.getsize(sFileName) < PARALLEL_MIN_SIZE:
+        return BUILTIN_BACKEND
+    if get_pigz_programm():
+        return PIGZ_BACKEND
+    if is_bgzf_file(sFileName):
+        return BGZF_BACKEND
+    # Границы gzip блоков без указания размеров не известны до распаковки,
+    # поэтому параллельная распаковка таких файлов не возможна
+    return BUILTIN_BACKEND
+
+
+class icDecompressStream:
+    """
+    Базовый класс потока распакованных данных.
+    Подклассы реализуют метод _read_chunk.
+    """
+    def __init__(self):
+        self._buffer = b''
+        self._eof = False
+
+    def _read_chunk(self):
+        """
+        Очередной блок распакованных данных. Пустой блок - конец данных.
+        """
+        return b''
+
+    def read(self, iSize=-1):
+        """
+        Прочитать распакованные данные.
+        @param iSize: Количество байт. -1 - все оставшиеся данные.
+        """
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while not self._eof and (iSize < 0 or length < iSize):
+            chunk = self._read_chunk()
+            if not chunk:
+                self._eof = True
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+        data = b''.join(chunks)
+        if iSize < 0:
+            self._buffer = b''
+            return data
+        self._buffer = data[iSize:]
+        return data[:iSize]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class icProcessStream(icDecompressStream):
+    """
+    Распаковка внешней программой.
+    Программа должна выводить распакованные данные в stdout.
+    Сжатые данные передаются программе именем файла в команде
+    или через stdin из файлового объекта источника.
+    Процесс регистрируется в контексте шага сценария (см. watchdog).
+    """
+    def __init__(self, lCommand, SourceFile=None):
+        """
+        Конструктор.
+        @param lCommand: Команда запуска программы распаковки в виде списка.
+        @param SourceFile: Файловый объект источника сжатых данных.
+            Если не указан, то имя файла должно быть в команде.
+        """
+        icDecompressStream.__init__(self)
+        self._command = lCommand
+        self._source_file = SourceFile
+        self._feeder = None
+        stdin = subprocess.PIPE if SourceFile is not None else subprocess.DEVNULL
+        self._process = watchdog.popen(lCommand, shell=False, stdin=stdin, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, bufsize=READ_BLOCK_SIZE)
+        if SourceFile is not None:
+            self._feeder = threading.Thread(target=self._feed, daemon=True)
+            self._feeder.start()
+
+    def _feed(self):
+        """
+        Передача сжатых данных программе распаковки.
+        """
+        try:
+            data = self._source_file.read(READ_BLOCK_SIZE)
+            while data:
+                self._process.stdin.write(data)
+                data = self._source_file.read(READ_BLOCK_SIZE)
+        except (BrokenPipeError, ValueError, OSError):
+            # Программа распаковки завершена
+            pass
+        finally:
+            try:
+                self._process.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+
+    def _read_chunk(self):
+        chunk = self._process.stdout.read(READ_BLOCK_SIZE)
+        if not chunk:
+            self._check()
+        return chunk
+
+    def _check(self):
+        return_code = self._process.wait()
+        if return_code:
+            error = self._process.stderr.read().decode('utf-8', 'replace')
+            raise IOError(u'Ошибка распаковки <%s> (%s): %s' % (os.path.basename(self._command[0]), return_code, error))
+
+    def close(self):
+        if self._process.poll() is None:
+            # Данные прочитаны не полностью (например, после конца tar архива)
+            self._process.kill()
+        self._process.stdout.close()
+        self._process.wait()
+        if self._feeder is not None:
+            self._feeder.join()
+        self._process.stderr.close()
+        context = watchdog.get_context()
+        if context is not None:
+            context.unregister_process(self._process)
+
+
+def _open_source(sFileName, SourceFile=None, iBufferSize=READ_BLOCK_SIZE):
+    """
+    Файловый объект источника сжатых данных.
+    @return: Кортеж (Файловый объект, Признак владения - закрыть после использования).
+    """
+    if SourceFile is not None:
+        return SourceFile, False
+    return open(sFileName, 'rb', buffering=iBufferSize), True
+
+
+class icPipelinedGzipStream(icDecompressStream):
+    """
+    Распаковка gzip в одном отдельном потоке.
+    Распаковка выполняется параллельно с обработкой распакованных данных,
+    gzip блоки файла распаковываются последовательно.
+    Нулевые байты выравнивания после gzip блоков пропускаются, как в модуле gzip.
+    """
+    def __init__(self, sFileName, SourceFile=None):
+        icDecompressStream.__init__(self)
+        self._file_name = sFileName
+        self._file, self._owned = _open_source(sFileName, SourceFile)
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._stop = False
+        self._thread = threading.Thread(target=self._decompress, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop:
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decompress(self):
+        try:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            # Начат очередной gzip блок файла
+            member_started = False
+            data = self._file.read(READ_BLOCK_SIZE)
+            while data and not self._stop:
+                member_started = True
+                chunk = decompressor.decompress(data)
+                if chunk and not self._put(chunk):
+                    return
+                if decompressor.eof:
+                    # Следующий gzip блок файла
+                    data = self._skip_padding(decompressor.unused_data)
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                    member_started = False
+                else:
+                    data = self._file.read(READ_BLOCK_SIZE)
+            if member_started and not self._stop:
+                raise EOFError(u'Не полный gzip файл <%s>' % self._file_name)
+            self._put(b'')
+        except Exception as err:
+            self._put(err)
+
+    def _skip_padding(self, data):
+        """
+        Пропустить нулевые байты выравнивания после gzip блока.
+        @param data: Не распакованные данные после gzip блока.
+        @return: Данные, начиная со следующего gzip блока,
+            или пустые данные в конце файла.
+        """
+        data = data.lstrip(b'\0')
+        while not data:
+            data = self._file.read(READ_BLOCK_SIZE)
+            if not data:
+                return data
+            data = data.lstrip(b'\0')
+        return data
+
+    def _read_chunk(self):
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        if self._owned:
+            self._file.close()
+
+
+class icBGZFStream(icDecompressStream):
+    """
+    Параллельная распаковка блоков BGZF в пуле потоков.
+    Сжатые блоки читаются последовательно, распаковываются параллельно
+    и выдаются в исходном порядке.
+    """
+    def __init__(self, sFileName, iWorkers=None, SourceFile=None):
+        icDecompressStream.__init__(self)
+        self._file, self._owned = _open_source(sFileName, SourceFile)
+        self._offset = 0
+        workers = iWorkers or os.cpu_count() or 1
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._futures = collections.deque()
+        self._max_futures = workers * 4
+        self._file_eof = False
+
+    def _read_exactly(self, iSize):
+        data = self._file.read(iSize)
+        while 0 < len(data) < iSize:
+            block = self._file.read(iSize - len(data))
+            if not block:
+                break
+            data += block
+        self._offset += len(data)
+        return data
+
+    def _read_block(self):
+        offset = self._offset
+        header = self._read_exactly(12)
+        if not header:
+            return None
+        block_size = None
+        if len(header) == 12:
+            header += self._read_exactly(struct.unpack('<H', header[10:12])[0])
+            block_size = _get_bgzf_block_size(header)
+        if block_size is None or block_size < len(header):
+            raise IOError(u'Не корректный блок BGZF в позиции %d' % offset)
+        block = header + self._read_exactly(block_size - len(header))
+        if len(block) != block_size:
+            raise EOFError(u'Не полный блок BGZF в позиции %d' % offset)
+        return block
+
+    def _fill(self):
+        while not self._file_eof and len(self._futures) < self._max_futures:
+            block = self._read_block()
+            if block is None:
+                self._file_eof = True
+                break
+            self._futures.append(self._pool.submit(zlib.decompress, block, zlib.MAX_WBITS | 16))
+
+    def _read_chunk(self):
+        while True:
+            self._fill()
+            if not self._futures:
+                return b''
+            chunk = self._futures.popleft().result()
+            if chunk:
+                return chunk
+
+    def close(self):
+        for future in self._futures:
+            future.cancel()
+        self._pool.shutdown(wait=True)
+        if self._owned:
+            self._file.close()
+
+
+def open_gzip_stream(sFileName, sBackend=None, SourceFile=None):
+    """
+    Открыть поток распакованных данных gzip файла.
+    @param sFileName: Полное имя gzip файла.
+    @param sBackend: Способ распаковки. Если не указан, то выбирается автоматически.
+    @param SourceFile: Файловый объект источника сжатых данных
+        (например, чтение с вычислением контрольной суммы).
+        Если не указан, то файл открывается по имени.
+    @return: Объект с методами read/close.
+    """
+    backend = sBackend or choose_backend(sFileName)
+    if backend == THREADED_BACKEND:
+        backend = PIPELINED_BACKEND
+    if backend == PIGZ_BACKEND and not get_pigz_programm():
+        log.warning(u'Распаковка. Программа <%s> не установлена' % PIGZ_PROGRAMM)
+        backend = BUILTIN_BACKEND
+    if backend == BGZF_BACKEND and not is_bgzf_file(sFileName):
+        backend = BUILTIN_BACKEND
+    log.info(u'Распаковка <%s>. Способ <%s>' % (sFileName, backend))
+
+    if backend == PIGZ_BACKEND:
+        return _open_process_stream(get_pigz_programm(), sFileName, SourceFile)
+    elif backend == BGZF_BACKEND:
+        return icBGZFStream(sFileName, SourceFile=SourceFile)
+    elif backend == PIPELINED_BACKEND:
+        return icPipelinedGzipStream(sFileName, SourceFile)
+    elif backend != BUILTIN_BACKEND:
+        log.warning(u'Распаковка. Не поддерживаемый способ <%s>' % backend)
+    if SourceFile is not None:
+        return gzip.GzipFile(fileobj=SourceFile, mode='rb')
+    return gzip.open(sFileName, 'rb')
+
+
+def _open_process_stream(sProgramm, sFileName, SourceFile=None):
+    """
+    Открыть поток распаковки внешней программой.
+    """
+    command = [sProgramm, '--decompress', '--stdout', '--quiet']
+    if SourceFile is None:
+        command.append(sFileName)
+    return icProcessStream(command, SourceFile)
+
+
+def open_zstd_stream(sFileName, SourceFile=None):
+    """
+    Открыть поток распакованных данных zstd файла.
+    """
+    try:
+        import zstandard
+        source_file, owned = _open_source(sFileName, SourceFile)
+        return zstandard.ZstdDecompressor().stream_reader(source_file, read_size=READ_BLOCK_SIZE, closefd=owned)
+    except ImportError:
+        pass
+    programm = shutil.which(ZSTD_PROGRAMM)
+    if not programm:
+        raise IOError(u'Для распаковки <%s> не установлен модуль zstandard или программа zstd' % sFileName)
+    return _open_process_stream(programm, sFileName, SourceFile)
+
+
+def open_lz4_stream(sFileName, SourceFile=None):
+    """
+    Открыть поток распакованных данных lz4 файла.
+    """
+    try:
+        import lz4.frame
+        return lz4.frame.open(SourceFile if SourceFile is not None else sFileName, 'rb')
+    except ImportError:
+        pass
+    programm = shutil.which(LZ4_PROGRAMM)
+    if not programm:
+        raise IOError(u'Для распаковки <%s> не установлен модуль lz4 или программа lz4' % sFileName)
+    return _open_process_stream(programm, sFileName, SourceFile)
+
+
+def open_stream(sFileName, sCodec=None, sBackend=None, SourceFile=None):
+    """
+    Открыть поток распакованных данных сжатого файла.
+    @param sFileName: Полное имя файла.
+    @param sCodec: Способ сжатия (см. archive_format).
+        Если не указан, то определяется по содержимому файла.
+    @param sBackend: Способ распаковки gzip (см. open_gzip_stream).
+    @param SourceFile: Файловый объект источника сжатых данных.
+        Если не указан, то файл открывается по имени.
+    @return: Объект с методами read/close.
+    """
+    codec = sCodec or archive_format.get_format_codec(archive_format.detect_format(sFileName))
+    source = SourceFile if SourceFile is not None else sFileName
+    if codec == archive_format.GZIP_CODEC:
+        return open_gzip_stream(sFileName, sBackend, SourceFile)
+    elif codec == archive_format.XZ_CODEC:
+        return lzma.open(source, 'rb')
+    elif codec == archive_format.BZIP2_CODEC:
+        return bz2.open(source, 'rb')
+    elif codec == archive_format.ZSTD_CODEC:
+        return open_zstd_stream(sFileName, SourceFile)
+    elif codec == archive_format.LZ4_CODEC:
+        return open_lz4_stream(sFileName, SourceFile)
+    raise IOError(u'Не поддерживаемый способ сжатия <%s> файла <%s>' % (codec, sFileName))
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Хранилище содержимого файлов инсталлированных пакетов (дедупликация).
+
+Хранилище - папка objects рядом с install.log (в INSTALLATOR_SETTINGS_DIR).
+Объект хранилища - файл с содержимым, адресуемый хешем манифеста (см. manifest),
+режимом доступа, временем изменения и владельцем:
+    <Хранилище>/<2 первых символа хеша>/<Хеш>.<Режим доступа>.<Время изменения>.<UID>.<GID>
+Режим доступа, время изменения и владелец входят в адрес, т.к. жесткие ссылки
+на объект разделяют их с объектом.
+При разархивировании (см. extract) содержимое элемента архива хешируется
+до записи. Если объект с таким содержимым уже есть, то файл не записывается,
+а создается копией без копирования данных (reflink, FICLONE), если файловая
+система это поддерживает, или жесткой ссылкой на объект.
+Объект создается только когда содержимое понадобилось второй раз:
+инсталлированные файлы с тем же содержимым ищутся по манифестам пакетов
+(см. manifest), которые и являются учетом ссылок на содержимое.
+Поэтому содержимое, используемое одним пакетом, записывается один раз
+и не занимает места в хранилище. Объект - отдельный файл (reflink
+инсталлированного файла или новая запись содержимого) и никогда
+не создается жесткой ссылкой на инсталлированный файл.
+Объект без жестких ссылок (например, после деинсталляции пакетов
+или на файловых системах с reflink) удаляется purge_store и при необходимости
+создается заново по манифестам.
+Хранилище должно находиться на той же файловой системе, что и инсталляционные
+папки. Для других файловых систем файлы записываются без дедупликации.
+Изменение файла, связанного жесткой ссылкой, изменяет его во всех пакетах
+и объект хранилища. Поэтому перед использованием объект проверяется
+(размер, атрибуты и содержимое), и измененный объект удаляется из хранилища.
+Хранилище включается явно (ключ 'dedup' описания программы
+или переменная DEDUP_STORE).
+"""
+
+import os
+import os.path
+import stat
+import errno
+import threading
+
+from . import log
+from . import extract
+from . import manifest
+from . import fastcopy
+
+__version__ = (0, 1, 1, 1)
+
+DEDUP_STORE_DIR_NAME = 'objects'
+
+# Файлы меньше этого размера не дедуплицируются
+DEDUP_MIN_SIZE = 16 * 1024
+# Элементы архива больше этого размера не читаются в память для хеширования
+# до записи и не дедуплицируются
+DEDUP_MAX_BUFFER_SIZE = 64 * 1024 * 1024
+
+# Суффикс временного файла при замене файла ссылкой на объект
+_LINK_TMP_SUFFIX = '.icdedup'
+
+
+class icDedupStore:
+    """
+    Хранилище содержимого файлов.
+    Используется потоками пула разархивирования одновременно.
+    """
+    def __init__(self, sStoreDir, sManifestsDir=None):
+        """
+        Конструктор.
+        @param sStoreDir: Папка хранилища.
+        @param sManifestsDir: Папка манифестов инсталлированных пакетов.
+            По манифестам ищутся инсталлированные файлы с тем же содержимым.
+        """
+        self.store_dir = sStoreDir
+        self.manifests_dir = sManifestsDir
+        # Файловые системы (st_dev), поддерживающие reflink
+        self._reflink_devices = {}
+        # Файловые системы, на которые нельзя создать жесткую ссылку из хранилища
+        self._foreign_devices = set()
+        # Объекты, проверенные перед использованием (см. _check_object)
+        self._checked_objects = set()
+        # Файлы с содержимым: {(Хеш, Режим доступа, Время изменения): [Полное имя файла, ...]}
+        # Загружаются из манифестов при первом обращении (см. _get_sources)
+        self._sources = None
+        self._lock = threading.Lock()
+        # Статистика: количество файлов, созданных из хранилища, и сэкономленный объем
+        self.linked = 0
+        self.saved_size = 0
+
+    def is_candidate(self, iSize):
+        """
+        Дедуплицировать файл такого размера?
+        """
+        return DEDUP_MIN_SIZE <= iSize <= DEDUP_MAX_BUFFER_SIZE
+
+    def get_object_file_name(self, sHash, iMode, iMTime, iUID, iGID):
+        """
+        Полное имя файла объекта хранилища.
+        """
+        return os.path.join(self.store_dir, sHash[:2], '%s.%o.%d.%d.%d' % (sHash, iMode & 0o7777, int(iMTime or 0),
+                                                                           iUID, iGID))
+
+    def _write_file(self, sFileName, data, iMode, iMTime, bSetOwner, iUID, iGID):
+        """
+        Записать содержимое в новый файл.
+        """
+        fd = os.open(sFileName, extract.WRITE_FILE_FLAGS, 0o600)
+        try:
+            extract.write_sparse(fd, data)
+            os.ftruncate(fd, len(data))
+            if bSetOwner:
+                os.fchown(fd, iUID, iGID)
+            os.fchmod(fd, iMode)
+            os.utime(fd, (iMTime, iMTime))
+        finally:
+            os.close(fd)
+
+    def _is_same_file(self, sFileName, data, iMode, iMTime, iUID, iGID):
+        """
+        Файл имеет указанные содержимое, режим доступа, время изменения и владельца?
+        """
+        try:
+            file_stat = os.lstat(sFileName)
+            if not stat.S_ISREG(file_stat.st_mode) or file_stat.st_size != len(data) or \
+                    int(file_stat.st_mtime) != iMTime or stat.S_IMODE(file_stat.st_mode) != iMode or \
+                    file_stat.st_uid != iUID or file_stat.st_gid != iGID:
+                return False
+            with open(sFileName, 'rb') as check_file:
+                return check_file.read() == data
+        except OSError:
+            return False
+
+    def _check_object(self, sObjectFileName, data, iMode, iMTime, iUID, iGID):
+        """
+        Проверить, что объект есть в хранилище и не изменен
+        (файл, связанный с ним жесткой ссылкой, мог быть изменен на месте).
+        Измененный объект удаляется из хранилища.
+        @return: True - объект можно использовать, False - нет.
+        """
+        if not os.path.exists(sObjectFileName):
+            return False
+        with self._lock:
+            if sObjectFileName in self._checked_objects:
+                return True
+        if not self._is_same_file(sObjectFileName, data, iMode, iMTime, iUID, iGID):
+            log.warning(u'Объект хранилища <%s> изменен. Объект удален из хранилища' % sObjectFileName)
+            try:
+                os.remove(sObjectFileName)
+            except FileNotFoundError:
+                pass
+            return False
+        with self._lock:
+            self._checked_objects.add(sObjectFileName)
+        return True
+
+    def _get_sources(self):
+        """
+        Файлы инсталлированных пакетов, содержимое которых может быть в хранилище.
+        Загружаются из манифестов пакетов.
+        """
+        with self._lock:
+            if self._sources is None:
+                self._sources = load_manifest_sources(self.manifests_dir)
+            return self._sources
+
+    def _find_source(self, tKey, data, iUID, iGID):
+        """
+        Найти инсталлированный файл с тем же содержимым и атрибутами.
+        @param tKey: Кортеж (Хеш, Режим доступа, Время изменения).
+        @return: Полное имя файла или None.
+        """
+        sources = self._get_sources()
+        with self._lock:
+            file_names = list(sources.get(tKey, ()))
+        for file_name in file_names:
+            if self._is_same_file(file_name, data, tKey[1], tKey[2], iUID, iGID):
+                return file_name
+        return None
+
+    def _add_source(self, tKey, sFileName):
+        """
+        Зарегистрировать записанный файл как источник содержимого.
+        """
+        sources = self._get_sources()
+        with self._lock:
+            sources.setdefault(tKey, []).append(sFileName)
+
+    def _create_object(self, sObjectFileName, sSourceFileName, data, iMode, iMTime, bSetOwner, iUID, iGID):
+        """
+        Создать объект хранилища, когда содержимое понадобилось второй раз.
+        Объект создается отдельным файлом: копией инсталлированного файла
+        без копирования данных (reflink) или новой записью содержимого,
+        но никогда не жесткой ссылкой на инсталлированный файл.
+        @return: True - объект создан, False - нет.
+        """
+        device = os.stat(os.path.dirname(sSourceFileName)).st_dev
+        if device in self._foreign_devices:
+            return False
+        path = os.path.dirname(sObjectFileName)
+        os.makedirs(path, exist_ok=True)
+        if os.stat(path).st_dev != device:
+            with self._lock:
+                if device not in self._foreign_devices:
+                    log.warning(u'Хранилище <%s> на другой файловой системе, чем <%s>. Дедупликация отключена' % (self.store_dir,
+                                                                                                            sSourceFileName))
+                    self._foreign_devices.add(device)
+            return False
+        tmp_file_name = sObjectFileName + _LINK_TMP_SUFFIX + '.%d' % threading.get_ident()
+        try:
+            if self._reflink_devices.get(device, True) and fastcopy.reflink_file(sSourceFileName, tmp_file_name):
+                self._reflink_devices[device] = True
+                if bSetOwner:
+                    os.chown(tmp_file_name, iUID, iGID)
+                os.chmod(tmp_file_name, iMode)
+                os.utime(tmp_file_name, (iMTime, iMTime))
+            else:
+                self._reflink_devices[device] = False
+                self._write_file(tmp_file_name, data, iMode, iMTime, bSetOwner, iUID, iGID)
+                # Содержимое объекта записано вместо первого файла из хранилища
+                with self._lock:
+                    self.saved_size -= len(data)
+            # Объект, добавленный другим потоком, не заменяется
+            os.link(tmp_file_name, sObjectFileName)
+        except FileExistsError:
+            pass
+        finally:
+            if os.path.lexists(tmp_file_name):
+                os.remove(tmp_file_name)
+        return True
+
+    def _link_object(self, sObjectFileName, sTargetFileName, iMode, iMTime, bSetOwner, iUID, iGID):
+        """
+        Создать файл из объекта хранилища.
+        Место для файла должно быть подготовлено (extract._prepare_target).
+        @return: True/False.
+        """
+        device = os.stat(os.path.dirname(sTargetFileName)).st_dev
+        if device in self._foreign_devices:
+            return False
+        tmp_file_name = sTargetFileName + _LINK_TMP_SUFFIX
+        try:
+            if self._reflink_devices.get(device, True) and fastcopy.reflink_file(sObjectFileName, tmp_file_name):
+                self._reflink_devices[device] = True
+                if bSetOwner:
+                    os.chown(tmp_file_name, iUID, iGID)
+                os.chmod(tmp_file_name, iMode)
+                os.utime(tmp_file_name, (iMTime, iMTime))
+            else:
+                self._reflink_devices[device] = False
+                os.link(sObjectFileName, tmp_file_name)
+            os.replace(tmp_file_name, sTargetFileName)
+            return True
+        except FileNotFoundError:
+            # Объект удален во время разархивирования
+            return False
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+            with self._lock:
+                if device not in self._foreign_devices:
+                    log.warning(u'Хранилище <%s> на другой файловой системе, чем <%s>. Дедупликация отключена' % (self.store_dir,
+                                                                                                            sTargetFileName))
+                    self._foreign_devices.add(device)
+            return False
+
+    def extract_data(self, data, iMode, iMTime, lTargetFileNames, bOverwrite=True, iUID=None, iGID=None):
+        """
+        Записать содержимое элемента архива в файлы через хранилище.
+        @param data: Содержимое элемента архива.
+        @param iMode: Режим доступа.
+        @param iMTime: Время изменения.
+        @param lTargetFileNames: Список полных имен файлов результата.
+        @param bOverwrite: Перезаписывать существующие файлы?
+        @param iUID: Владелец файлов. Если не указан, то файлы принадлежат
+            текущему пользователю.
+        @param iGID: Группа владельца файлов.
+        @return: Хеш содержимого в формате манифеста.
+        """
+        hash_obj = manifest.create_hash()
+        hash_obj.update(data)
+        data_hash = hash_obj.hexdigest()
+        mode = iMode & 0o7777
+        mtime = int(iMTime or 0)
+        set_owner = iUID is not None
+        uid = iUID if set_owner else os.geteuid()
+        gid = iGID if set_owner else os.getegid()
+        object_file_name = self.get_object_file_name(data_hash, mode, mtime, uid, gid)
+        source_key = (data_hash, mode, mtime)
+
+        targets = [target for target in lTargetFileNames if extract._prepare_target(target, bOverwrite)]
+        if not targets:
+            return data_hash
+        is_object = self._check_object(object_file_name, data, mode, mtime, uid, gid)
+        if not is_object:
+            source_file_name = self._find_source(source_key, data, uid, gid)
+            if source_file_name is not None:
+                is_object = self._create_object(object_file_name, source_file_name, data, mode, mtime,
+                                                set_owner, uid, gid)
+        written = []
+        for target in targets:
+            if not is_object and written:
+                # Одно содержимое записывается в несколько папок
+                is_object = self._create_object(object_file_name, written[0], data, mode, mtime,
+                                                set_owner, uid, gid)
+            if is_object and self._link_object(object_file_name, target, mode, mtime, set_owner, uid, gid):
+                with self._lock:
+                    self.linked += 1
+                    self.saved_size += len(data)
+                continue
+            self._write_file(target, data, mode, mtime, set_owner, uid, gid)
+            written.append(target)
+        if written:
+            self._add_source(source_key, written[0])
+        return data_hash
+
+    def log_statistics(self, sPackageName):
+        """
+        Записать в журнал статистику дедупликации.
+        """
+        if self.linked:
+            log.info(u'Дедупликация <%s>. Файлов из хранилища: %d. Не записано: %d байт' % (sPackageName, self.linked,
+                                                                                          self.saved_size))
+
+
+def get_store_dir(sSettingsDir):
+    """
+    Папка хранилища в папке настроек инсталлятора.
+    """
+    return os.path.join(sSettingsDir, DEDUP_STORE_DIR_NAME)
+
+
+def load_manifest_sources(sManifestsDir):
+    """
+    Файлы инсталлированных пакетов по манифестам пакетов, которые могут
+    быть источниками содержимого объектов хранилища.
+    @param sManifestsDir: Папка манифестов.
+    @return: Словарь {(Хеш, Режим доступа, Время изменения): [Полное имя файла, ...]}.
+    """
+    sources = {}
+    if not sManifestsDir or not os.path.isdir(sManifestsDir):
+        return sources
+    for name in sorted(os.listdir(sManifestsDir)):
+        if not name.endswith(manifest.MANIFEST_FILE_EXT):
+            continue
+        package_manifest = manifest.icPackageManifest(sFileName=os.path.join(sManifestsDir, name))
+        try:
+            entries = package_manifest.get_entries()
+        except (OSError, ValueError, EOFError) as err:
+            log.warning(u'Дедупликация. Ошибка чтения манифеста <%s>: %s' % (name, err))
+            continue
+        for entry in entries:
+            if entry.type == manifest.FILE_TYPE and entry.hash and DEDUP_MIN_SIZE <= entry.size <= DEDUP_MAX_BUFFER_SIZE:
+                sources.setdefault((entry.hash, entry.mode, entry.mtime),
+                                   []).append(package_manifest.get_full_path(entry))
+    return sources
+
+
+def purge_store(sStoreDir):
+    """
+    Удалить объекты хранилища, на которые не осталось ссылок
+    (например, после деинсталляции пакетов).
+    @return: Количество удаленных объектов.
+    """
+    count = 0
+    if not os.path.isdir(sStoreDir):
+        return count
+    for sub_dir in os.listdir(sStoreDir):
+        path = os.path.join(sStoreDir, sub_dir)
+        if not os.path.isdir(path):
+            continue
+        for name in os.listdir(path):
+            object_file_name = os.path.join(path, name)
+            try:
+                if os.lstat(object_file_name).st_nlink <= 1:
+                    os.remove(object_file_name)
+                    count += 1
+            except OSError as err:
+                log.warning(u'Ошибка удаления объекта хранилища <%s>: %s' % (object_file_name, err))
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+    if count:
+        log.info(u'Из хранилища <%s> удалено объектов: %d' % (sStoreDir, count))
+    return count
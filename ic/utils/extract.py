@@ -0,0 +1,963 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Разархивирование инсталляционных архивов средствами Python.
+
+Архив читается и распаковывается один раз, а содержимое
+записывается сразу в несколько папок. Используется при инсталляции
+одного набора программ в несколько корневых папок (см. multi_root).
+
+Поддерживаемые архивы: *.zip, *.tar, *.tar.gz, *.tar.xz, *.tar.bz2, *.tar.zst, *.tar.lz4
+(см. archive_format).
+tar архивы разархивируются потоково (tar_extract) синхронно или
+асинхронно (tar_extract_async) с результатом по каждому элементу архива.
+Сжатые tar архивы распаковываются через модуль decompress
+(gzip в том числе многопоточно).
+zip архивы разархивируются параллельно в пуле потоков (zip_extract).
+Во время записи файлов может формироваться манифест пакета (см. manifest).
+Содержимое файлов может дедуплицироваться через хранилище (см. dedup).
+Файлы записываются разреженными: блоки нулей (SPARSE_BLOCK_SIZE) не записываются,
+а остаются дырами файла (образы дисков dosemu в основном состоят из нулей).
+Разреженные элементы tar архива (GNU/PAX sparse) записываются по карте
+областей данных без распаковки нулей.
+Элементы архива с абсолютными путями и ссылками на родительские
+папки ('..') пропускаются. Элементы, путь которых выходит за пределы
+папки разархивирования через символическую ссылку (в том числе созданную
+предыдущим элементом архива), и жесткие ссылки на файлы вне папки
+разархивирования не записываются (см. get_member_targets).
+Символические ссылки zip архива создаются после записи всех файлов.
+"""
+
+import os
+import os.path
+import stat
+import time
+import mmap
+import zlib
+import struct
+import tarfile
+import zipfile
+import threading
+import concurrent.futures
+
+from . import log
+from . import watchdog
+from . import decompress
+from . import archive_format
+from . import checksum
+from . import manifest
+
+__version__ = (0, 1, 1, 1)
+
+# Размер блока копирования данных элемента архива
+COPY_BLOCK_SIZE = 1024 * 1024
+# Размер буфера чтения архива
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Минимальное количество потоков разархивирования zip архива.
+# Запись небольших файлов ограничена в основном системными вызовами
+ZIP_MIN_WORKERS = 4
+# Элементы zip архива больше этого размера распаковываются потоково
+ZIP_LARGE_MEMBER_SIZE = 64 * 1024 * 1024
+# Флаг шифрования элемента zip архива
+ZIP_ENCRYPTED_FLAG = 0x1
+# Режим доступа файлов элементов zip архива без режима доступа unix
+# (архивы, созданные в DOS/Windows)
+ZIP_DEFAULT_FILE_MODE = 0o644
+# Идентификатор дополнительного поля расширенной метки времени
+ZIP_EXTENDED_TIMESTAMP_ID = 0x5455
+# Элементы zip архива распаковываются пакетами, чтобы сократить
+# накладные расходы пула потоков на каждый небольшой файл
+ZIP_BATCH_COUNT = 64
+ZIP_BATCH_SIZE = 4 * 1024 * 1024
+# Флаги создания файлов. Символическая ссылка не должна перезаписываться через ссылку
+WRITE_FILE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_CLOEXEC', 0)
+# Размер блока нулей, который не записывается в файл, а остается дырой.
+# Совпадает с размером блока большинства файловых систем
+SPARSE_BLOCK_SIZE = 4096
+_ZERO_BLOCK = bytes(SPARSE_BLOCK_SIZE)
+_ZERO_COPY_BLOCK = bytes(COPY_BLOCK_SIZE)
+
+
+def is_safe_member_name(sMemberName):
+    """
+    Имя элемента архива не выходит за пределы папки разархивирования?
+    @param sMemberName: Имя элемента архива.
+    """
+    name = sMemberName.replace('\\', '/')
+    if not name or name.startswith('/'):
+        return False
+    return '..' not in name.split('/')
+
+
+def is_inside_dir(sDir, sPath):
+    """
+    Путь с учетом символических ссылок находится в папке?
+    @param sDir: Папка.
+    @param sPath: Проверяемый путь.
+    """
+    real_dir = os.path.realpath(sDir)
+    real_path = os.path.realpath(sPath)
+    return real_path == real_dir or real_path.startswith(real_dir.rstrip('/') + '/')
+
+
+def get_member_targets(lDirs, sMemberName, bDir=False):
+    """
+    Полные имена элемента архива во всех папках разархивирования.
+    Имя элемента должно быть проверено is_safe_member_name.
+    Папка элемента (для элемента-папки - сама папка) не должна выходить
+    за пределы папки разархивирования через символические ссылки.
+    @param lDirs: Список папок разархивирования.
+    @param sMemberName: Имя элемента архива.
+    @param bDir: Элемент-папка?
+    @return: Список полных имен.
+    """
+    targets = []
+    for target_dir in lDirs:
+        target = os.path.join(target_dir, sMemberName)
+        if not is_inside_dir(target_dir, target if bDir else os.path.dirname(target)):
+            raise OSError(u'Элемент архива <%s> выходит за пределы папки <%s> через символическую ссылку' % (sMemberName,
+                                                                                                          target_dir))
+        targets.append(target)
+    return targets
+
+
+def get_hardlink_source(sTargetDir, sLinkName):
+    """
+    Полное имя файла, на который указывает жесткая ссылка элемента архива.
+    @param sTargetDir: Папка разархивирования.
+    @param sLinkName: Имя элемента архива, на который указывает ссылка.
+    @return: Полное имя файла.
+    """
+    source = os.path.join(sTargetDir, sLinkName)
+    if not is_safe_member_name(sLinkName) or not is_inside_dir(sTargetDir, source):
+        raise OSError(u'Жесткая ссылка на <%s> выходит за пределы папки <%s>' % (sLinkName, sTargetDir))
+    return source
+
+
+def get_selected_names(lNames):
+    """
+    Множество нормализованных имен выбранных элементов архива.
+    """
+    return set([os.path.normpath(name) for name in lNames]) if lNames is not None else None
+
+
+def is_selected_member(sMemberName, SelectedNames):
+    """
+    Элемент архива выбран для выборочного разархивирования?
+    Элемент выбран, если выбран он сам или одна из папок, в которых он находится.
+    @param sMemberName: Имя элемента архива.
+    @param SelectedNames: Множество имен выбранных элементов (см. get_selected_names)
+        или None - выбраны все элементы.
+    """
+    if SelectedNames is None:
+        return True
+    path = os.path.normpath(sMemberName)
+    while path and path not in SelectedNames:
+        path = os.path.dirname(path)
+    return bool(path)
+
+
+def _prepare_target(sTargetFileName, bOverwrite=True):
+    """
+    Подготовить место для записи элемента архива.
+    @return: True - можно записывать, False - файл уже существует.
+    """
+    path = os.path.dirname(sTargetFileName)
+    if path and not os.path.isdir(path):
+        os.makedirs(path)
+    if os.path.lexists(sTargetFileName) and not os.path.isdir(sTargetFileName) or os.path.islink(sTargetFileName):
+        if not bOverwrite:
+            return False
+        os.remove(sTargetFileName)
+    return True
+
+
+def _pwrite_all(iFD, data, iOffset):
+    """
+    Записать данные в файл со смещения полностью.
+    """
+    view = memoryview(data)
+    while view:
+        count = os.pwrite(iFD, view, iOffset)
+        view = view[count:]
+        iOffset += count
+
+
+def write_sparse(iFD, data, iOffset=0):
+    """
+    Записать данные в файл со смещения, пропуская блоки нулей.
+    Пропущенные блоки остаются дырами разреженного файла, поэтому
+    файл должен быть создан заново (O_TRUNC), а его размер устанавливается
+    после записи всех данных (os.ftruncate).
+    @param iFD: Дескриптор файла.
+    @param data: Данные.
+    @param iOffset: Смещение данных в файле.
+    """
+    if _ZERO_BLOCK not in data:
+        # Блоков нулей нет. Проверка выполняется быстрым поиском подстроки
+        _pwrite_all(iFD, data, iOffset)
+        return
+    view = memoryview(data)
+    start = None
+    for pos in range(0, len(view), SPARSE_BLOCK_SIZE):
+        block = view[pos:pos + SPARSE_BLOCK_SIZE]
+        if block == _ZERO_BLOCK[:len(block)]:
+            if start is not None:
+                _pwrite_all(iFD, view[start:pos], iOffset + start)
+                start = None
+        elif start is None:
+            start = pos
+    if start is not None:
+        _pwrite_all(iFD, view[start:], iOffset + start)
+
+
+def _hash_zeros(Hash, iSize):
+    """
+    Добавить в хеш данных нули дыры разреженного файла.
+    """
+    while iSize > 0:
+        Hash.update(_ZERO_COPY_BLOCK[:min(iSize, COPY_BLOCK_SIZE)])
+        iSize -= COPY_BLOCK_SIZE
+
+
+def write_stream_to_files(src_file, lTargetFileNames, iMode=None, bOverwrite=True, Hash=None,
+                          lSparse=None, iSize=None):
+    """
+    Записать поток данных в несколько файлов.
+    Данные читаются блоками один раз. Блоки нулей не записываются (см. write_sparse).
+    @param src_file: Файловый объект источника.
+    @param lTargetFileNames: Список полных имен файлов результата.
+    @param iMode: Режим доступа создаваемых файлов.
+    @param bOverwrite: Перезаписывать существующие файлы?
+    @param Hash: Объект вычисления хеша данных (hashlib).
+        Если указан, то поток читается полностью, даже если
+        все файлы уже существуют.
+    @param lSparse: Карта разреженного файла [(Смещение, Размер), ...].
+        Если указана, то источник содержит только области данных, записанные подряд.
+    @param iSize: Размер разреженного файла.
+    @return: Количество записанных байт в каждый файл.
+    """
+    target_fds = []
+    size = 0
+    try:
+        for target_file_name in lTargetFileNames:
+            if _prepare_target(target_file_name, bOverwrite):
+                target_fds.append(os.open(target_file_name, WRITE_FILE_FLAGS, 0o666))
+        if not target_fds and Hash is None:
+            return 0
+        regions = lSparse if lSparse is not None else [(0, None)]
+        for offset, region_size in regions:
+            if region_size == 0:
+                # Пустые области (например, завершающая область карты GNU sparse)
+                continue
+            if Hash is not None and offset > size:
+                _hash_zeros(Hash, offset - size)
+            size = offset
+            block = src_file.read(COPY_BLOCK_SIZE if region_size is None else min(region_size, COPY_BLOCK_SIZE))
+            while block:
+                for target_fd in target_fds:
+                    write_sparse(target_fd, block, size)
+                if Hash is not None:
+                    Hash.update(block)
+                size += len(block)
+                if region_size is not None:
+                    if size >= offset + region_size:
+                        break
+                    block = src_file.read(min(offset + region_size - size, COPY_BLOCK_SIZE))
+                    if not block:
+                        raise EOFError(u'Не ожиданный конец данных разреженного файла')
+                else:
+                    block = src_file.read(COPY_BLOCK_SIZE)
+        if lSparse is not None and iSize is not None:
+            if Hash is not None and iSize > size:
+                _hash_zeros(Hash, iSize - size)
+            size = iSize
+        for target_fd in target_fds:
+            os.ftruncate(target_fd, size)
+            if iMode is not None:
+                os.fchmod(target_fd, iMode)
+    finally:
+        for target_fd in target_fds:
+            os.close(target_fd)
+    return size
+
+
+def _make_link(sLinkTarget, lLinkNames, bOverwrite=True):
+    """
+    Создать символические ссылки.
+    """
+    for link_name in lLinkNames:
+        if _prepare_target(link_name, bOverwrite):
+            os.symlink(sLinkTarget, link_name)
+
+
+class icExtractResult:
+    """
+    Результат разархивирования.
+    """
+    def __init__(self, sArchiveFileName, lDirs):
+        """
+        Конструктор.
+        @param sArchiveFileName: Полное имя архива.
+        @param lDirs: Список папок разархивирования.
+        """
+        self.archive = sArchiveFileName
+        self.dirs = lDirs
+        # Результаты по элементам архива:
+        # [{'name': Имя элемента, 'ok': True/False, 'error': Текст ошибки или None}, ...]
+        self.members = []
+        # Ошибка чтения архива. Разархивирование прервано
+        self.error = None
+
+    def add_member(self, sName, error=None):
+        """
+        Зарегистрировать результат обработки элемента архива.
+        """
+        self.members.append(dict(name=sName, ok=error is None, error=str(error) if error is not None else None))
+
+    def get_errors(self):
+        """
+        Список элементов архива, разархивированных с ошибкой.
+        """
+        return [member for member in self.members if not member['ok']]
+
+    def is_ok(self):
+        """
+        Архив разархивирован полностью без ошибок?
+        """
+        return self.error is None and not self.get_errors()
+
+    def __bool__(self):
+        return self.is_ok()
+
+
+class icExtractHandle:
+    """
+    Объект асинхронного разархивирования.
+    Разархивирование выполняется в отдельном потоке.
+    """
+    def __init__(self, fExtract, *args, **kwargs):
+        """
+        Конструктор.
+        @param fExtract: Функция разархивирования, возвращающая icExtractResult.
+        """
+        self._extract = fExtract
+        self._args = args
+        self._kwargs = kwargs
+        self.result = None
+        # Контекст шага сценария передается в поток разархивирования
+        self._context = watchdog.get_context()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        watchdog.set_context(self._context)
+        try:
+            self.result = self._extract(*self._args, **self._kwargs)
+        finally:
+            watchdog.set_context(None)
+
+    def start(self):
+        """
+        Запустить разархивирование.
+        """
+        self._thread.start()
+        return self
+
+    def is_done(self):
+        """
+        Разархивирование завершено?
+        """
+        return not self._thread.is_alive()
+
+    def wait(self, fTimeout=None):
+        """
+        Дождаться завершения разархивирования.
+        @param fTimeout: Время ожидания в секундах. None - без ограничения.
+        @return: Результат разархивирования (icExtractResult) или
+            None, если разархивирование не завершено.
+        """
+        self._thread.join(fTimeout)
+        return None if self._thread.is_alive() else self.result
+
+
+def _extract_tar_member(tar_file, member, lDirs, bOverwrite=True, bSetOwner=False, Manifest=None, Store=None):
+    """
+    Разархивировать элемент tar архива во все папки.
+    @param Manifest: Манифест пакета (manifest.icPackageManifest), в который
+        добавляется элемент архива.
+    @param Store: Хранилище содержимого файлов (dedup.icDedupStore).
+    """
+    targets = get_member_targets(lDirs, member.name, member.isdir())
+    entry_type = manifest.FILE_TYPE
+    entry_size = member.size
+    entry_hash = ''
+    if member.isdir():
+        entry_type = manifest.DIR_TYPE
+        for target in targets:
+            if not os.path.isdir(target):
+                os.makedirs(target)
+    elif member.issym():
+        entry_type = manifest.LINK_TYPE
+        entry_hash = member.linkname
+        _make_link(member.linkname, targets, bOverwrite)
+    elif member.islnk():
+        for target_dir, target in zip(lDirs, targets):
+            if _prepare_target(target, bOverwrite):
+                os.link(get_hardlink_source(target_dir, member.linkname), target)
+        # Жесткая ссылка в манифесте - файл с тем же содержимым
+        link_entry = Manifest.get(member.linkname) if Manifest is not None else None
+        if link_entry is not None:
+            entry_size = link_entry.size
+            entry_hash = link_entry.hash
+    elif member.issparse():
+        # Области данных разреженного элемента записаны в архиве подряд
+        hash_obj = manifest.create_hash() if Manifest is not None else None
+        tar_file.fileobj.seek(member.offset_data)
+        write_stream_to_files(tar_file.fileobj, targets, None, bOverwrite, hash_obj, member.sparse, member.size)
+        if hash_obj is not None:
+            entry_hash = hash_obj.hexdigest()
+    elif member.isreg() and Store is not None and Store.is_candidate(member.size):
+        # Содержимое хешируется до записи для поиска в хранилище
+        # Владелец входит в адрес объекта хранилища: файлы разных владельцев
+        # не связываются жесткими ссылками
+        entry_hash = Store.extract_data(tar_file.extractfile(member).read(), member.mode, member.mtime,
+                                        targets, bOverwrite,
+                                        member.uid if bSetOwner else None, member.gid if bSetOwner else None)
+    elif member.isreg():
+        hash_obj = manifest.create_hash() if Manifest is not None else None
+        write_stream_to_files(tar_file.extractfile(member), targets, None, bOverwrite, hash_obj)
+        if hash_obj is not None:
+            entry_hash = hash_obj.hexdigest()
+    else:
+        raise OSError(u'Специальные файлы не поддерживаются')
+
+    for target in targets:
+        if bSetOwner:
+            os.lchown(target, member.uid, member.gid)
+        if not member.issym():
+            os.chmod(target, member.mode)
+            os.utime(target, (member.mtime, member.mtime))
+    if Manifest is not None:
+        Manifest.add(member.name, entry_type, 0 if entry_type == manifest.DIR_TYPE else entry_size,
+                     member.mode, member.mtime, entry_hash)
+
+
+def open_tar_stream(sTarFileName, sDecompress=None, iBufferSize=READ_BUFFER_SIZE, SourceFile=None):
+    """
+    Открыть поток данных tar архива для последовательного чтения.
+    Способ сжатия архива определяется по содержимому (см. archive_format).
+    @param sTarFileName: Полное имя tar архива.
+    @param sDecompress: Способ распаковки gzip (см. decompress).
+        Если не указан, то выбирается автоматически.
+    @param iBufferSize: Размер буфера чтения архива.
+    @param SourceFile: Файловый объект чтения архива.
+        Если не указан, то архив открывается по имени.
+        Файловый объект источника не закрывается вместе с потоком.
+    @return: Кортеж (Файловый объект, Режим открытия tarfile).
+    """
+    format_name = archive_format.detect_format(sTarFileName)
+    codec = archive_format.get_format_codec(format_name)
+    if codec:
+        return decompress.open_stream(sTarFileName, codec, sDecompress, SourceFile), 'r|'
+    # Если формат не определен, то способ сжатия определяет tarfile
+    tar_mode = 'r|' if format_name == archive_format.TAR_FORMAT else 'r|*'
+    if SourceFile is not None:
+        return SourceFile, tar_mode
+    return open(sTarFileName, 'rb', buffering=iBufferSize), tar_mode
+
+
+def _check_archive_checksum(result, Checksum, hash_obj):
+    """
+    Проверить контрольную сумму прочитанного архива.
+    При несовпадении ошибка регистрируется в результате разархивирования.
+    @param hash_obj: Объект вычисления контрольной суммы или checksum.icHashingReader.
+    @return: True - контрольная сумма совпадает, False - нет.
+    """
+    if Checksum.is_valid(hash_obj):
+        log.info(u'Архив <%s>. Контрольная сумма %s проверена' % (result.archive, Checksum.algorithm))
+        return True
+    result.error = u'Не совпадает контрольная сумма %s архива <%s>' % (Checksum.algorithm, result.archive)
+    log.error(result.error)
+    return False
+
+
+def _extract_tar_stream(archive_file, sTarMode, lDirs, bOverwrite, fProgress, iBufferSize,
+                        result, lDirMembers, bSetOwner, context, Manifest=None, Store=None):
+    """
+    Разархивировать элементы tar архива из потока.
+    Элементы-папки добавляются в lDirMembers для последующей установки атрибутов.
+    """
+    with tarfile.open(fileobj=archive_file, mode=sTarMode, bufsize=iBufferSize) as tar_file:
+        for member in tar_file:
+            if context is not None:
+                context.check()
+            if not is_safe_member_name(member.name):
+                log.warning(u'TarGz. Пропущен элемент архива <%s>' % member.name)
+                result.add_member(member.name, u'Не допустимое имя элемента архива')
+                continue
+            try:
+                if member.isdir():
+                    for target in get_member_targets(lDirs, member.name, True):
+                        if not os.path.isdir(target):
+                            os.makedirs(target)
+                    lDirMembers.append(member)
+                else:
+                    _extract_tar_member(tar_file, member, lDirs, bOverwrite, bSetOwner, Manifest, Store)
+                result.add_member(member.name)
+            except OSError as err:
+                log.error(u'TarGz. Ошибка разархивирования элемента <%s>: %s' % (member.name, err))
+                result.add_member(member.name, err)
+            if fProgress:
+                fProgress(member.name)
+
+
+def tar_extract(sTarFileName, lDirs, bOverwrite=True, fProgress=None, iBufferSize=READ_BUFFER_SIZE,
+                sDecompress=None, Checksum=None, Manifest=None, Store=None):
+    """
+    Потоковое разархивирование tar архива (в том числе сжатого) в папки.
+    Архив читается последовательно один раз большими блоками
+    без запуска внешних процессов.
+    Ошибки записи отдельных элементов не прерывают разархивирование
+    и регистрируются в результате.
+    @param sTarFileName: Полное имя tar архива.
+    @param lDirs: Список папок, в которые разворачивается архив.
+    @param bOverwrite: Перезаписать существующие файлы?
+    @param fProgress: Функция, вызываемая с именем каждого разархивированного элемента.
+    @param iBufferSize: Размер буфера чтения архива.
+    @param sDecompress: Способ распаковки gzip (см. decompress).
+        Если не указан, то выбирается автоматически.
+    @param Checksum: Ожидаемая контрольная сумма архива (checksum.icChecksum).
+        Вычисляется в том же чтении архива. При несовпадении
+        результат разархивирования содержит ошибку.
+    @param Manifest: Манифест пакета (manifest.icPackageManifest),
+        заполняемый во время записи файлов.
+    @param Store: Хранилище содержимого файлов (dedup.icDedupStore).
+        Если указано, то одинаковые файлы не записываются повторно.
+    @return: Результат разархивирования icExtractResult.
+    """
+    result = icExtractResult(sTarFileName, lDirs)
+    # Владельца файлов можно установить только с правами root
+    set_owner = hasattr(os, 'geteuid') and os.geteuid() == 0
+    context = watchdog.get_context()
+    # Папки разархивируются с правами записи.
+    # Режим доступа папок устанавливается после записи их содержимого
+    dir_members = []
+    try:
+        with open(sTarFileName, 'rb', buffering=iBufferSize) as raw_file:
+            source_file = Checksum.create_reader(raw_file) if Checksum is not None else raw_file
+            archive_file, tar_mode = open_tar_stream(sTarFileName, sDecompress, iBufferSize, source_file)
+            try:
+                _extract_tar_stream(archive_file, tar_mode, lDirs, bOverwrite, fProgress, iBufferSize,
+                                    result, dir_members, set_owner, context, Manifest, Store)
+            finally:
+                if archive_file is not source_file:
+                    archive_file.close()
+            if Checksum is not None:
+                # Архив дочитывается до конца
+                source_file.drain()
+                _check_archive_checksum(result, Checksum, source_file)
+        for member in reversed(dir_members):
+            try:
+                _extract_tar_member(None, member, lDirs, bOverwrite, set_owner, Manifest)
+            except OSError as err:
+                log.error(u'TarGz. Ошибка установки атрибутов папки <%s>: %s' % (member.name, err))
+    except watchdog.icStepInterrupt:
+        raise
+    except Exception as err:
+        log.fatal(u'TarGz. Ошибка чтения архива <%s>' % sTarFileName)
+        result.error = str(err)
+    if result.is_ok():
+        log.info(u'TarGz. Архив <%s> распакован в %s. Элементов: %d' % (sTarFileName, lDirs, len(result.members)))
+    else:
+        log.error(u'TarGz. Архив <%s> распакован в %s с ошибками. Элементов с ошибками: %d' % (sTarFileName, lDirs,
+                                                                                            len(result.get_errors())))
+    return result
+
+
+def tar_extract_async(sTarFileName, lDirs, bOverwrite=True, fProgress=None, iBufferSize=READ_BUFFER_SIZE,
+                      sDecompress=None, Checksum=None, Manifest=None, Store=None):
+    """
+    Асинхронное разархивирование tar архива.
+    Параметры аналогичны tar_extract.
+    @return: Запущенный объект icExtractHandle.
+    """
+    return icExtractHandle(tar_extract, sTarFileName, lDirs, bOverwrite, fProgress, iBufferSize,
+                           sDecompress, Checksum, Manifest, Store).start()
+
+
+def tar_extract_to_dirs(sTarFileName, lDirs, bOverwrite=True, sDecompress=None):
+    """
+    Распаковать tar архив (в том числе сжатый) одновременно в несколько папок.
+    Архив читается последовательно (потоком) один раз.
+    @param sTarFileName: Полное имя tar архива.
+    @param lDirs: Список папок, в которые разворачивается архив.
+    @param bOverwrite: Перезаписать существующие файлы?
+    @param sDecompress: Способ распаковки gzip (см. decompress).
+    @return: Количество распакованных элементов архива или None в случае ошибки.
+    """
+    result = tar_extract(sTarFileName, lDirs, bOverwrite, sDecompress=sDecompress)
+    return len(result.members) if result.is_ok() else None
+
+
+def _get_zip_member_mtime(member):
+    """
+    Время изменения элемента zip архива.
+    Берется из расширенной метки времени (UTC), если она есть,
+    иначе из времени DOS (локальное время).
+    """
+    extra = member.extra
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, size = struct.unpack('<HH', extra[pos:pos + 4])
+        if header_id == ZIP_EXTENDED_TIMESTAMP_ID and size >= 5 and extra[pos + 4] & 1:
+            return struct.unpack('<i', extra[pos + 5:pos + 9])[0]
+        pos += 4 + size
+    try:
+        return time.mktime(member.date_time + (0, 0, -1))
+    except (OverflowError, ValueError):
+        return None
+
+
+def _get_zip_data_offset(archive_map, member):
+    """
+    Смещение сжатых данных элемента zip архива.
+    Определяется по локальному заголовку элемента.
+    """
+    header = archive_map[member.header_offset:member.header_offset + zipfile.sizeFileHeader]
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(u'Не корректный заголовок элемента <%s>' % member.filename)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    return member.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+
+
+class icZipExtractor:
+    """
+    Параллельное разархивирование zip архива.
+    Центральный каталог архива читается один раз,
+    все папки создаются заранее, а элементы архива распаковываются
+    в пуле потоков (zlib освобождает GIL) из отображенного в память архива.
+    Элементы, сжатые не deflate, зашифрованные и очень большие,
+    распаковываются модулем zipfile (отдельный объект ZipFile на поток).
+    """
+    def __init__(self, sZipFileName, lDirs, bOverwrite=True, iWorkers=None, Checksum=None, Manifest=None,
+                 lNames=None, Store=None):
+        """
+        Конструктор.
+        @param sZipFileName: Полное имя *.zip архива.
+        @param lDirs: Список папок, в которые разворачивается архив.
+        @param bOverwrite: Перезаписать существующие файлы?
+        @param iWorkers: Количество потоков. Если не указано, то определяется
+            по количеству ядер.
+        @param Checksum: Ожидаемая контрольная сумма архива (checksum.icChecksum).
+            Вычисляется по отображенному в память архиву параллельно
+            с разархивированием, без дополнительного чтения файла.
+        @param Manifest: Манифест пакета (manifest.icPackageManifest),
+            заполняемый потоками пула во время записи файлов.
+        @param lNames: Имена разархивируемых элементов архива. Папки разархивируются
+            с содержимым. Если не указаны, то разархивируются все элементы.
+        @param Store: Хранилище содержимого файлов (dedup.icDedupStore).
+        """
+        self.zip_file_name = sZipFileName
+        self.dirs = lDirs
+        self.overwrite = bOverwrite
+        self.checksum = Checksum
+        self.manifest = Manifest
+        self.names = get_selected_names(lNames)
+        self.store = Store
+        self.workers = iWorkers or max(ZIP_MIN_WORKERS, os.cpu_count() or 1)
+        self._archive_map = None
+        self._thread_local = threading.local()
+        self._zip_files = []
+        self._zip_files_lock = threading.Lock()
+
+    def _get_zip_file(self):
+        """
+        Объект ZipFile текущего потока.
+        """
+        zip_file = getattr(self._thread_local, 'zip_file', None)
+        if zip_file is None:
+            zip_file = zipfile.ZipFile(self.zip_file_name)
+            self._thread_local.zip_file = zip_file
+            with self._zip_files_lock:
+                self._zip_files.append(zip_file)
+        return zip_file
+
+    def _read_member(self, member):
+        """
+        Прочитать распакованные данные элемента архива.
+        @return: Данные или None, если элемент необходимо распаковать потоково.
+        """
+        if member.flag_bits & ZIP_ENCRYPTED_FLAG or member.file_size > ZIP_LARGE_MEMBER_SIZE:
+            return None
+        if member.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            return None
+        offset = _get_zip_data_offset(self._archive_map, member)
+        data = self._archive_map[offset:offset + member.compress_size]
+        if member.compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS, member.file_size or zlib.DEF_BUF_SIZE)
+        if zlib.crc32(data) != member.CRC:
+            raise zipfile.BadZipFile(u'Не совпадает контрольная сумма элемента <%s>' % member.filename)
+        return data
+
+    def _write_data(self, sTargetFileName, data, iMode, fMTime):
+        """
+        Записать данные элемента архива в файл.
+        """
+        try:
+            fd = os.open(sTargetFileName, WRITE_FILE_FLAGS, 0o644)
+        except OSError:
+            # На месте файла символическая ссылка
+            if not os.path.islink(sTargetFileName):
+                raise
+            os.remove(sTargetFileName)
+            fd = os.open(sTargetFileName, WRITE_FILE_FLAGS, 0o644)
+        try:
+            write_sparse(fd, data)
+            os.ftruncate(fd, len(data))
+            if iMode:
+                os.fchmod(fd, iMode)
+            if fMTime is not None:
+                os.utime(fd, (fMTime, fMTime))
+        finally:
+            os.close(fd)
+
+    def _write_member(self, member):
+        """
+        Разархивировать элемент архива во все папки.
+        """
+        targets = get_member_targets(self.dirs, member.filename)
+        if not self.overwrite:
+            targets = [target for target in targets if not os.path.lexists(target)]
+            # Для манифеста элемент читается, даже если файлы уже существуют
+            if not targets and self.manifest is None:
+                return
+        mode = member.external_attr >> 16
+        data = self._read_member(member)
+        if stat.S_ISLNK(mode):
+            if data is None:
+                data = self._get_zip_file().read(member)
+            link_target = data.decode('utf-8')
+            _make_link(link_target, targets)
+            if self.manifest is not None:
+                self.manifest.add(member.filename, manifest.LINK_TYPE, 0, stat.S_IMODE(mode),
+                                  _get_zip_member_mtime(member), link_target)
+            return
+        mtime = _get_zip_member_mtime(member)
+        # В манифест записывается режим доступа, установленный файлу
+        file_mode = stat.S_IMODE(mode) or ZIP_DEFAULT_FILE_MODE
+        hash_obj = manifest.create_hash() if self.manifest is not None else None
+        if data is not None and mtime is not None and self.store is not None and self.store.is_candidate(len(data)):
+            data_hash = self.store.extract_data(data, file_mode, mtime, targets, self.overwrite)
+            if self.manifest is not None:
+                self.manifest.add(member.filename, manifest.FILE_TYPE, member.file_size, file_mode, mtime, data_hash)
+            return
+        if data is None:
+            with self._get_zip_file().open(member) as member_file:
+                write_stream_to_files(member_file, targets, Hash=hash_obj)
+            for target in targets:
+                os.chmod(target, file_mode)
+                if mtime is not None:
+                    os.utime(target, (mtime, mtime))
+        else:
+            for target in targets:
+                self._write_data(target, data, file_mode, mtime)
+            if hash_obj is not None:
+                hash_obj.update(data)
+        if self.manifest is not None:
+            self.manifest.add(member.filename, manifest.FILE_TYPE, member.file_size, file_mode,
+                              mtime, hash_obj.hexdigest())
+
+    def _write_members(self, lMembers, context=None):
+        """
+        Разархивировать пакет элементов архива.
+        Выполняется в потоке пула.
+        @return: Список кортежей (Элемент, Ошибка или None).
+        """
+        watchdog.set_context(context)
+        results = []
+        try:
+            for member in lMembers:
+                if context is not None:
+                    context.check()
+                try:
+                    self._write_member(member)
+                    results.append((member, None))
+                except (OSError, zipfile.BadZipFile, zlib.error, UnicodeDecodeError) as err:
+                    results.append((member, err))
+        finally:
+            watchdog.set_context(None)
+        return results
+
+    def _get_batches(self, lMembers):
+        """
+        Разбить элементы архива на пакеты для пула потоков.
+        """
+        batches = []
+        batch = []
+        batch_size = 0
+        for member in lMembers:
+            batch.append(member)
+            batch_size += member.file_size
+            if len(batch) >= ZIP_BATCH_COUNT or batch_size >= ZIP_BATCH_SIZE:
+                batches.append(batch)
+                batch = []
+                batch_size = 0
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _hash_archive(self):
+        """
+        Вычислить контрольную сумму отображенного в память архива.
+        @return: Объект вычисления контрольной суммы.
+        """
+        hash_obj = self.checksum.create_hash()
+        with memoryview(self._archive_map) as archive_view:
+            for offset in range(0, len(archive_view), checksum.DRAIN_BLOCK_SIZE):
+                hash_obj.update(archive_view[offset:offset + checksum.DRAIN_BLOCK_SIZE])
+        return hash_obj
+
+    def _plan(self, zip_file, result):
+        """
+        Разбор центрального каталога архива.
+        @return: Кортеж (Список папок, Список элементов-папок, Список элементов-файлов,
+            Список элементов-символических ссылок).
+        """
+        dir_names = set()
+        dir_members = []
+        file_members = []
+        link_members = []
+        for member in zip_file.infolist():
+            if not is_selected_member(member.filename, self.names):
+                continue
+            if not is_safe_member_name(member.filename):
+                log.warning(u'Unzip. Пропущен элемент архива <%s>' % member.filename)
+                result.add_member(member.filename, u'Не допустимое имя элемента архива')
+                continue
+            if member.is_dir():
+                dir_members.append(member)
+                dir_names.add(member.filename.rstrip('/'))
+            else:
+                # Символические ссылки создаются после записи файлов,
+                # чтобы файлы не записывались через них
+                if stat.S_ISLNK(member.external_attr >> 16):
+                    link_members.append(member)
+                else:
+                    file_members.append(member)
+                dir_names.add(os.path.dirname(member.filename))
+        dir_names.discard('')
+        return sorted(dir_names), dir_members, file_members, link_members
+
+    def _add_results(self, result, lResults, fProgress=None):
+        """
+        Зарегистрировать результаты разархивирования пакета элементов.
+        @param lResults: Список кортежей (Элемент, Ошибка или None).
+        """
+        for member, error in lResults:
+            if error is not None:
+                log.error(u'Unzip. Ошибка разархивирования элемента <%s>: %s' % (member.filename, error))
+            result.add_member(member.filename, error)
+            if fProgress:
+                fProgress(member.filename)
+
+    def extract(self, fProgress=None):
+        """
+        Разархивировать.
+        @param fProgress: Функция, вызываемая с именем каждого разархивированного элемента.
+        @return: Результат разархивирования icExtractResult.
+        """
+        result = icExtractResult(self.zip_file_name, self.dirs)
+        context = watchdog.get_context()
+        try:
+            with zipfile.ZipFile(self.zip_file_name) as zip_file, open(self.zip_file_name, 'rb') as archive_file:
+                dir_names, dir_members, file_members, link_members = self._plan(zip_file, result)
+                for dir_name in dir_names:
+                    for target in get_member_targets(self.dirs, dir_name, True):
+                        os.makedirs(target, exist_ok=True)
+
+                if file_members or link_members or self.checksum is not None:
+                    self._archive_map = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+                        futures = [pool.submit(self._write_members, batch, context)
+                                   for batch in self._get_batches(file_members)]
+                        try:
+                            if self.checksum is not None:
+                                # Контрольная сумма вычисляется, пока потоки пула распаковывают элементы
+                                hash_obj = self._hash_archive()
+                            for future in concurrent.futures.as_completed(futures):
+                                self._add_results(result, future.result(), fProgress)
+                        except BaseException:
+                            for future in futures:
+                                future.cancel()
+                            raise
+                        if link_members:
+                            self._add_results(result, pool.submit(self._write_members, link_members,
+                                                                  context).result(), fProgress)
+                finally:
+                    if self._archive_map is not None:
+                        self._archive_map.close()
+                        self._archive_map = None
+                    for member_zip_file in self._zip_files:
+                        member_zip_file.close()
+                    self._zip_files = []
+
+                if self.checksum is not None:
+                    _check_archive_checksum(result, self.checksum, hash_obj)
+
+                # Режим доступа папок устанавливается после записи их содержимого
+                for member in reversed(dir_members):
+                    mode = stat.S_IMODE(member.external_attr >> 16)
+                    for target in get_member_targets(self.dirs, member.filename, True):
+                        if mode:
+                            os.chmod(target, mode)
+                    if self.manifest is not None:
+                        self.manifest.add(member.filename, manifest.DIR_TYPE, 0, mode,
+                                          _get_zip_member_mtime(member))
+                    result.add_member(member.filename)
+        except watchdog.icStepInterrupt:
+            raise
+        except Exception as err:
+            log.fatal(u'Unzip. Ошибка чтения архива <%s>' % self.zip_file_name)
+            result.error = str(err)
+        if result.is_ok():
+            log.info(u'Unzip. Архив <%s> распакован в %s. Элементов: %d' % (self.zip_file_name, self.dirs,
+                                                                          len(result.members)))
+        else:
+            log.error(u'Unzip. Архив <%s> распакован в %s с ошибками. Элементов с ошибками: %d' % (self.zip_file_name,
+                                                                                                self.dirs,
+                                                                                                len(result.get_errors())))
+        return result
+
+
+def zip_extract(sZipFileName, lDirs, bOverwrite=True, fProgress=None, iWorkers=None, Checksum=None,
+                Manifest=None, lNames=None, Store=None):
+    """
+    Параллельное разархивирование zip архива в папки (см. icZipExtractor).
+    @param sZipFileName: Полное имя *.zip архива.
+    @param lDirs: Список папок, в которые разворачивается архив.
+    @param bOverwrite: Перезаписать существующие файлы?
+    @param fProgress: Функция, вызываемая с именем каждого разархивированного элемента.
+    @param iWorkers: Количество потоков.
+    @param Checksum: Ожидаемая контрольная сумма архива (checksum.icChecksum).
+    @param Manifest: Манифест пакета (manifest.icPackageManifest).
+    @param lNames: Имена разархивируемых элементов архива (см. icZipExtractor).
+    @param Store: Хранилище содержимого файлов (dedup.icDedupStore).
+    @return: Результат разархивирования icExtractResult.
+    """
+    return icZipExtractor(sZipFileName, lDirs, bOverwrite, iWorkers, Checksum, Manifest,
+                          lNames, Store).extract(fProgress)
+
+
+def zip_extract_to_dirs(sZipFileName, lDirs, bOverwrite=True):
+    """
+    Распаковать *.zip архив одновременно в несколько папок.
+    @param sZipFileName: Полное имя *.zip архива.
+    @param lDirs: Список папок, в которые разворачивается архив.
+    @param bOverwrite: Перезаписать существующие файлы?
+    @return: Количество распакованных элементов архива или None в случае ошибки.
+    """
+    result = zip_extract(sZipFileName, lDirs, bOverwrite)
+    return len(result.members) if result.is_ok() else None
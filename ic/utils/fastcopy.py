@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Копирование файлов без копирования данных через пространство пользователя.
+
+Способы копирования содержимого файла в порядке предпочтения:
+    REFLINK_METHOD - копия без копирования данных (ioctl FICLONE, btrfs/xfs),
+    COPY_RANGE_METHOD - копирование в ядре (os.copy_file_range),
+    SENDFILE_METHOD - копирование в ядре (os.sendfile),
+    READ_WRITE_METHOD - чтение и запись блоками.
+Если способ не поддерживается файловой системой, то используется следующий.
+Способы, не поддерживаемые ядром, больше не пробуются.
+Папки копируются параллельно по файлам в пуле потоков (copy_tree)
+с сохранением режима доступа, времени изменения и владельца
+(владелец - только с правами root).
+"""
+
+import os
+import os.path
+import stat
+import errno
+import fcntl
+import concurrent.futures
+
+from . import log
+
+__version__ = (0, 1, 1, 1)
+
+REFLINK_METHOD = 'reflink'
+COPY_RANGE_METHOD = 'copy_file_range'
+SENDFILE_METHOD = 'sendfile'
+READ_WRITE_METHOD = 'read_write'
+
+# Код ioctl FICLONE
+FICLONE = 0x40049409
+
+# Размер блока копирования
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+# Минимальное количество потоков копирования папки
+COPY_MIN_WORKERS = 4
+
+# Ошибки, при которых способ копирования не применим к этим файлам
+_UNSUPPORTED_ERRORS = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                       errno.EBADF, errno.ETXTBSY)
+
+# Способы копирования, не поддерживаемые ядром
+_DISABLED_METHODS = set()
+
+WRITE_FILE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_CLOEXEC', 0)
+
+
+def _disable_method(sMethod, err):
+    if err.errno == errno.ENOSYS:
+        _DISABLED_METHODS.add(sMethod)
+
+
+def _reflink(iSrcFD, iDstFD):
+    """
+    Копия без копирования данных.
+    @return: True/False - файловая система не поддерживает reflink.
+    """
+    if REFLINK_METHOD in _DISABLED_METHODS:
+        return False
+    try:
+        fcntl.ioctl(iDstFD, FICLONE, iSrcFD)
+        return True
+    except OSError as err:
+        if err.errno not in _UNSUPPORTED_ERRORS:
+            raise
+        _disable_method(REFLINK_METHOD, err)
+    return False
+
+
+def _copy_range(iSrcFD, iDstFD):
+    """
+    Копирование в ядре через copy_file_range.
+    @return: True/False - способ не применим.
+    """
+    if COPY_RANGE_METHOD in _DISABLED_METHODS or not hasattr(os, 'copy_file_range'):
+        return False
+    copied = 0
+    try:
+        while True:
+            count = os.copy_file_range(iSrcFD, iDstFD, COPY_BLOCK_SIZE)
+            if not count:
+                return True
+            copied += count
+    except OSError as err:
+        # Ошибка после начала копирования не означает, что способ не поддерживается
+        if copied or err.errno not in _UNSUPPORTED_ERRORS:
+            raise
+        _disable_method(COPY_RANGE_METHOD, err)
+    return False
+
+
+def _sendfile(iSrcFD, iDstFD):
+    """
+    Копирование в ядре через sendfile.
+    @return: True/False - способ не применим.
+    """
+    if SENDFILE_METHOD in _DISABLED_METHODS or not hasattr(os, 'sendfile'):
+        return False
+    offset = 0
+    try:
+        while True:
+            count = os.sendfile(iDstFD, iSrcFD, offset, COPY_BLOCK_SIZE)
+            if not count:
+                return True
+            offset += count
+    except OSError as err:
+        if offset or err.errno not in _UNSUPPORTED_ERRORS:
+            raise
+        _disable_method(SENDFILE_METHOD, err)
+    return False
+
+
+def _read_write(iSrcFD, iDstFD):
+    """
+    Копирование чтением и записью блоками.
+    """
+    block = os.read(iSrcFD, COPY_BLOCK_SIZE)
+    while block:
+        view = memoryview(block)
+        while view:
+            view = view[os.write(iDstFD, view):]
+        block = os.read(iSrcFD, COPY_BLOCK_SIZE)
+    return True
+
+
+def copy_fd(iSrcFD, iDstFD):
+    """
+    Копировать содержимое файла по дескрипторам.
+    Файл-назначение должен быть пустым.
+    @return: Способ копирования (*_METHOD).
+    """
+    if _reflink(iSrcFD, iDstFD):
+        return REFLINK_METHOD
+    if _copy_range(iSrcFD, iDstFD):
+        return COPY_RANGE_METHOD
+    if _sendfile(iSrcFD, iDstFD):
+        return SENDFILE_METHOD
+    _read_write(iSrcFD, iDstFD)
+    return READ_WRITE_METHOD
+
+
+def reflink_file(sSrcFileName, sDstFileName):
+    """
+    Создать копию файла без копирования данных (FICLONE).
+    @return: True - копия создана, False - файловая система не поддерживает reflink
+        (файл-назначение не создается).
+    """
+    src_fd = os.open(sSrcFileName, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+    try:
+        dst_fd = os.open(sDstFileName, WRITE_FILE_FLAGS, 0o600)
+        try:
+            is_reflink = _reflink(src_fd, dst_fd)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    if not is_reflink:
+        os.remove(sDstFileName)
+    return is_reflink
+
+
+def copy_file(sSrcFileName, sDstFileName, bPreserve=False, bSetOwner=None):
+    """
+    Копировать файл.
+    Существующий файл-назначение заменяется новым файлом (а не перезаписывается),
+    поэтому жесткие ссылки на него (см. dedup) не изменяются.
+    @param sSrcFileName: Имя файла-источника.
+    @param sDstFileName: Имя файла-назначения.
+    @param bPreserve: Сохранить режим доступа и время изменения?
+    @param bSetOwner: Сохранить владельца? Если не указано, то владелец
+        сохраняется при bPreserve и правах root.
+    @return: Способ копирования (*_METHOD).
+    """
+    src_fd = os.open(sSrcFileName, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+    try:
+        src_stat = os.fstat(src_fd)
+        if os.path.islink(sDstFileName) or (os.path.exists(sDstFileName) and not os.path.isdir(sDstFileName)):
+            os.remove(sDstFileName)
+        dst_fd = os.open(sDstFileName, WRITE_FILE_FLAGS, 0o666)
+        try:
+            method = copy_fd(src_fd, dst_fd)
+            if bSetOwner is None:
+                bSetOwner = bPreserve and hasattr(os, 'geteuid') and os.geteuid() == 0
+            if bSetOwner:
+                os.fchown(dst_fd, src_stat.st_uid, src_stat.st_gid)
+            if bPreserve:
+                os.fchmod(dst_fd, stat.S_IMODE(src_stat.st_mode))
+                os.utime(dst_fd, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    return method
+
+
+class icCopyResult:
+    """
+    Результат копирования папки.
+    """
+    def __init__(self, sSrcDir, sDstDir):
+        self.src_dir = sSrcDir
+        self.dst_dir = sDstDir
+        # Количество скопированных файлов по способам копирования
+        self.methods = {}
+        # Ошибки копирования: [(Полный путь, Текст ошибки), ...]
+        self.errors = []
+
+    def add_error(self, sPath, error):
+        self.errors.append((sPath, str(error)))
+
+    def get_copied(self):
+        """
+        Количество скопированных файлов.
+        """
+        return sum(self.methods.values())
+
+    def is_ok(self):
+        return not self.errors
+
+    def __bool__(self):
+        return self.is_ok()
+
+
+def _copy_files(lFiles, bSetOwner):
+    """
+    Копировать группу файлов.
+    Выполняется в потоке пула.
+    @return: Список кортежей (Файл-источник, Способ копирования или None, Ошибка или None).
+    """
+    results = []
+    for src, dst in lFiles:
+        try:
+            results.append((src, copy_file(src, dst, True, bSetOwner), None))
+        except OSError as err:
+            results.append((src, None, err))
+    return results
+
+
+def _copy_dir_attributes(sSrcDir, sDstDir, bSetOwner):
+    src_stat = os.lstat(sSrcDir)
+    if bSetOwner:
+        os.lchown(sDstDir, src_stat.st_uid, src_stat.st_gid)
+    os.chmod(sDstDir, stat.S_IMODE(src_stat.st_mode))
+    os.utime(sDstDir, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+
+def copy_tree(sSrcDir, sDstDir, iWorkers=None, iBatchCount=64):
+    """
+    Копировать папку параллельно по файлам.
+    Режим доступа, время изменения и владелец (с правами root) сохраняются.
+    Символические ссылки копируются как ссылки.
+    Существующие файлы заменяются, существующие папки объединяются.
+    @param sSrcDir: Папка-источник.
+    @param sDstDir: Папка-назначение.
+    @param iWorkers: Количество потоков. Если не указано, то определяется
+        по количеству ядер.
+    @param iBatchCount: Количество файлов, копируемых одной задачей пула.
+    @return: Результат копирования icCopyResult.
+    """
+    result = icCopyResult(sSrcDir, sDstDir)
+    set_owner = hasattr(os, 'geteuid') and os.geteuid() == 0
+    dirs = []
+    files = []
+    for root, dir_names, file_names in os.walk(sSrcDir):
+        rel_dir = os.path.relpath(root, sSrcDir)
+        dst_dir = os.path.normpath(os.path.join(sDstDir, rel_dir))
+        try:
+            os.makedirs(dst_dir, exist_ok=True)
+            dirs.append((root, dst_dir))
+        except OSError as err:
+            result.add_error(root, err)
+            dir_names[:] = []
+            continue
+        for name in dir_names + file_names:
+            src = os.path.join(root, name)
+            dst = os.path.join(dst_dir, name)
+            if os.path.islink(src):
+                # Ссылки на папки os.walk не обходит
+                try:
+                    if os.path.lexists(dst) and (os.path.islink(dst) or not os.path.isdir(dst)):
+                        os.remove(dst)
+                    os.symlink(os.readlink(src), dst)
+                    if set_owner:
+                        link_stat = os.lstat(src)
+                        os.lchown(dst, link_stat.st_uid, link_stat.st_gid)
+                    result.methods['symlink'] = result.methods.get('symlink', 0) + 1
+                except OSError as err:
+                    result.add_error(src, err)
+            elif name in file_names:
+                files.append((src, dst))
+
+    workers = iWorkers or max(COPY_MIN_WORKERS, os.cpu_count() or 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_copy_files, files[i:i + iBatchCount], set_owner)
+                   for i in range(0, len(files), iBatchCount)]
+        for future in futures:
+            for src, method, err in future.result():
+                if err is not None:
+                    result.add_error(src, err)
+                else:
+                    result.methods[method] = result.methods.get(method, 0) + 1
+
+    # Атрибуты папок устанавливаются после копирования их содержимого
+    for src_dir, dst_dir in reversed(dirs):
+        try:
+            _copy_dir_attributes(src_dir, dst_dir, set_owner)
+        except OSError as err:
+            result.add_error(src_dir, err)
+
+    for path, error in result.errors:
+        log.error(u'Ошибка копирования <%s>: %s' % (path, error))
+    log.info(u'Копирование <%s> в <%s>. Файлов: %d %s. Ошибок: %d' % (sSrcDir, sDstDir, result.get_copied(),
+                                                                     result.methods, len(result.errors)))
+    return result
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Отпечатки инсталляционных архивов и инсталляционных папок.
+
+Используются для инкрементальной инсталляции:
+программа не переустанавливается, если ее архив и
+инсталляционная папка не изменились с момента последней инсталляции.
+
+Отпечаток инсталлированной программы вычисляется по файлам ее манифеста
+(см. manifest), поэтому файлы, созданные при работе программы
+(__pycache__, журналы, файлы пользователя), его не изменяют.
+Отпечаток папки используется, только если манифеста у программы нет.
+
+Кеш отпечатков - JSON файл следующего формата:
+{
+'programms': {<Имя программы>: {'archive': <Отпечаток архива>,
+                                'target': <Инсталляционная папка>,
+                                'manifest': <Отпечаток файлов манифеста>}, ...},
+'targets': {<Инсталляционная папка>: <Отпечаток папки>, ...},
+'hashes': {<Ключ архива>: <Хеш архива>, ...},
+}
+Отпечаток папки хранится отдельно от программ, т.к. в одну папку
+могут устанавливаться несколько программ. После инсталляции
+любой из них отпечаток папки обновляется для всех.
+"""
+
+import os
+import os.path
+import stat
+import json
+import hashlib
+import threading
+
+from . import log
+from . import util
+from . import staging
+from . import manifest
+
+__version__ = (0, 1, 1, 1)
+
+FINGERPRINT_CACHE_FILE_NAME = 'fingerprints.json'
+
+# Размер блока чтения файла при хешировании
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Папки, не учитываемые в отпечатке папки:
+# кеш байткода Python и папки замены пакета (см. staging)
+SKIP_DIR_NAMES = ('__pycache__',)
+SKIP_DIR_PREFIXES = (staging.STAGE_DIR_PREFIX, staging.OLD_DIR_PREFIX)
+
+
+def get_file_hash(sFileName, sHashName='sha256', iBlockSize=HASH_BLOCK_SIZE):
+    """
+    Хеш содержимого файла.
+    @param sFileName: Полное имя файла.
+    @param sHashName: Имя алгоритма хеширования (sha256, blake2b, ...).
+    @param iBlockSize: Размер блока чтения.
+    @return: Шестнадцатиричная строка хеша.
+    """
+    hash_obj = hashlib.new(sHashName)
+    with open(sFileName, 'rb') as hash_file:
+        block = hash_file.read(iBlockSize)
+        while block:
+            hash_obj.update(block)
+            block = hash_file.read(iBlockSize)
+    return hash_obj.hexdigest()
+
+
+def get_dir_fingerprint(sDir):
+    """
+    Отпечаток папки.
+    Вычисляется по относительным путям, размерам и времени изменения
+    всех файлов дерева папки. Содержимое файлов не читается.
+    Время изменения папок и папки SKIP_DIR_NAMES/SKIP_DIR_PREFIXES
+    не учитываются.
+    @param sDir: Папка.
+    @return: Шестнадцатиричная строка отпечатка или None, если папки нет.
+    """
+    if not sDir or not os.path.isdir(sDir):
+        return None
+
+    hash_obj = hashlib.blake2b(digest_size=16)
+    dirs = [sDir]
+    while dirs:
+        cur_dir = dirs.pop()
+        try:
+            entries = sorted(os.scandir(cur_dir), key=lambda entry: entry.name)
+        except OSError:
+            log.warning(u'Отпечаток. Ошибка чтения папки <%s>' % cur_dir)
+            continue
+        for entry in entries:
+            rel_path = os.path.relpath(entry.path, sDir)
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name in SKIP_DIR_NAMES or entry.name.startswith(SKIP_DIR_PREFIXES):
+                    continue
+                hash_obj.update(('%s\0dir\n' % rel_path).encode('utf-8', 'surrogateescape'))
+                dirs.append(entry.path)
+                continue
+            try:
+                entry_stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            hash_obj.update(('%s\0%d\0%d\0%d\n' % (rel_path, entry_stat.st_mode,
+                                                   entry_stat.st_size, entry_stat.st_mtime_ns)).encode('utf-8',
+                                                                                                      'surrogateescape'))
+    return hash_obj.hexdigest()
+
+
+def get_manifest_fingerprint(Manifest):
+    """
+    Отпечаток файлов пакета по его манифесту.
+    Вычисляется по путям, режимам доступа, размерам и времени изменения
+    файлов и ссылок манифеста на диске. Папки учитываются только по наличию.
+    Файлы, не входящие в манифест, не учитываются.
+    @param Manifest: Манифест пакета (manifest.icPackageManifest).
+    @return: Шестнадцатиричная строка отпечатка или None,
+        если манифест не удалось прочитать.
+    """
+    try:
+        entries = sorted(Manifest.get_entries(), key=lambda entry: entry.path)
+    except (OSError, ValueError, EOFError) as err:
+        log.warning(u'Отпечаток. Ошибка чтения манифеста: %s' % err)
+        return None
+
+    hash_obj = hashlib.blake2b(digest_size=16)
+    for entry in entries:
+        try:
+            entry_stat = os.lstat(Manifest.get_full_path(entry))
+        except OSError:
+            line = '%s\0-\n' % entry.path
+        else:
+            if entry.type == manifest.DIR_TYPE:
+                line = '%s\0%s\0%d\n' % (entry.path, entry.type, stat.S_ISDIR(entry_stat.st_mode))
+            else:
+                line = '%s\0%s\0%d\0%d\0%d\n' % (entry.path, entry.type, entry_stat.st_mode,
+                                                   entry_stat.st_size, entry_stat.st_mtime_ns)
+        hash_obj.update(line.encode('utf-8', 'surrogateescape'))
+    return hash_obj.hexdigest()
+
+
+class icFingerprintCache:
+    """
+    Кеш отпечатков инсталлированных программ.
+    """
+    def __init__(self, sCacheFileName):
+        """
+        Конструктор.
+        @param sCacheFileName: Полное имя файла кеша.
+        """
+        self._cache_file_name = sCacheFileName
+        self._cache = None
+        self._lock = threading.RLock()
+
+    def get_cache_file_name(self):
+        """
+        Полное имя файла кеша.
+        """
+        return self._cache_file_name
+
+    def load(self):
+        """
+        Загрузить кеш.
+        """
+        with self._lock:
+            self._cache = dict(programms={}, targets={}, hashes={})
+            if os.path.exists(self._cache_file_name):
+                try:
+                    with open(self._cache_file_name, 'rt') as cache_file:
+                        self._cache.update(json.load(cache_file))
+                except:
+                    log.fatal(u'Ошибка загрузки кеша отпечатков <%s>' % self._cache_file_name)
+            return self._cache
+
+    def save(self):
+        """
+        Сохранить кеш.
+        Запись производится через временный файл, чтобы
+        прерванная запись не испортила кеш.
+        """
+        with self._lock:
+            if self._cache is None:
+                return False
+            tmp_file_name = self._cache_file_name + '.tmp'
+            try:
+                path = os.path.dirname(self._cache_file_name)
+                if path and not os.path.exists(path):
+                    os.makedirs(path)
+                with open(tmp_file_name, 'wt') as cache_file:
+                    json.dump(self._cache, cache_file, indent=1)
+                os.replace(tmp_file_name, self._cache_file_name)
+                return True
+            except:
+                log.fatal(u'Ошибка сохранения кеша отпечатков <%s>' % self._cache_file_name)
+        return False
+
+    def _get_cache(self):
+        if self._cache is None:
+            self.load()
+        return self._cache
+
+    def get_archive_fingerprint(self, sFileName, sHashName=None):
+        """
+        Отпечаток инсталляционного архива.
+        @param sFileName: Полное имя архива.
+        @param sHashName: Алгоритм хеширования содержимого архива.
+            Если не указан, то отпечаток определяется только по имени,
+            размеру и времени изменения файла.
+            Хеш вычисляется один раз для одних и тех же имени, размера и времени изменения.
+        @return: Словарь отпечатка или None, если архив не найден.
+        """
+        fingerprint = util.get_file_identity(sFileName)
+        if fingerprint is None or not sHashName:
+            return fingerprint
+
+        hash_key = '%s:%s:%s:%s' % (sHashName, fingerprint['path'], fingerprint['size'], fingerprint['mtime'])
+        with self._lock:
+            hashes = self._get_cache()['hashes']
+            if hash_key not in hashes:
+                hashes[hash_key] = get_file_hash(sFileName, sHashName)
+            fingerprint['hash'] = hashes[hash_key]
+        return fingerprint
+
+    def is_unchanged(self, sName, dArchiveFingerprint, sTargetDir=None, Manifest=None):
+        """
+        Программа уже установлена из того же архива в неизмененную папку?
+        @param sName: Имя программы.
+        @param dArchiveFingerprint: Текущий отпечаток архива.
+        @param sTargetDir: Инсталляционная папка программы.
+            Если не указана, то папка не проверяется.
+        @param Manifest: Манифест пакета программы (manifest.icPackageManifest).
+            Если указан, то проверяются только файлы манифеста.
+        @return: True/False.
+        """
+        with self._lock:
+            cache = self._get_cache()
+            record = cache['programms'].get(sName, None)
+            if not record or dArchiveFingerprint is None or record.get('archive', None) != dArchiveFingerprint:
+                return False
+            if sTargetDir is None:
+                return True
+            if record.get('target', None) != sTargetDir:
+                return False
+            manifest_fingerprint = record.get('manifest', None)
+            target_fingerprint = cache['targets'].get(sTargetDir, None)
+        if Manifest is not None and manifest_fingerprint is not None:
+            return manifest_fingerprint == get_manifest_fingerprint(Manifest)
+        return target_fingerprint is not None and target_fingerprint == get_dir_fingerprint(sTargetDir)
+
+    def has_programm(self, sName):
+        """
+        Есть ли в кеше отпечаток программы?
+        @param sName: Имя программы.
+        """
+        with self._lock:
+            return sName in self._get_cache()['programms']
+
+    def get_programm_archive_fingerprint(self, sName):
+        """
+        Отпечаток архива, из которого установлена программа.
+        @param sName: Имя программы.
+        @return: Словарь отпечатка или None.
+        """
+        with self._lock:
+            record = self._get_cache()['programms'].get(sName, None)
+            return record.get('archive', None) if record else None
+
+    def update(self, sName, dArchiveFingerprint, sTargetDir=None, Manifest=None):
+        """
+        Зарегистрировать отпечатки установленной программы.
+        @param sName: Имя программы.
+        @param dArchiveFingerprint: Отпечаток архива.
+        @param sTargetDir: Инсталляционная папка программы.
+        @param Manifest: Манифест пакета программы (manifest.icPackageManifest).
+        @return: True/False.
+        """
+        manifest_fingerprint = get_manifest_fingerprint(Manifest) if Manifest is not None and sTargetDir else None
+        with self._lock:
+            cache = self._get_cache()
+            cache['programms'][sName] = dict(archive=dArchiveFingerprint, target=sTargetDir)
+            if manifest_fingerprint is not None:
+                cache['programms'][sName]['manifest'] = manifest_fingerprint
+            if sTargetDir:
+                cache['targets'][sTargetDir] = get_dir_fingerprint(sTargetDir)
+            return self.save()
+
+    def remove(self, sName):
+        """
+        Удалить отпечаток программы из кеша.
+        @param sName: Имя программы.
+        """
+        with self._lock:
+            cache = self._get_cache()
+            if sName in cache['programms']:
+                del cache['programms'][sName]
+                return self.save()
+        return False
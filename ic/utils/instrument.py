@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Измерение ресурсов, затраченных на выполнение шагов сценария.
+
+Для каждого шага определяется:
+    wall - время выполнения (сек)
+    cpu - процессорное время потока шага и завершенных дочерних процессов (сек)
+    read_bytes/write_bytes - объем чтения/записи на диск по /proc/self/io
+    processes - количество запущенных подпроцессов
+    files - количество созданных файлов
+    dirs - количество созданных папок
+
+Подпроцессы и создаваемые файлы учитываются с помощью audit hook
+(sys.addaudithook) в потоке, выполняющем шаг. Файлы, созданные
+внешними программами (tar, unzip, dpkg) не учитываются.
+Показатели /proc/self/io и процессорное время дочерних процессов
+общие для всего процесса инсталлятора, поэтому при параллельном
+выполнении шагов они включают работу одновременно выполняемых шагов.
+"""
+
+import os
+import os.path
+import sys
+import json
+import time
+import threading
+
+from . import log
+
+__version__ = (0, 1, 1, 1)
+
+PROC_SELF_IO_FILE_NAME = '/proc/self/io'
+
+# События аудита запуска подпроцессов
+PROCESS_AUDIT_EVENTS = ('subprocess.Popen', 'os.system', 'os.spawn', 'os.fork', 'os.forkpty')
+
+# Текущие измерители потоков
+_THREAD_LOCAL = threading.local()
+_AUDIT_HOOK_LOCK = threading.Lock()
+_AUDIT_HOOK_INSTALLED = False
+
+
+def read_proc_io():
+    """
+    Прочитать счетчики ввода/вывода процесса.
+    @return: Словарь счетчиков /proc/self/io или пустой словарь,
+        если счетчики не доступны.
+    """
+    try:
+        with open(PROC_SELF_IO_FILE_NAME, 'rt') as io_file:
+            return dict([(line.split(':')[0].strip(), int(line.split(':')[1])) for line in io_file if ':' in line])
+    except (OSError, ValueError):
+        return {}
+
+
+def _audit_hook(event, args):
+    """
+    Обработчик событий аудита.
+    Учитывает события в измерителе текущего потока.
+    """
+    instrument = getattr(_THREAD_LOCAL, 'instrument', None)
+    if instrument is None or getattr(_THREAD_LOCAL, 'in_hook', False):
+        return
+    _THREAD_LOCAL.in_hook = True
+    try:
+        if event in PROCESS_AUDIT_EVENTS:
+            instrument.processes += 1
+        elif event == 'open':
+            path, mode, flags = args
+            if isinstance(path, int) or path is None:
+                return
+            if isinstance(flags, int) and flags & os.O_CREAT or isinstance(mode, str) and ('w' in mode or 'x' in mode):
+                if not os.path.exists(path):
+                    instrument.files += 1
+        elif event == 'os.mkdir':
+            instrument.dirs += 1
+    except Exception:
+        pass
+    finally:
+        _THREAD_LOCAL.in_hook = False
+
+
+def install_audit_hook():
+    """
+    Установить обработчик событий аудита.
+    Обработчик устанавливается один раз и не может быть удален.
+    """
+    global _AUDIT_HOOK_INSTALLED
+    with _AUDIT_HOOK_LOCK:
+        if not _AUDIT_HOOK_INSTALLED and hasattr(sys, 'addaudithook'):
+            sys.addaudithook(_audit_hook)
+            _AUDIT_HOOK_INSTALLED = True
+    return _AUDIT_HOOK_INSTALLED
+
+
+class icStepInstrument:
+    """
+    Измеритель ресурсов шага сценария.
+    Используется как контекстный менеджер в потоке, выполняющем шаг:
+        with icStepInstrument() as instrument:
+            ...
+        stats = instrument.get_stats()
+    """
+    def __init__(self):
+        self.processes = 0
+        self.files = 0
+        self.dirs = 0
+
+        self._start_time = None
+        self._start_wall = None
+        self._start_cpu = None
+        self._start_children_cpu = None
+        self._start_io = None
+        self._stats = None
+
+    def start(self):
+        """
+        Начать измерение.
+        """
+        install_audit_hook()
+        _THREAD_LOCAL.instrument = self
+        times = os.times()
+        self._start_io = read_proc_io()
+        self._start_children_cpu = times.children_user + times.children_system
+        self._start_cpu = time.thread_time()
+        self._start_time = time.time()
+        self._start_wall = time.perf_counter()
+        return self
+
+    def stop(self):
+        """
+        Закончить измерение.
+        @return: Словарь показателей.
+        """
+        wall = time.perf_counter() - self._start_wall
+        cpu = time.thread_time() - self._start_cpu
+        times = os.times()
+        children_cpu = times.children_user + times.children_system - self._start_children_cpu
+        io = read_proc_io()
+        _THREAD_LOCAL.instrument = None
+
+        self._stats = dict(start=self._start_time, wall=wall, cpu=cpu + children_cpu,
+                           read_bytes=io.get('read_bytes', 0) - self._start_io.get('read_bytes', 0) if io else None,
+                           write_bytes=io.get('write_bytes', 0) - self._start_io.get('write_bytes', 0) if io else None,
+                           processes=self.processes, files=self.files, dirs=self.dirs)
+        return self._stats
+
+    def get_stats(self):
+        """
+        Показатели последнего измерения.
+        """
+        return self._stats
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+def _format_bytes(iBytes):
+    """
+    Размер в удобочитаемом виде.
+    """
+    if iBytes is None:
+        return '-'
+    size = float(iBytes)
+    for unit in ('B', 'K', 'M', 'G'):
+        if abs(size) < 1024 or unit == 'G':
+            return '%.1f%s' % (size, unit) if unit != 'B' else '%d%s' % (size, unit)
+        size /= 1024
+
+
+def format_summary_table(lStepResults):
+    """
+    Таблица показателей выполнения шагов сценария в текстовом виде.
+    @param lStepResults: Список результатов шагов (см. scenario_executor.get_step_results).
+    @return: Текст таблицы.
+    """
+    header = (u'Шаг', u'Сост.', u'Время', u'CPU', u'Чтение', u'Запись', u'Проц.', u'Файлы')
+    rows = []
+    for step in lStepResults or ():
+        stats = step.get('stats', None) or {}
+        rows.append((str(step.get('name', '')), str(step.get('state', '')),
+                     '%.1f' % stats['wall'] if 'wall' in stats else '-',
+                     '%.2f' % stats['cpu'] if 'cpu' in stats else '-',
+                     _format_bytes(stats.get('read_bytes', None)),
+                     _format_bytes(stats.get('write_bytes', None)),
+                     str(stats.get('processes', '-')), str(stats.get('files', '-'))))
+    widths = [max([len(row[i]) for row in rows + [header]]) for i in range(len(header))]
+    lines = [u'  '.join([value.ljust(widths[i]) for i, value in enumerate(row)]) for row in [header] + rows]
+    total_wall = sum([(step.get('stats', None) or {}).get('wall', 0) for step in lStepResults or ()])
+    lines.append(u'%s: %.1f' % (u'Суммарное время шагов', total_wall))
+    return u'\n'.join(lines)
+
+
+def save_report(sReportFileName, dReport):
+    """
+    Сохранить отчет о выполнении сценария в JSON файл.
+    @param sReportFileName: Полное имя файла отчета.
+    @param dReport: Словарь отчета.
+    @return: True/False.
+    """
+    tmp_file_name = sReportFileName + '.tmp'
+    try:
+        path = os.path.dirname(sReportFileName)
+        if path and not os.path.exists(path):
+            os.makedirs(path)
+        with open(tmp_file_name, 'wt') as report_file:
+            # Результаты шагов могут быть не сериализуемыми объектами
+            json.dump(dReport, report_file, indent=1, default=str)
+        os.replace(tmp_file_name, sReportFileName)
+        return True
+    except:
+        log.fatal(u'Ошибка сохранения отчета выполнения сценария <%s>' % sReportFileName)
+    return False
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Проверка файлов инсталлированного пакета по манифесту (см. manifest).
+
+Режимы проверки:
+    STAT_CHECK - только по атрибутам файлов (тип, размер, время изменения, режим доступа),
+    AUTO_CHECK - по атрибутам, хеш содержимого вычисляется только для файлов,
+        у которых совпадает размер, но отличается время изменения,
+    HASH_CHECK - хеш содержимого вычисляется для всех файлов.
+Элементы манифеста проверяются в пуле потоков (stat и чтение файлов
+освобождают GIL).
+"""
+
+import os
+import os.path
+import stat
+import concurrent.futures
+
+from . import log
+from . import manifest
+
+__version__ = (0, 1, 1, 1)
+
+# Режимы проверки
+STAT_CHECK = 'stat'
+AUTO_CHECK = 'auto'
+HASH_CHECK = 'hash'
+
+# Результаты проверки элемента манифеста
+MISSING_STATUS = 'missing'
+TYPE_STATUS = 'type'
+SIZE_STATUS = 'size'
+MTIME_STATUS = 'mtime'
+MODE_STATUS = 'mode'
+HASH_STATUS = 'hash'
+LINK_STATUS = 'link'
+ERROR_STATUS = 'error'
+
+# Минимальное количество потоков проверки
+CHECK_MIN_WORKERS = 4
+# Количество элементов манифеста, проверяемых одной задачей пула
+CHECK_BATCH_COUNT = 256
+
+
+class icCheckResult:
+    """
+    Результат проверки файлов пакета.
+    """
+    def __init__(self, sPackageName, sBaseDir, sMode=AUTO_CHECK):
+        """
+        Конструктор.
+        @param sPackageName: Имя пакета.
+        @param sBaseDir: Базовая папка манифеста.
+        @param sMode: Режим проверки.
+        """
+        self.package_name = sPackageName
+        self.base_dir = sBaseDir
+        self.mode = sMode
+        # Количество проверенных элементов манифеста
+        self.checked = 0
+        # Отличающиеся элементы: [(Элемент манифеста, Результат проверки), ...]
+        self.damaged = []
+
+    def is_ok(self):
+        """
+        Файлы пакета соответствуют манифесту?
+        """
+        return not self.damaged
+
+    def __bool__(self):
+        return self.is_ok()
+
+    def get_damaged_paths(self):
+        """
+        Пути отличающихся элементов относительно базовой папки.
+        """
+        return [entry.path for entry, status in self.damaged]
+
+    def to_dict(self):
+        return dict(name=self.package_name, dir=self.base_dir, mode=self.mode, checked=self.checked,
+                    result=self.is_ok(),
+                    damaged=[dict(path=entry.path, status=status) for entry, status in self.damaged])
+
+
+def check_entry(Manifest, entry, sMode=AUTO_CHECK):
+    """
+    Проверить элемент манифеста.
+    @param Manifest: Манифест пакета (manifest.icPackageManifest).
+    @param entry: Элемент манифеста (manifest.icManifestEntry).
+    @param sMode: Режим проверки.
+    @return: None - элемент соответствует манифесту или результат проверки (*_STATUS).
+    """
+    full_path = Manifest.get_full_path(entry)
+    try:
+        file_stat = os.lstat(full_path)
+    except FileNotFoundError:
+        return MISSING_STATUS
+    except OSError:
+        return ERROR_STATUS
+
+    if entry.type == manifest.DIR_TYPE:
+        return None if stat.S_ISDIR(file_stat.st_mode) else TYPE_STATUS
+    elif entry.type == manifest.LINK_TYPE:
+        if not stat.S_ISLNK(file_stat.st_mode):
+            return TYPE_STATUS
+        try:
+            return None if os.readlink(full_path) == entry.hash else LINK_STATUS
+        except OSError:
+            return ERROR_STATUS
+
+    if not stat.S_ISREG(file_stat.st_mode):
+        return TYPE_STATUS
+    if file_stat.st_size != entry.size:
+        return SIZE_STATUS
+    is_mtime = int(file_stat.st_mtime) == entry.mtime
+    if sMode == HASH_CHECK or (sMode == AUTO_CHECK and not is_mtime):
+        try:
+            if entry.hash and manifest.get_file_hash(full_path) != entry.hash:
+                return HASH_STATUS
+        except OSError:
+            return ERROR_STATUS
+    elif not is_mtime:
+        return MTIME_STATUS
+    # Режим доступа 0 - не указан (манифесты zip архивов DOS/Windows)
+    if entry.mode and stat.S_IMODE(file_stat.st_mode) != entry.mode:
+        return MODE_STATUS
+    return None
+
+
+def _check_entries(Manifest, lEntries, sMode):
+    """
+    Проверить группу элементов манифеста.
+    Выполняется в потоке пула.
+    @return: Список кортежей (Элемент, Результат проверки) отличающихся элементов.
+    """
+    damaged = []
+    for entry in lEntries:
+        status = check_entry(Manifest, entry, sMode)
+        if status is not None:
+            damaged.append((entry, status))
+    return damaged
+
+
+def _submit_check(Manifest, sMode, Pool, lEntries=None):
+    """
+    Поставить проверку файлов пакета в очередь пула потоков.
+    @return: Кортеж (Результат проверки icCheckResult, Список задач пула).
+    """
+    entries = Manifest.get_entries() if lEntries is None else lEntries
+    # Базовая папка определена после загрузки манифеста
+    result = icCheckResult(Manifest.package_name, Manifest.base_dir, sMode)
+    result.checked = len(entries)
+    futures = [Pool.submit(_check_entries, Manifest, entries[i:i + CHECK_BATCH_COUNT], sMode)
+               for i in range(0, len(entries), CHECK_BATCH_COUNT)]
+    return result, futures
+
+
+def _collect_check(result, lFutures):
+    """
+    Дождаться проверки файлов пакета.
+    """
+    for future in lFutures:
+        result.damaged.extend(future.result())
+    if result.damaged:
+        log.warning(u'Проверка пакета <%s>. Отличаются от манифеста: %d из %d' % (result.package_name,
+                                                                                len(result.damaged),
+                                                                                result.checked))
+    else:
+        log.info(u'Проверка пакета <%s>. Элементов: %d. Ошибок нет' % (result.package_name, result.checked))
+    return result
+
+
+def _get_workers(iWorkers=None):
+    return iWorkers or max(CHECK_MIN_WORKERS, os.cpu_count() or 1)
+
+
+def check_manifest(Manifest, sMode=AUTO_CHECK, iWorkers=None, lEntries=None):
+    """
+    Проверить файлы пакета по манифесту.
+    @param Manifest: Манифест пакета (manifest.icPackageManifest).
+    @param sMode: Режим проверки: STAT_CHECK, AUTO_CHECK или HASH_CHECK.
+    @param iWorkers: Количество потоков. Если не указано, то определяется
+        по количеству ядер.
+    @param lEntries: Проверяемые элементы манифеста. Если не указаны, то все элементы.
+    @return: Результат проверки icCheckResult.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_get_workers(iWorkers)) as pool:
+        return _collect_check(*_submit_check(Manifest, sMode, pool, lEntries))
+
+
+def verify_packages(LogManager, sMode=STAT_CHECK, iWorkers=None, lPackageNames=None):
+    """
+    Проверить файлы инсталлированных пакетов по манифестам.
+    Элементы всех пакетов проверяются в общем пуле потоков.
+    @param LogManager: Менеджер журналирования инсталляции.
+    @param sMode: Режим проверки: STAT_CHECK, AUTO_CHECK или HASH_CHECK.
+    @param iWorkers: Количество потоков.
+    @param lPackageNames: Имена проверяемых пакетов. Если не указаны, то все пакеты install.log.
+    @return: Словарь отчета:
+        {'result': True/False, 'install_log': Файл install.log, 'mode': Режим проверки,
+         'packages': [Результат проверки пакета (см. icCheckResult.to_dict), ...],
+         'no_manifest': [Имена пакетов без манифеста, ...],
+         'not_installed': [Имена не инсталлированных пакетов из lPackageNames, ...]}
+    """
+    install_log_file_name = LogManager.get_install_log_file_name()
+    report = dict(result=True, install_log=install_log_file_name, mode=sMode, packages=[],
+                  no_manifest=[], not_installed=[])
+    packages = LogManager.load_packages() if os.path.exists(install_log_file_name) else dict()
+    package_names = list(packages.keys()) if lPackageNames is None else lPackageNames
+
+    checks = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_get_workers(iWorkers)) as pool:
+        for package_name in package_names:
+            if package_name not in packages:
+                log.warning(u'Пакет <%s> не инсталлирован' % package_name)
+                report['not_installed'].append(package_name)
+                continue
+            package_manifest = LogManager.get_package_manifest(package_name)
+            if package_manifest is None:
+                log.warning(u'Проверка пакета <%s>. Манифест пакета не сохранен' % package_name)
+                report['no_manifest'].append(package_name)
+                continue
+            try:
+                checks.append(_submit_check(package_manifest, sMode, pool))
+            except (OSError, ValueError, EOFError) as err:
+                log.error(u'Ошибка загрузки манифеста пакета <%s>: %s' % (package_name, err))
+                report['packages'].append(dict(name=package_name, dir=packages[package_name], mode=sMode,
+                                               checked=0, result=False, damaged=[], error=str(err)))
+        for result, futures in checks:
+            report['packages'].append(_collect_check(result, futures).to_dict())
+    report['result'] = not report['not_installed'] and all([package['result'] for package in report['packages']])
+    return report
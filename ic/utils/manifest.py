@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Манифест файлов инсталлированного пакета.
+
+Манифест формируется разархиватором во время записи файлов
+(см. extract) и сохраняется в папке manifests рядом с install.log.
+Используется для деинсталляции, проверки и восстановления
+инсталлированных файлов без обхода всего дерева папок.
+
+Формат файла манифеста - сжатый gzip текст с разделителями-табуляциями:
+    # icmanifest <Версия> <Имя пакета> <Базовая папка> <Алгоритм хеширования>
+    <Путь> <Тип> <Размер> <Режим доступа> <Время изменения> <Хеш или цель ссылки>
+    ...
+Путь указывается относительно базовой папки (папки разархивирования).
+Тип: 'f' - файл, 'd' - папка, 'l' - символическая ссылка.
+Режим доступа в восьмеричном виде, время изменения - целое число секунд.
+Символы табуляции, перевода строки и обратной косой черты в
+путях экранируются.
+"""
+
+import os
+import os.path
+import gzip
+import hashlib
+import threading
+import urllib.parse
+
+from . import log
+
+__version__ = (0, 1, 1, 1)
+
+MANIFEST_VERSION = 1
+MANIFEST_SIGNATURE = '# icmanifest'
+MANIFESTS_DIR_NAME = 'manifests'
+MANIFEST_FILE_EXT = '.tsv.gz'
+
+# Алгоритм хеширования содержимого файлов
+MANIFEST_HASH_NAME = 'blake2b-160'
+MANIFEST_DIGEST_SIZE = 20
+
+# Типы элементов манифеста
+FILE_TYPE = 'f'
+DIR_TYPE = 'd'
+LINK_TYPE = 'l'
+
+_ESCAPES = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'))
+
+
+def create_hash():
+    """
+    Создать объект вычисления хеша содержимого файла для манифеста.
+    """
+    return hashlib.blake2b(digest_size=MANIFEST_DIGEST_SIZE)
+
+
+def get_file_hash(sFileName, iBlockSize=1024 * 1024):
+    """
+    Хеш содержимого файла в формате манифеста.
+    """
+    hash_obj = create_hash()
+    with open(sFileName, 'rb') as hash_file:
+        block = hash_file.read(iBlockSize)
+        while block:
+            hash_obj.update(block)
+            block = hash_file.read(iBlockSize)
+    return hash_obj.hexdigest()
+
+
+def _escape(sText):
+    for char, escape in _ESCAPES:
+        sText = sText.replace(char, escape)
+    return sText
+
+
+def _unescape(sText):
+    if '\\' not in sText:
+        return sText
+    result = []
+    i = 0
+    while i < len(sText):
+        if sText[i] == '\\' and i + 1 < len(sText):
+            result.append({'t': '\t', 'n': '\n'}.get(sText[i + 1], sText[i + 1]))
+            i += 2
+        else:
+            result.append(sText[i])
+            i += 1
+    return ''.join(result)
+
+
+def get_manifest_file_name(sManifestsDir, sPackageName):
+    """
+    Полное имя файла манифеста пакета.
+    @param sManifestsDir: Папка манифестов.
+    @param sPackageName: Имя пакета.
+    """
+    return os.path.join(sManifestsDir, urllib.parse.quote(sPackageName.strip(), safe='') + MANIFEST_FILE_EXT)
+
+
+class icManifestEntry:
+    """
+    Элемент манифеста.
+    """
+    __slots__ = ('path', 'type', 'size', 'mode', 'mtime', 'hash')
+
+    def __init__(self, sPath, sType, iSize=0, iMode=0, iMTime=0, sHash=''):
+        self.path = sPath
+        self.type = sType
+        self.size = iSize
+        self.mode = iMode
+        self.mtime = iMTime
+        # Хеш содержимого файла или цель символической ссылки
+        self.hash = sHash
+
+    def to_line(self):
+        return '%s\t%s\t%d\t%o\t%d\t%s\n' % (_escape(self.path), self.type, self.size, self.mode,
+                                             self.mtime, _escape(self.hash or ''))
+
+    @classmethod
+    def from_line(cls, sLine):
+        path, entry_type, size, mode, mtime, entry_hash = sLine.rstrip('\n').split('\t')
+        return cls(_unescape(path), entry_type, int(size), int(mode, 8), int(mtime), _unescape(entry_hash))
+
+
+class icPackageManifest:
+    """
+    Манифест файлов пакета.
+    Элементы загружаются из файла при первом обращении.
+    Добавление элементов во время разархивирования потокобезопасно.
+    """
+    def __init__(self, sPackageName=None, sBaseDir=None, sFileName=None):
+        """
+        Конструктор.
+        @param sPackageName: Имя пакета.
+        @param sBaseDir: Базовая папка (папка разархивирования).
+        @param sFileName: Полное имя файла манифеста для загрузки.
+        """
+        self.package_name = sPackageName
+        self.base_dir = sBaseDir
+        self.hash_name = MANIFEST_HASH_NAME
+        self._file_name = sFileName
+        self._entries = None if sFileName else {}
+        self._lock = threading.Lock()
+
+    def get_file_name(self):
+        """
+        Полное имя файла манифеста.
+        """
+        return self._file_name
+
+    def _load(self):
+        """
+        Загрузить элементы манифеста из файла.
+        """
+        entries = {}
+        with gzip.open(self._file_name, 'rt', encoding='utf-8') as manifest_file:
+            header = manifest_file.readline().rstrip('\n').split('\t')
+            if not header or header[0] != MANIFEST_SIGNATURE or len(header) < 5:
+                raise ValueError(u'Не корректный заголовок манифеста <%s>' % self._file_name)
+            if int(header[1]) != MANIFEST_VERSION:
+                raise ValueError(u'Не поддерживаемая версия манифеста <%s>' % header[1])
+            self.package_name = _unescape(header[2])
+            self.base_dir = _unescape(header[3])
+            self.hash_name = header[4]
+            for line in manifest_file:
+                if line.strip():
+                    entry = icManifestEntry.from_line(line)
+                    entries[entry.path] = entry
+        return entries
+
+    def _get_entries(self):
+        if self._entries is None:
+            with self._lock:
+                if self._entries is None:
+                    self._entries = self._load()
+        return self._entries
+
+    def load_header(self):
+        """
+        Загрузить только заголовок манифеста (имя пакета, базовую папку).
+        """
+        if self._entries is None and self._file_name:
+            with gzip.open(self._file_name, 'rt', encoding='utf-8') as manifest_file:
+                header = manifest_file.readline().rstrip('\n').split('\t')
+            if len(header) >= 5 and header[0] == MANIFEST_SIGNATURE:
+                self.package_name = _unescape(header[2])
+                self.base_dir = _unescape(header[3])
+                self.hash_name = header[4]
+        return self
+
+    def add(self, sPath, sType, iSize=0, iMode=0, iMTime=0, sHash=''):
+        """
+        Добавить элемент манифеста.
+        @param sPath: Путь относительно базовой папки.
+        @param sType: Тип элемента ('f', 'd', 'l').
+        @param iSize: Размер файла.
+        @param iMode: Режим доступа.
+        @param iMTime: Время изменения.
+        @param sHash: Хеш содержимого файла или цель символической ссылки.
+        """
+        entry = icManifestEntry(os.path.normpath(sPath), sType, int(iSize), int(iMode) & 0o7777,
+                                int(iMTime or 0), sHash)
+        entries = self._get_entries()
+        with self._lock:
+            entries[entry.path] = entry
+        return entry
+
+    def get(self, sPath):
+        """
+        Элемент манифеста по пути или None.
+        """
+        return self._get_entries().get(os.path.normpath(sPath), None)
+
+    def get_entries(self):
+        """
+        Список элементов манифеста в порядке путей.
+        """
+        entries = self._get_entries()
+        return [entries[path] for path in sorted(entries)]
+
+    def get_full_path(self, entry):
+        """
+        Полный путь элемента манифеста.
+        """
+        return os.path.join(self.base_dir, entry.path)
+
+    def __len__(self):
+        return len(self._get_entries())
+
+    def save(self, sFileName=None, sBaseDir=None):
+        """
+        Сохранить манифест.
+        @param sFileName: Полное имя файла. Если не указано, то файл,
+            из которого манифест загружен.
+        @param sBaseDir: Базовая папка. Если указана, то заменяет базовую папку манифеста
+            (один манифест сохраняется для нескольких корневых папок, см. multi_root).
+        @return: True/False.
+        """
+        base_dir = sBaseDir or self.base_dir
+        file_name = sFileName or self._file_name
+        tmp_file_name = file_name + '.tmp'
+        try:
+            path = os.path.dirname(file_name)
+            if path and not os.path.exists(path):
+                os.makedirs(path)
+            entries = self.get_entries()
+            with gzip.open(tmp_file_name, 'wt', encoding='utf-8', compresslevel=6) as manifest_file:
+                manifest_file.write('\t'.join([MANIFEST_SIGNATURE, str(MANIFEST_VERSION),
+                                               _escape(self.package_name or ''), _escape(base_dir or ''),
+                                               self.hash_name]) + '\n')
+                manifest_file.writelines([entry.to_line() for entry in entries])
+            os.replace(tmp_file_name, file_name)
+            if self._file_name is None:
+                self._file_name = file_name
+            log.info(u'Манифест пакета <%s> сохранен в <%s>. Элементов: %d' % (self.package_name, file_name,
+                                                                              len(entries)))
+            return True
+        except:
+            log.fatal(u'Ошибка сохранения манифеста <%s>' % file_name)
+        return False
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Удаление файлов инсталлированного пакета.
+
+Пакет удаляется по его манифесту (см. manifest): удаляются только
+файлы и ссылки, записанные при инсталляции. Файлы удаляются параллельно
+в пуле потоков по папкам (unlink относительно дескриптора папки,
+без повторного разбора полного пути и без перехода по символическим ссылкам).
+Затем пустые папки пакета удаляются снизу вверх.
+Файлы, не принадлежащие пакету (например, данные пользователя),
+не удаляются и регистрируются как оставшиеся.
+Если манифест пакета отсутствует, то папка удаляется целиком (remove_tree)
+с регистрацией ошибок.
+"""
+
+import os
+import os.path
+import errno
+import shutil
+import concurrent.futures
+
+from . import log
+from . import manifest
+
+__version__ = (0, 1, 1, 1)
+
+# Минимальное количество потоков удаления.
+# Удаление ограничено в основном задержками файловой системы
+REMOVE_MIN_WORKERS = 4
+
+OPEN_DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_CLOEXEC', 0)
+
+
+class icRemoveResult:
+    """
+    Результат удаления файлов пакета.
+    """
+    def __init__(self, sPath):
+        """
+        Конструктор.
+        @param sPath: Удаляемая папка.
+        """
+        self.path = sPath
+        # Количество удаленных файлов и папок
+        self.removed = 0
+        # Количество файлов, отсутствовавших на момент удаления
+        self.missing = 0
+        # Ошибки удаления: [(Полный путь, Текст ошибки), ...]
+        self.errors = []
+        # Оставшиеся файлы и папки, не принадлежащие пакету
+        self.leftovers = []
+
+    def add_error(self, sPath, error):
+        self.errors.append((sPath, str(error)))
+
+    def is_ok(self):
+        """
+        Удаление выполнено без ошибок?
+        """
+        return not self.errors
+
+    def __bool__(self):
+        return self.is_ok()
+
+
+def _open_dir(iBaseFD, sRelDir):
+    """
+    Открыть папку относительно дескриптора базовой папки.
+    Символические ссылки в пути не допускаются.
+    @return: Дескриптор папки.
+    """
+    fd = os.dup(iBaseFD)
+    for name in sRelDir.split(os.sep) if sRelDir else ():
+        try:
+            sub_fd = os.open(name, OPEN_DIR_FLAGS, dir_fd=fd)
+        finally:
+            os.close(fd)
+        fd = sub_fd
+    return fd
+
+
+def _unlink_dir_entries(iBaseFD, sRelDir, lNames):
+    """
+    Удалить файлы одной папки.
+    Выполняется в потоке пула.
+    @return: Кортеж (Количество удаленных, Количество отсутствовавших, Список ошибок).
+    """
+    removed = missing = 0
+    errors = []
+    try:
+        fd = _open_dir(iBaseFD, sRelDir)
+    except FileNotFoundError:
+        return 0, len(lNames), []
+    except OSError as err:
+        return 0, 0, [(sRelDir, err)]
+    try:
+        for name in lNames:
+            try:
+                os.unlink(name, dir_fd=fd)
+                removed += 1
+            except FileNotFoundError:
+                missing += 1
+            except OSError as err:
+                errors.append((os.path.join(sRelDir, name), err))
+    finally:
+        os.close(fd)
+    return removed, missing, errors
+
+
+def _get_manifest_dirs(Manifest):
+    """
+    Папки пакета (в том числе не записанные в манифест явно)
+    в порядке удаления снизу вверх.
+    """
+    dirs = set()
+    for entry in Manifest.get_entries():
+        path = entry.path if entry.type == manifest.DIR_TYPE else os.path.dirname(entry.path)
+        while path and path not in dirs:
+            dirs.add(path)
+            path = os.path.dirname(path)
+    dirs.discard('.')
+    return sorted(dirs, key=lambda path: (-path.count(os.sep), path))
+
+
+def get_foreign_paths(Manifest, sPath=None):
+    """
+    Файлы и папки, не принадлежащие пакету (например, данные пользователя).
+    Символические ссылки на папки не обходятся.
+    @param Manifest: Манифест пакета (manifest.icPackageManifest).
+    @param sPath: Проверяемая папка внутри базовой папки манифеста.
+        Если не указана, то базовая папка манифеста.
+    @return: Список полных путей. Для папки, не принадлежащей пакету,
+        возвращается только сама папка.
+    """
+    package_paths = set([entry.path for entry in Manifest.get_entries()])
+    package_paths.update(_get_manifest_dirs(Manifest))
+    # Базовая папка определена после загрузки манифеста
+    base_dir = Manifest.base_dir
+    path = os.path.normpath(sPath or base_dir)
+    foreign_paths = []
+    for root, dir_names, file_names in os.walk(path):
+        rel_root = os.path.relpath(root, base_dir)
+        for name in list(dir_names):
+            if os.path.normpath(os.path.join(rel_root, name)) not in package_paths:
+                foreign_paths.append(os.path.join(root, name))
+                dir_names.remove(name)
+        for name in file_names:
+            if os.path.normpath(os.path.join(rel_root, name)) not in package_paths:
+                foreign_paths.append(os.path.join(root, name))
+    return foreign_paths
+
+
+def remove_manifest_files(Manifest, iWorkers=None):
+    """
+    Удалить файлы пакета по манифесту.
+    Базовая папка манифеста не удаляется.
+    @param Manifest: Манифест пакета (manifest.icPackageManifest).
+    @param iWorkers: Количество потоков. Если не указано, то определяется
+        по количеству ядер.
+    @return: Результат удаления icRemoveResult.
+    """
+    # Файлы группируются по папкам
+    dir_files = dict()
+    for entry in Manifest.get_entries():
+        if entry.type != manifest.DIR_TYPE:
+            rel_dir, name = os.path.split(entry.path)
+            dir_files.setdefault(rel_dir, []).append(name)
+    # Базовая папка определена после загрузки манифеста
+    base_dir = Manifest.base_dir
+    result = icRemoveResult(base_dir)
+
+    try:
+        base_fd = os.open(base_dir, os.O_RDONLY | os.O_DIRECTORY | getattr(os, 'O_CLOEXEC', 0))
+    except FileNotFoundError:
+        log.warning(u'Папка пакета <%s> не найдена' % base_dir)
+        return result
+    try:
+        workers = iWorkers or max(REMOVE_MIN_WORKERS, os.cpu_count() or 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_unlink_dir_entries, base_fd, rel_dir, names)
+                       for rel_dir, names in dir_files.items()]
+            for future in futures:
+                removed, missing, errors = future.result()
+                result.removed += removed
+                result.missing += missing
+                for rel_path, err in errors:
+                    result.add_error(os.path.join(base_dir, rel_path), err)
+
+        # Пустые папки удаляются снизу вверх
+        manifest_dirs = _get_manifest_dirs(Manifest)
+        leftover_dirs = set()
+        for rel_dir in manifest_dirs:
+            parent_dir, name = os.path.split(rel_dir)
+            try:
+                parent_fd = _open_dir(base_fd, parent_dir)
+                try:
+                    os.rmdir(name, dir_fd=parent_fd)
+                finally:
+                    os.close(parent_fd)
+                result.removed += 1
+            except FileNotFoundError:
+                continue
+            except OSError as err:
+                if err.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                    result.add_error(os.path.join(base_dir, rel_dir), err)
+                    continue
+                leftover_dirs.add(rel_dir)
+                for leftover_name in sorted(os.listdir(os.path.join(base_dir, rel_dir))):
+                    if os.path.join(rel_dir, leftover_name) not in leftover_dirs:
+                        result.leftovers.append(os.path.join(base_dir, rel_dir, leftover_name))
+    finally:
+        os.close(base_fd)
+
+    for path, error in result.errors:
+        log.error(u'Ошибка удаления <%s>: %s' % (path, error))
+    if result.leftovers:
+        log.warning(u'Не удалены файлы, не принадлежащие пакету <%s>: %s' % (Manifest.package_name,
+                                                                          result.leftovers))
+    log.info(u'Удаление пакета <%s> по манифесту. Удалено: %d. Отсутствовало: %d. Ошибок: %d' % (Manifest.package_name,
+                                                                                               result.removed,
+                                                                                               result.missing,
+                                                                                               len(result.errors)))
+    return result
+
+
+def remove_tree(sPath):
+    """
+    Удалить папку (или файл) целиком.
+    Ошибки удаления не прерывают удаление и регистрируются в результате.
+    @param sPath: Полный путь.
+    @return: Результат удаления icRemoveResult.
+    """
+    result = icRemoveResult(sPath)
+
+    def on_error(function, path, exc_info):
+        result.add_error(path, exc_info[1])
+
+    if os.path.isdir(sPath) and not os.path.islink(sPath):
+        shutil.rmtree(sPath, onerror=on_error)
+    elif os.path.lexists(sPath):
+        try:
+            os.remove(sPath)
+        except OSError as err:
+            result.add_error(sPath, err)
+    for path, error in result.errors:
+        log.error(u'Ошибка удаления <%s>: %s' % (path, error))
+    return result
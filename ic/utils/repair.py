@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Восстановление файлов инсталлированных пакетов.
+
+Файлы пакета проверяются по манифесту (см. integrity, режим AUTO_CHECK):
+сначала по размеру и времени изменения, хеш содержимого вычисляется
+только при несовпадении времени изменения.
+Из архива пакета разархивируются только отсутствующие и поврежденные элементы:
+    - tar архивы - по индексу архива (см. tar_index),
+    - zip архивы - выборочно по центральному каталогу.
+Пакеты, для которых манифест не сохранен, и DEB пакеты не восстанавливаются.
+"""
+
+import os
+import os.path
+
+from . import log
+from . import util
+from . import remove
+from . import extract
+from . import manifest
+from . import integrity
+from . import tar_index
+from . import archive_format
+
+__version__ = (0, 1, 1, 1)
+
+
+def _remove_obstacle(Manifest, entry):
+    """
+    Удалить то, что находится на месте элемента манифеста другого типа.
+    """
+    full_path = Manifest.get_full_path(entry)
+    if entry.type == manifest.DIR_TYPE or not os.path.isdir(full_path) or os.path.islink(full_path):
+        if os.path.lexists(full_path) and not os.path.isdir(full_path):
+            os.remove(full_path)
+    else:
+        remove.remove_tree(full_path)
+
+
+def repair_package(Manifest, sArchiveFileName, sMode=integrity.AUTO_CHECK, iWorkers=None):
+    """
+    Восстановить файлы пакета из архива.
+    @param Manifest: Манифест пакета (manifest.icPackageManifest).
+    @param sArchiveFileName: Полное имя архива, из которого был инсталлирован пакет.
+    @param sMode: Режим проверки файлов (см. integrity).
+    @param iWorkers: Количество потоков проверки.
+    @return: Словарь результата восстановления пакета:
+        {'name': Имя пакета, 'archive': Архив, 'checked': Количество проверенных элементов,
+         'damaged': [{'path': Путь, 'status': Результат проверки}, ...],
+         'repaired': Количество восстановленных элементов,
+         'result': True/False, 'error': Текст ошибки или None}
+    """
+    check_result = integrity.check_manifest(Manifest, sMode, iWorkers)
+    report = check_result.to_dict()
+    report.update(archive=sArchiveFileName, repaired=0, error=None)
+    if check_result.is_ok():
+        return report
+
+    archive_kind = None
+    if not sArchiveFileName or not os.path.isfile(sArchiveFileName):
+        report['error'] = u'Не найден архив пакета <%s>' % sArchiveFileName
+    else:
+        archive_kind = archive_format.get_format_kind(archive_format.detect_format(sArchiveFileName))
+    if report['error'] is None and archive_kind not in (archive_format.TAR_KIND, archive_format.ZIP_KIND):
+        report['error'] = u'Восстановление пакетов формата <%s> не поддерживается' % archive_kind
+    if report['error']:
+        log.error(u'Восстановление пакета <%s>. %s' % (Manifest.package_name, report['error']))
+        report['result'] = False
+        return report
+
+    log.info(u'Восстановление пакета <%s>. Элементов: %s' % (Manifest.package_name,
+                                                           check_result.get_damaged_paths()))
+    try:
+        for entry, status in check_result.damaged:
+            if status == integrity.TYPE_STATUS:
+                _remove_obstacle(Manifest, entry)
+        names = check_result.get_damaged_paths()
+        if archive_kind == archive_format.ZIP_KIND:
+            extract_result = extract.zip_extract(sArchiveFileName, [Manifest.base_dir], lNames=names)
+        else:
+            extract_result = tar_index.extract_members(sArchiveFileName, names, [Manifest.base_dir])
+        report['repaired'] = len([member for member in extract_result.members if member['ok']])
+        if not extract_result.is_ok():
+            report['error'] = extract_result.error or str([member['name'] for member in extract_result.get_errors()])
+    except OSError as err:
+        log.fatal(u'Ошибка восстановления пакета <%s>' % Manifest.package_name)
+        report['error'] = str(err)
+
+    # Повторная проверка восстановленных элементов
+    recheck_result = integrity.check_manifest(Manifest, sMode, iWorkers,
+                                              [entry for entry, status in check_result.damaged])
+    report['result'] = recheck_result.is_ok() and not report['error']
+    if report['result']:
+        log.info(u'Пакет <%s> восстановлен. Элементов: %d' % (Manifest.package_name, len(check_result.damaged)))
+    else:
+        log.error(u'Пакет <%s> восстановлен не полностью. Отличаются от манифеста: %s' % (Manifest.package_name,
+                                                                                        recheck_result.get_damaged_paths()))
+    return report
+
+
+def repair_packages(LogManager, sPackageDir=util.INSTALL_PACKAGES_DIR_DEFAULT, sMode=integrity.AUTO_CHECK,
+                    iWorkers=None):
+    """
+    Восстановить файлы всех инсталлированных пакетов.
+    Имя пакета в install.log - имя файла архива в папке инсталляционных пакетов.
+    @param LogManager: Менеджер журналирования инсталляции.
+    @param sPackageDir: Папка инсталляционных пакетов.
+    @param sMode: Режим проверки файлов (см. integrity).
+    @param iWorkers: Количество потоков проверки.
+    @return: Словарь отчета:
+        {'result': True/False, 'install_log': Файл install.log,
+         'packages': [Результат восстановления пакета (см. repair_package), ...]}
+    """
+    report = dict(result=True, install_log=LogManager.get_install_log_file_name(), packages=[])
+    if not os.path.exists(LogManager.get_install_log_file_name()):
+        log.warning(u'Файл <%s> не найден' % LogManager.get_install_log_file_name())
+        return report
+    for package_name, package_path in LogManager.load_packages().items():
+        package_manifest = LogManager.get_package_manifest(package_name)
+        if package_manifest is None:
+            log.warning(u'Восстановление пакета <%s>. Манифест пакета не сохранен' % package_name)
+            report['packages'].append(dict(name=package_name, dir=package_path, result=None,
+                                           error=u'Манифест пакета не сохранен'))
+            continue
+        try:
+            package_manifest.get_entries()
+        except (OSError, ValueError, EOFError) as err:
+            log.error(u'Ошибка загрузки манифеста пакета <%s>: %s' % (package_name, err))
+            report['packages'].append(dict(name=package_name, dir=package_path, result=False, error=str(err)))
+            report['result'] = False
+            continue
+        archive_file_name = util.get_programm_filename(dict(programm=package_name), sPackageDir)
+        package_report = repair_package(package_manifest, archive_file_name, sMode, iWorkers)
+        report['packages'].append(package_report)
+        report['result'] = report['result'] and package_report['result']
+    return report
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Инсталляция архивов через промежуточную папку с атомарной заменой.
+
+Архив разворачивается в скрытую промежуточную папку внутри
+инсталляционной папки (на той же файловой системе). Только после
+успешного разархивирования и проверки контрольной суммы содержимое
+промежуточной папки переносится в инсталляционную папку (icInstallTransaction.commit):
+    - папка пакета ('package_dir') заменяется атомарно одним переименованием
+      (renameat2 с флагом RENAME_EXCHANGE, если поддерживается ядром и
+      файловой системой, иначе двумя переименованиями);
+    - остальное содержимое переносится переименованием с объединением папок.
+Прежняя папка пакета сохраняется под скрытым именем до завершения
+инсталляции программы для быстрого отката (icInstallTransaction.rollback)
+и затем удаляется в фоновом потоке. Так же при объединении сохраняются
+замененные файлы и папки, а новые пути запоминаются, поэтому откат
+восстанавливает и инсталляционную папку программы без 'package_dir'.
+Используемые промежуточные и прежние папки не удаляются как оставшиеся
+после аварийного завершения (remove_stale_dirs) шагами сценария,
+выполняющимися параллельно в той же инсталляционной папке.
+При ошибке разархивирования промежуточная папка удаляется,
+а инсталляционная папка не изменяется.
+"""
+
+import os
+import os.path
+import time
+import errno
+import queue
+import shutil
+import atexit
+import ctypes
+import ctypes.util
+import tempfile
+import threading
+
+from . import log
+
+__version__ = (0, 1, 1, 1)
+
+# Префикс имени промежуточной папки
+STAGE_DIR_PREFIX = '.icinstall-stage-'
+# Префикс имени сохраненной прежней папки пакета
+OLD_DIR_PREFIX = '.icinstall-old-'
+
+# Время, после которого оставшиеся после аварийного завершения
+# промежуточные и прежние папки удаляются (сек)
+STALE_DIR_TIME = 24 * 60 * 60
+
+# Параметры renameat2
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+_RENAMEAT2 = None
+_RENAMEAT2_LOADED = False
+
+# Используемые промежуточные и прежние папки
+_LIVE_DIRS = set()
+_LIVE_DIRS_LOCK = threading.Lock()
+
+
+def _set_live(sPath, bLive=True):
+    """
+    Отметить промежуточную/прежнюю папку как используемую.
+    """
+    with _LIVE_DIRS_LOCK:
+        if bLive:
+            _LIVE_DIRS.add(sPath)
+        else:
+            _LIVE_DIRS.discard(sPath)
+
+
+def _is_live(sPath):
+    with _LIVE_DIRS_LOCK:
+        return sPath in _LIVE_DIRS
+
+
+def _get_renameat2():
+    """
+    Функция renameat2 библиотеки libc или None, если она не доступна.
+    """
+    global _RENAMEAT2, _RENAMEAT2_LOADED
+    if not _RENAMEAT2_LOADED:
+        _RENAMEAT2_LOADED = True
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            _RENAMEAT2 = libc.renameat2
+            _RENAMEAT2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+            _RENAMEAT2.restype = ctypes.c_int
+        except (OSError, AttributeError, TypeError):
+            _RENAMEAT2 = None
+    return _RENAMEAT2
+
+
+def exchange_paths(sPath1, sPath2):
+    """
+    Атомарно поменять местами два пути (renameat2 RENAME_EXCHANGE).
+    @return: True - пути поменяны местами,
+        False - атомарный обмен не поддерживается.
+    """
+    renameat2 = _get_renameat2()
+    if renameat2 is None:
+        return False
+    if renameat2(AT_FDCWD, os.fsencode(sPath1), AT_FDCWD, os.fsencode(sPath2), RENAME_EXCHANGE) == 0:
+        return True
+    error = ctypes.get_errno()
+    if error in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.EOPNOTSUPP):
+        return False
+    raise OSError(error, os.strerror(error), sPath1)
+
+
+def _move_to_unique_name(sPath, sNamePath, sPrefix=OLD_DIR_PREFIX):
+    """
+    Переименовать путь в уникальное скрытое имя.
+    Имя занимается заранее созданной пустой папкой (файлом), которая
+    атомарно заменяется переименованием, поэтому не может быть занято
+    параллельно выполняющимся шагом.
+    Время изменения переименованного пути обновляется, чтобы он не был
+    удален как оставшийся после аварийного завершения.
+    @param sPath: Переименовываемый путь.
+    @param sNamePath: Путь, по имени которого формируется уникальное имя.
+    @param sPrefix: Префикс уникального имени.
+    @return: Уникальное имя.
+    """
+    prefix = sPrefix + os.path.basename(sNamePath) + '-'
+    path = os.path.dirname(sNamePath)
+    if os.path.isdir(sPath) and not os.path.islink(sPath):
+        unique_name = tempfile.mkdtemp(prefix=prefix, dir=path)
+    else:
+        fd, unique_name = tempfile.mkstemp(prefix=prefix, dir=path)
+        os.close(fd)
+    _set_live(unique_name)
+    try:
+        os.rename(sPath, unique_name)
+    except OSError:
+        _set_live(unique_name, False)
+        if os.path.isdir(unique_name) and not os.path.islink(unique_name):
+            os.rmdir(unique_name)
+        else:
+            os.remove(unique_name)
+        raise
+    os.utime(unique_name, follow_symlinks=False)
+    return unique_name
+
+
+def swap_dir(sNewDir, sTargetDir):
+    """
+    Заменить папку новой папкой.
+    @param sNewDir: Новая папка.
+    @param sTargetDir: Заменяемая папка. Если не существует, то новая
+        папка просто переименовывается.
+    @return: Путь, под которым сохранена прежняя папка, или None.
+    """
+    if not os.path.lexists(sTargetDir):
+        os.rename(sNewDir, sTargetDir)
+        return None
+    if exchange_paths(sNewDir, sTargetDir):
+        # На месте новой папки теперь прежняя
+        return _move_to_unique_name(sNewDir, sTargetDir)
+    old_dir = _move_to_unique_name(sTargetDir, sTargetDir)
+    os.rename(sNewDir, sTargetDir)
+    return old_dir
+
+
+class icBackgroundRemover:
+    """
+    Удаление папок в фоновом потоке.
+    Перед завершением инсталлятора ожидается удаление всех папок очереди.
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif os.path.lexists(path):
+                    os.remove(path)
+                log.info(u'Удалена папка <%s>' % path)
+            except OSError as err:
+                log.warning(u'Ошибка удаления <%s>: %s' % (path, err))
+            finally:
+                _set_live(path, False)
+                self._queue.task_done()
+
+    def remove(self, sPath):
+        """
+        Поставить папку в очередь удаления.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                atexit.register(self.wait)
+        self._queue.put(sPath)
+
+    def wait(self):
+        """
+        Дождаться удаления всех папок очереди.
+        """
+        self._queue.join()
+
+
+BACKGROUND_REMOVER = icBackgroundRemover()
+
+
+def remove_background(sPath):
+    """
+    Удалить папку в фоновом потоке.
+    """
+    BACKGROUND_REMOVER.remove(sPath)
+
+
+def remove_stale_dirs(sDir):
+    """
+    Удалить промежуточные и прежние папки, оставшиеся после
+    аварийного завершения инсталляции.
+    @param sDir: Инсталляционная папка.
+    """
+    now = time.time()
+    try:
+        names = os.listdir(sDir)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith((STAGE_DIR_PREFIX, OLD_DIR_PREFIX)):
+            continue
+        path = os.path.join(sDir, name)
+        if _is_live(path):
+            continue
+        try:
+            if now - os.lstat(path).st_mtime > STALE_DIR_TIME:
+                _set_live(path)
+                log.info(u'Удаление оставшейся папки <%s>' % path)
+                remove_background(path)
+        except OSError:
+            continue
+
+
+def create_stage_dir(sDir):
+    """
+    Создать промежуточную папку разархивирования.
+    @param sDir: Инсталляционная папка.
+    @return: Полный путь промежуточной папки.
+    """
+    if not os.path.exists(sDir):
+        os.makedirs(sDir)
+    remove_stale_dirs(sDir)
+    stage_dir = tempfile.mkdtemp(prefix=STAGE_DIR_PREFIX, dir=sDir)
+    _set_live(stage_dir)
+    return stage_dir
+
+
+def _merge_tree(sSrcDir, sDstDir, lSwapped=None):
+    """
+    Перенести содержимое папки в другую папку переименованием.
+    Существующие папки объединяются, файлы заменяются.
+    @param lSwapped: Список [(Путь, Сохраненный прежний путь или None), ...], в который
+        добавляются замененные пути (сохраняются под уникальным именем)
+        и новые пути (None) для отката. Если не указан, то замененные файлы
+        не сохраняются, а замененные папки удаляются в фоновом потоке.
+    """
+    for name in os.listdir(sSrcDir):
+        src = os.path.join(sSrcDir, name)
+        dst = os.path.join(sDstDir, name)
+        src_is_dir = os.path.isdir(src) and not os.path.islink(src)
+        dst_is_dir = os.path.isdir(dst) and not os.path.islink(dst)
+        if src_is_dir and dst_is_dir:
+            _merge_tree(src, dst, lSwapped)
+            shutil.copystat(src, dst)
+            os.rmdir(src)
+            continue
+        if lSwapped is not None:
+            # Прежний путь сохраняется до завершения инсталляции для отката
+            old_path = _move_to_unique_name(dst, dst) if os.path.lexists(dst) else None
+            lSwapped.append((dst, old_path))
+        elif dst_is_dir:
+            remove_background(_move_to_unique_name(dst, dst))
+        os.replace(src, dst)
+
+
+def _remove_old_path(sPath):
+    """
+    Удалить сохраненный прежний путь.
+    Папки удаляются в фоновом потоке, файлы - сразу.
+    """
+    if os.path.isdir(sPath) and not os.path.islink(sPath):
+        remove_background(sPath)
+        return
+    try:
+        os.remove(sPath)
+    except FileNotFoundError:
+        pass
+    finally:
+        _set_live(sPath, False)
+
+
+def discard_stage_dir(sStageDir):
+    """
+    Удалить промежуточную папку.
+    @param sStageDir: Промежуточная папка.
+    """
+    if os.path.exists(sStageDir):
+        log.info(u'Удаление промежуточной папки <%s>' % sStageDir)
+        remove_background(sStageDir)
+
+
+class icInstallTransaction:
+    """
+    Перенос разархивированных программ из промежуточных папок
+    в инсталляционные с возможностью отката.
+    """
+    def __init__(self):
+        # Замененные папки пакетов, замененные и новые пути при объединении:
+        # [(Путь, Сохраненный прежний путь или None), ...]
+        self._swapped = []
+
+    def commit(self, sStageDir, sDir, sPackageDir=None):
+        """
+        Перенести содержимое промежуточной папки в инсталляционную папку.
+        @param sStageDir: Промежуточная папка.
+        @param sDir: Инсталляционная папка.
+        @param sPackageDir: Папка пакета относительно инсталляционной папки.
+            Заменяется атомарно целиком. Если не указана, то все содержимое
+            объединяется с инсталляционной папкой.
+        """
+        if sPackageDir:
+            staged_package_dir = os.path.join(sStageDir, sPackageDir)
+            package_dir = os.path.join(sDir, sPackageDir)
+            if os.path.isdir(staged_package_dir):
+                parent_dir = os.path.dirname(package_dir)
+                if not os.path.isdir(parent_dir):
+                    os.makedirs(parent_dir)
+                old_dir = swap_dir(staged_package_dir, package_dir)
+                self._swapped.append((package_dir, old_dir))
+                log.info(u'Папка пакета <%s> заменена' % package_dir)
+        _merge_tree(sStageDir, sDir, self._swapped)
+        os.rmdir(sStageDir)
+        _set_live(sStageDir, False)
+        log.info(u'Разархивированное содержимое перенесено в <%s>' % sDir)
+
+    def rollback(self):
+        """
+        Откатить замену папок пакетов и перенос файлов в инсталляционные папки:
+        прежние пути восстанавливаются, новые удаляются.
+        """
+        count = 0
+        for path, old_path in reversed(self._swapped):
+            try:
+                failed_path = None
+                if old_path is None:
+                    if os.path.lexists(path):
+                        failed_path = _move_to_unique_name(path, path)
+                elif not os.path.lexists(path):
+                    os.rename(old_path, path)
+                    _set_live(old_path, False)
+                elif exchange_paths(old_path, path):
+                    failed_path = old_path
+                else:
+                    failed_path = _move_to_unique_name(path, path)
+                    os.rename(old_path, path)
+                    _set_live(old_path, False)
+                if failed_path is not None:
+                    _remove_old_path(failed_path)
+                count += 1
+            except OSError as err:
+                log.error(u'Ошибка отката замены <%s>: %s' % (path, err))
+        if count:
+            log.warning(u'Откат переноса пакета. Восстановлено путей: %d' % count)
+        self._swapped = []
+
+    def finish(self):
+        """
+        Завершить инсталляцию. Прежние папки пакетов удаляются в фоновом потоке.
+        """
+        for path, old_path in self._swapped:
+            if old_path is not None:
+                _remove_old_path(old_path)
+        self._swapped = []
@@ -0,0 +1,593 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Индексы tar архивов для выборочного разархивирования.
+
+Индекс сохраняется рядом с архивом в файле <Архив>.icidx
+(сжатый gzip JSON) и содержит:
+    - смещения данных элементов tar архива в распакованном потоке
+      (и карты областей данных разреженных элементов);
+    - для архивов, сжатых gzip, - точки доступа в сжатом потоке
+      (смещение в распакованном и сжатом потоке, номер бита
+      и последние 32 Кб распакованных данных перед точкой)
+      через каждые INDEX_SPAN байт распакованных данных.
+Распаковка с точки доступа выполняется библиотекой zlib через ctypes
+(inflatePrime/inflateSetDictionary не доступны в модуле zlib),
+поэтому извлечение одного элемента требует распаковки не более
+INDEX_SPAN байт, а не всего архива с начала.
+Если библиотека zlib не доступна, а также для архивов, сжатых
+не gzip (xz, bzip2, zstd, lz4), индекс содержит только смещения элементов
+и архив распаковывается с начала, но без записи пропускаемых элементов.
+Не сжатый tar архив читается с нужного смещения напрямую.
+Индекс устаревает при изменении размера или времени изменения архива.
+"""
+
+import os
+import os.path
+import json
+import gzip
+import zlib
+import base64
+import bisect
+import ctypes
+import ctypes.util
+import tarfile
+
+from . import log
+from . import extract
+from . import manifest
+from . import decompress
+from . import archive_format
+
+__version__ = (0, 1, 1, 1)
+
+INDEX_VERSION = 2
+INDEX_FILE_EXT = '.icidx'
+
+# Расстояние между точками доступа в распакованном потоке
+INDEX_SPAN = 1024 * 1024
+# Размер окна deflate
+WINDOW_SIZE = 32 * 1024
+# Размеры буферов чтения сжатых и распакованных данных
+INPUT_CHUNK_SIZE = 64 * 1024
+OUTPUT_CHUNK_SIZE = 256 * 1024
+
+# Типы элементов индекса (дополнительно к типам манифеста)
+HARDLINK_TYPE = 'h'
+OTHER_TYPE = '?'
+
+# Константы zlib
+Z_OK = 0
+Z_STREAM_END = 1
+Z_NEED_DICT = 2
+Z_BUF_ERROR = -5
+Z_NO_FLUSH = 0
+Z_BLOCK = 5
+# Окно deflate без заголовка и с заголовком gzip
+RAW_WINDOW_BITS = -15
+GZIP_WINDOW_BITS = 31
+# Размер трейлера gzip (CRC32 и размер)
+GZIP_TRAILER_SIZE = 8
+
+
+class _ZStream(ctypes.Structure):
+    """
+    Структура z_stream библиотеки zlib.
+    """
+    _fields_ = [('next_in', ctypes.c_void_p), ('avail_in', ctypes.c_uint), ('total_in', ctypes.c_ulong),
+                ('next_out', ctypes.c_void_p), ('avail_out', ctypes.c_uint), ('total_out', ctypes.c_ulong),
+                ('msg', ctypes.c_char_p), ('state', ctypes.c_void_p),
+                ('zalloc', ctypes.c_void_p), ('zfree', ctypes.c_void_p), ('opaque', ctypes.c_void_p),
+                ('data_type', ctypes.c_int), ('adler', ctypes.c_ulong), ('reserved', ctypes.c_ulong)]
+
+
+_LIBZ = None
+_LIBZ_LOADED = False
+
+
+def _get_libz():
+    """
+    Библиотека zlib или None, если она не доступна.
+    """
+    global _LIBZ, _LIBZ_LOADED
+    if not _LIBZ_LOADED:
+        _LIBZ_LOADED = True
+        try:
+            libz = ctypes.CDLL(ctypes.util.find_library('z'))
+            stream_p = ctypes.POINTER(_ZStream)
+            libz.zlibVersion.restype = ctypes.c_char_p
+            libz.inflateInit2_.argtypes = [stream_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+            libz.inflate.argtypes = [stream_p, ctypes.c_int]
+            libz.inflateEnd.argtypes = [stream_p]
+            libz.inflateReset.argtypes = [stream_p]
+            libz.inflateReset2.argtypes = [stream_p, ctypes.c_int]
+            libz.inflatePrime.argtypes = [stream_p, ctypes.c_int, ctypes.c_int]
+            libz.inflateSetDictionary.argtypes = [stream_p, ctypes.c_char_p, ctypes.c_uint]
+            _LIBZ = libz
+        except (OSError, AttributeError, TypeError):
+            _LIBZ = None
+    return _LIBZ
+
+
+class icGzipIndexReader:
+    """
+    Чтение gzip потока с регистрацией точек доступа (bBuildIndex)
+    или с точки доступа.
+    Поддерживаются gzip файлы из нескольких частей (members).
+    """
+    def __init__(self, src_file, Point=None, bBuildIndex=False, iSpan=INDEX_SPAN):
+        """
+        Конструктор.
+        @param src_file: Файловый объект сжатого файла с поддержкой seek.
+        @param Point: Точка доступа [Смещение распакованных данных, Смещение сжатых данных,
+            Номер бита, Окно]. Если не указана, то чтение с начала файла.
+        @param bBuildIndex: Регистрировать точки доступа?
+        @param iSpan: Расстояние между точками доступа.
+        """
+        self._libz = _get_libz()
+        self._file = src_file
+        self._stream = _ZStream()
+        self._in_buffer = ctypes.create_string_buffer(INPUT_CHUNK_SIZE)
+        self._out_buffer = ctypes.create_string_buffer(OUTPUT_CHUNK_SIZE)
+        self._in_offset = 0
+        self._in_size = 0
+        self._pending = b''
+        self._eof = False
+        # Начало очередной части gzip. Конец файла допустим только здесь
+        self._member_start = Point is None
+        self.build_index = bBuildIndex
+        self.span = iSpan
+        self.points = []
+        self._window = b''
+        self._last_point = 0
+
+        if Point is None:
+            self.position = 0
+            self._raw = False
+            self._init(GZIP_WINDOW_BITS)
+            self._file.seek(0)
+        else:
+            out_offset, in_offset, bits, window = Point
+            self.position = out_offset
+            self._raw = True
+            self._init(RAW_WINDOW_BITS)
+            self._file.seek(in_offset - (1 if bits else 0))
+            self._in_offset = self._file.tell()
+            if bits:
+                value = self._file.read(1)[0]
+                self._in_offset += 1
+                self._check(self._libz.inflatePrime(ctypes.byref(self._stream), bits, value >> (8 - bits)))
+            if window:
+                self._check(self._libz.inflateSetDictionary(ctypes.byref(self._stream), window, len(window)))
+
+    def _init(self, iWindowBits):
+        version = self._libz.zlibVersion()
+        self._check(self._libz.inflateInit2_(ctypes.byref(self._stream), iWindowBits, version,
+                                             ctypes.sizeof(_ZStream)))
+
+    def _check(self, iResult):
+        if iResult not in (Z_OK, Z_STREAM_END):
+            message = self._stream.msg.decode('utf-8', 'replace') if self._stream.msg else str(iResult)
+            raise zlib.error(u'Ошибка распаковки gzip: %s' % message)
+        return iResult
+
+    def _get_total_in(self):
+        """
+        Смещение в сжатом файле следующего не обработанного байта.
+        """
+        return self._in_offset + self._in_size - self._stream.avail_in
+
+    def _fill(self):
+        """
+        Прочитать очередной блок сжатых данных.
+        @return: False - конец файла.
+        """
+        self._in_offset = self._get_total_in()
+        data = self._file.read(INPUT_CHUNK_SIZE)
+        if not data:
+            return False
+        ctypes.memmove(self._in_buffer, data, len(data))
+        self._in_size = len(data)
+        self._stream.next_in = ctypes.addressof(self._in_buffer)
+        self._stream.avail_in = len(data)
+        return True
+
+    def _skip_input(self, iSize):
+        """
+        Пропустить байты сжатого потока (трейлер gzip).
+        """
+        while iSize:
+            if not self._stream.avail_in and not self._fill():
+                raise EOFError(u'Не полный трейлер gzip')
+            count = min(iSize, self._stream.avail_in)
+            self._stream.next_in += count
+            self._stream.avail_in -= count
+            iSize -= count
+
+    def _add_point(self, data):
+        if self.build_index:
+            self._window = (self._window + data)[-WINDOW_SIZE:]
+            data_type = self._stream.data_type
+            if data_type & 128 and not data_type & 64 and \
+                    (not self.points or self.position - self._last_point >= self.span):
+                self.points.append([self.position, self._get_total_in(), data_type & 7, self._window])
+                self._last_point = self.position
+
+    def _inflate(self):
+        """
+        Распаковать очередную порцию данных.
+        """
+        if not self._stream.avail_in and not self._fill():
+            if self._member_start:
+                self._eof = True
+                return
+            raise EOFError(u'Не полный gzip поток')
+        self._stream.next_out = ctypes.addressof(self._out_buffer)
+        self._stream.avail_out = OUTPUT_CHUNK_SIZE
+        result = self._libz.inflate(ctypes.byref(self._stream), Z_BLOCK if self.build_index else Z_NO_FLUSH)
+        if result != Z_BUF_ERROR:
+            if result != Z_OK and self._member_start and not self._raw:
+                # Данные после последней части gzip (например, выравнивание нулями)
+                self._eof = True
+                return
+            self._check(result)
+        count = OUTPUT_CHUNK_SIZE - self._stream.avail_out
+        data = ctypes.string_at(self._out_buffer, count) if count else b''
+        if count:
+            self._member_start = False
+            self._pending += data
+            self.position += count
+        self._add_point(data)
+        if result == Z_STREAM_END:
+            if self._raw:
+                # С точки доступа поток распаковывается без заголовка gzip
+                self._skip_input(GZIP_TRAILER_SIZE)
+                self._check(self._libz.inflateReset2(ctypes.byref(self._stream), GZIP_WINDOW_BITS))
+                self._raw = False
+            else:
+                self._check(self._libz.inflateReset(ctypes.byref(self._stream)))
+            self._member_start = True
+
+    def read(self, iSize=-1):
+        while not self._eof and (iSize < 0 or len(self._pending) < iSize):
+            self._inflate()
+        if iSize < 0:
+            data, self._pending = self._pending, b''
+        else:
+            data, self._pending = self._pending[:iSize], self._pending[iSize:]
+        return data
+
+    def skip(self, iSize):
+        """
+        Пропустить распакованные данные.
+        """
+        while iSize > 0:
+            data = self.read(min(iSize, OUTPUT_CHUNK_SIZE))
+            if not data:
+                raise EOFError(u'Не ожиданный конец gzip потока')
+            iSize -= len(data)
+
+    def tell(self):
+        """
+        Смещение следующего читаемого байта в распакованном потоке.
+        """
+        return self.position - len(self._pending)
+
+    def close(self):
+        if self._stream is not None:
+            self._libz.inflateEnd(ctypes.byref(self._stream))
+            self._stream = None
+
+    def __del__(self):
+        if getattr(self, '_stream', None) is not None and getattr(self, '_libz', None) is not None:
+            self.close()
+
+
+class _icLimitedReader:
+    """
+    Чтение не более заданного количества байт потока.
+    """
+    def __init__(self, src_file, iSize):
+        self._file = src_file
+        self._size = iSize
+
+    def read(self, iSize=-1):
+        if iSize < 0 or iSize > self._size:
+            iSize = self._size
+        data = self._file.read(iSize) if iSize else b''
+        if iSize and not data:
+            raise EOFError(u'Не ожиданный конец данных элемента архива')
+        self._size -= len(data)
+        return data
+
+
+def get_index_file_name(sTarFileName):
+    """
+    Полное имя файла индекса архива.
+    """
+    return sTarFileName + INDEX_FILE_EXT
+
+
+def _get_archive_identity(sTarFileName):
+    file_stat = os.stat(sTarFileName)
+    return dict(size=file_stat.st_size, mtime=file_stat.st_mtime_ns)
+
+
+def _get_member_type(member):
+    if member.isdir():
+        return manifest.DIR_TYPE
+    elif member.issym():
+        return manifest.LINK_TYPE
+    elif member.islnk():
+        return HARDLINK_TYPE
+    elif member.isreg():
+        return manifest.FILE_TYPE
+    return OTHER_TYPE
+
+
+def build_index(sTarFileName, iSpan=INDEX_SPAN):
+    """
+    Построить индекс tar архива.
+    Архив распаковывается один раз.
+    @param sTarFileName: Полное имя tar архива.
+    @param iSpan: Расстояние между точками доступа.
+    @return: Словарь индекса.
+    """
+    codec = archive_format.get_format_codec(archive_format.detect_format(sTarFileName))
+    index = dict(version=INDEX_VERSION, archive=_get_archive_identity(sTarFileName), codec=codec,
+                 span=iSpan, points=[], members=[])
+    with open(sTarFileName, 'rb') as archive_file:
+        reader = None
+        if codec == archive_format.GZIP_CODEC and _get_libz() is not None:
+            reader = stream = icGzipIndexReader(archive_file, bBuildIndex=True, iSpan=iSpan)
+        elif codec:
+            stream = decompress.open_stream(sTarFileName, codec, decompress.BUILTIN_BACKEND, archive_file)
+        else:
+            stream = archive_file
+        try:
+            with tarfile.open(fileobj=stream, mode='r|') as tar_file:
+                for member in tar_file:
+                    index['members'].append([member.name, _get_member_type(member), member.offset_data,
+                                             member.size, member.mode, member.mtime, member.linkname,
+                                             member.sparse])
+            if reader is not None:
+                # Дочитать архив до конца для точек доступа последних блоков
+                while reader.read(OUTPUT_CHUNK_SIZE):
+                    pass
+                index['points'] = [[out_offset, in_offset, bits, base64.b64encode(window).decode('ascii')]
+                                   for out_offset, in_offset, bits, window in reader.points]
+        finally:
+            if stream is not archive_file:
+                stream.close()
+    log.info(u'Индекс архива <%s>. Элементов: %d. Точек доступа: %d' % (sTarFileName, len(index['members']),
+                                                                       len(index['points'])))
+    return index
+
+
+def save_index(sTarFileName, dIndex):
+    """
+    Сохранить индекс рядом с архивом.
+    @return: True/False.
+    """
+    index_file_name = get_index_file_name(sTarFileName)
+    tmp_file_name = index_file_name + '.tmp'
+    try:
+        with gzip.open(tmp_file_name, 'wt', encoding='utf-8') as index_file:
+            json.dump(dIndex, index_file)
+        os.replace(tmp_file_name, index_file_name)
+        return True
+    except OSError as err:
+        log.warning(u'Ошибка сохранения индекса архива <%s>: %s' % (index_file_name, err))
+    return False
+
+
+def load_index(sTarFileName):
+    """
+    Загрузить индекс архива.
+    @return: Словарь индекса или None, если индекса нет или он устарел.
+    """
+    index_file_name = get_index_file_name(sTarFileName)
+    if not os.path.exists(index_file_name):
+        return None
+    try:
+        with gzip.open(index_file_name, 'rt', encoding='utf-8') as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError, EOFError):
+        log.warning(u'Не корректный индекс архива <%s>' % index_file_name)
+        return None
+    if index.get('version', None) != INDEX_VERSION or index.get('archive', None) != _get_archive_identity(sTarFileName):
+        log.info(u'Индекс архива <%s> устарел' % index_file_name)
+        return None
+    return index
+
+
+def get_index(sTarFileName):
+    """
+    Индекс архива. Если индекса нет или он устарел, то он строится и сохраняется.
+    """
+    index = load_index(sTarFileName)
+    if index is None:
+        index = build_index(sTarFileName)
+        save_index(sTarFileName, index)
+    return index
+
+
+def index_packages_dir(sPackageDir):
+    """
+    Построить индексы всех tar архивов папки инсталляционных пакетов.
+    Актуальные индексы не перестраиваются.
+    @param sPackageDir: Папка инсталляционных пакетов.
+    @return: Список имен проиндексированных архивов.
+    """
+    indexed = []
+    for name in sorted(os.listdir(sPackageDir)):
+        file_name = os.path.join(sPackageDir, name)
+        if name.endswith(INDEX_FILE_EXT) or not os.path.isfile(file_name):
+            continue
+        if archive_format.get_format_kind(archive_format.detect_format(file_name)) != archive_format.TAR_KIND:
+            continue
+        if load_index(file_name) is None:
+            try:
+                save_index(file_name, build_index(file_name))
+            except (OSError, EOFError, zlib.error, tarfile.TarError) as err:
+                log.error(u'Ошибка индексирования архива <%s>: %s' % (file_name, err))
+                continue
+        indexed.append(file_name)
+    return indexed
+
+
+class icIndexedTarReader:
+    """
+    Чтение данных элементов tar архива по индексу.
+    Данные элементов должны запрашиваться в порядке возрастания смещения.
+    """
+    def __init__(self, sTarFileName, dIndex):
+        self.tar_file_name = sTarFileName
+        self.index = dIndex
+        self._file = open(sTarFileName, 'rb')
+        self._points = [[out_offset, in_offset, bits, base64.b64decode(window)]
+                        for out_offset, in_offset, bits, window in dIndex.get('points', [])]
+        self._point_offsets = [point[0] for point in self._points]
+        self._stream = None
+        self._position = 0
+
+    def _open_stream(self, iOffset):
+        """
+        Открыть распакованный поток, из которого можно прочитать данные со смещения.
+        """
+        codec = self.index.get('codec', None)
+        if not codec:
+            self._file.seek(iOffset)
+            self._stream, self._position = self._file, iOffset
+            return
+        if self._stream is not None and self._position <= iOffset:
+            # Продолжить текущий поток, если до смещения не дальше расстояния между точками доступа
+            if not self._points or iOffset - self._position <= self.index.get('span', INDEX_SPAN):
+                return
+        if self._stream is not None and self._stream is not self._file:
+            self._stream.close()
+        if codec == archive_format.GZIP_CODEC and _get_libz() is not None:
+            i = bisect.bisect_right(self._point_offsets, iOffset) - 1
+            self._stream = icGzipIndexReader(self._file, self._points[i] if i >= 0 else None)
+            self._position = self._stream.tell()
+        else:
+            self._file.seek(0)
+            self._stream = decompress.open_stream(self.tar_file_name, codec, decompress.BUILTIN_BACKEND, self._file)
+            self._position = 0
+
+    def open_member(self, iOffset, iSize):
+        """
+        Файловый объект чтения данных элемента архива.
+        @param iOffset: Смещение данных в распакованном потоке.
+        @param iSize: Размер данных.
+        """
+        self._open_stream(iOffset)
+        skip = iOffset - self._position
+        while skip > 0:
+            data = self._stream.read(min(skip, OUTPUT_CHUNK_SIZE))
+            if not data:
+                raise EOFError(u'Не ожиданный конец архива <%s>' % self.tar_file_name)
+            skip -= len(data)
+        self._position = iOffset + iSize
+        return _icLimitedReader(self._stream, iSize)
+
+    def close(self):
+        if self._stream is not None and self._stream is not self._file:
+            self._stream.close()
+        self._stream = None
+        self._file.close()
+
+
+def _select_members(dIndex, lNames):
+    """
+    Элементы индекса с указанными именами и содержимое указанных папок.
+    """
+    names = extract.get_selected_names(lNames)
+    return [member for member in dIndex['members'] if extract.is_selected_member(member[0], names)]
+
+
+def extract_members(sTarFileName, lNames, lDirs, bOverwrite=True, Manifest=None, dIndex=None):
+    """
+    Выборочно разархивировать элементы tar архива по индексу.
+    @param sTarFileName: Полное имя tar архива.
+    @param lNames: Имена элементов архива. Папки разархивируются с содержимым.
+    @param lDirs: Список папок, в которые разворачиваются элементы.
+    @param bOverwrite: Перезаписать существующие файлы?
+    @param Manifest: Манифест пакета (manifest.icPackageManifest), в который
+        добавляются разархивированные элементы.
+    @param dIndex: Индекс архива. Если не указан, то загружается
+        (или строится) индекс архива.
+    @return: Результат разархивирования extract.icExtractResult.
+    """
+    result = extract.icExtractResult(sTarFileName, lDirs)
+    try:
+        index = dIndex or get_index(sTarFileName)
+        by_name = dict([(os.path.normpath(member[0]), member) for member in index['members']])
+        members = sorted(_select_members(index, lNames), key=lambda member: member[2])
+        reader = icIndexedTarReader(sTarFileName, index)
+        dir_members = []
+        try:
+            for member in members:
+                name, member_type, offset, size, mode, mtime, link_name, sparse = member
+                if not extract.is_safe_member_name(name):
+                    result.add_member(name, u'Не допустимое имя элемента архива')
+                    continue
+                try:
+                    targets = extract.get_member_targets(lDirs, name, member_type == manifest.DIR_TYPE)
+                    entry_hash = ''
+                    if member_type == manifest.DIR_TYPE:
+                        for target in targets:
+                            os.makedirs(target, exist_ok=True)
+                        dir_members.append(member)
+                        result.add_member(name)
+                        continue
+                    elif member_type == manifest.LINK_TYPE:
+                        extract._make_link(link_name, targets, bOverwrite)
+                        entry_hash = link_name
+                    elif member_type in (manifest.FILE_TYPE, HARDLINK_TYPE):
+                        data_member = member
+                        if member_type == HARDLINK_TYPE:
+                            # Данные жесткой ссылки берутся из элемента, на который она ссылается
+                            if not extract.is_safe_member_name(link_name):
+                                raise OSError(u'Не допустимое имя элемента <%s> жесткой ссылки' % link_name)
+                            data_member = by_name.get(os.path.normpath(link_name), None)
+                            if data_member is None or data_member[1] != manifest.FILE_TYPE:
+                                raise OSError(u'Не найден элемент <%s> жесткой ссылки' % link_name)
+                            size = data_member[3]
+                        # Области данных разреженного элемента записаны в архиве подряд
+                        data_sparse = data_member[7]
+                        data_size = sum([region[1] for region in data_sparse]) if data_sparse else data_member[3]
+                        hash_obj = manifest.create_hash() if Manifest is not None else None
+                        extract.write_stream_to_files(reader.open_member(data_member[2], data_size), targets,
+                                                      None, bOverwrite, hash_obj, data_sparse, data_member[3])
+                        if hash_obj is not None:
+                            entry_hash = hash_obj.hexdigest()
+                        for target in targets:
+                            if os.path.exists(target):
+                                os.chmod(target, mode)
+                                os.utime(target, (mtime, mtime))
+                    else:
+                        raise OSError(u'Выборочное разархивирование элемента не поддерживается')
+                    if Manifest is not None:
+                        Manifest.add(name, manifest.FILE_TYPE if member_type == HARDLINK_TYPE else member_type,
+                                     0 if member_type == manifest.LINK_TYPE else size, mode, mtime, entry_hash)
+                    result.add_member(name)
+                except (OSError, EOFError, zlib.error) as err:
+                    log.error(u'Ошибка выборочного разархивирования элемента <%s>: %s' % (name, err))
+                    result.add_member(name, err)
+        finally:
+            reader.close()
+        for name, member_type, offset, size, mode, mtime, link_name, sparse in reversed(dir_members):
+            for target in extract.get_member_targets(lDirs, name, True):
+                os.chmod(target, mode)
+                os.utime(target, (mtime, mtime))
+            if Manifest is not None:
+                Manifest.add(name, manifest.DIR_TYPE, 0, mode, mtime)
+    except (OSError, EOFError, zlib.error, tarfile.TarError) as err:
+        log.fatal(u'Ошибка выборочного разархивирования архива <%s>' % sTarFileName)
+        result.error = str(err)
+    log.info(u'Выборочно разархивировано из <%s> в %s. Элементов: %d. Ошибок: %d' % (sTarFileName, lDirs,
+                                                                                  len(result.members),
+                                                                                  len(result.get_errors())))
+    return result
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Корзина деинсталлированных пакетов.
+
+При деинсталляции папка пакета не удаляется, а переносится
+одним переименованием в корзину на той же файловой системе
+(папка TRASH_DIR_NAME рядом с папкой пакета).
+Элемент корзины:
+    <Корзина>/<Имя пакета>.<Время (мс)>.<Суффикс>/
+        data - папка пакета,
+        manifest.tsv.gz - манифест пакета (см. manifest), если он был сохранен,
+        info.json - описание элемента:
+            {'name': Имя пакета, 'path': Папка пакета, 'time': Время деинсталляции,
+             'archive': Отпечаток архива пакета (см. fingerprint),
+             'complete': Все файлы пакета находятся в папке пакета?,
+             'size': Размер элемента в байтах}
+При повторной инсталляции того же архива (совпадает отпечаток)
+в ту же папку пакет восстанавливается из корзины обратным переименованием
+без разархивирования.
+Элементы корзины удаляются в фоновом потоке (purge_background) по истечении
+TRASH_TTL или, начиная с самых старых, при превышении корзиной TRASH_MAX_SIZE.
+"""
+
+import os
+import os.path
+import json
+import time
+import queue
+import atexit
+import tempfile
+import threading
+import urllib.parse
+
+from . import log
+from . import remove
+
+__version__ = (0, 1, 1, 1)
+
+# Имя папки корзины
+TRASH_DIR_NAME = '.icinstall-trash'
+# Имена файлов элемента корзины
+TRASH_DATA_NAME = 'data'
+TRASH_INFO_NAME = 'info.json'
+TRASH_MANIFEST_NAME = 'manifest.tsv.gz'
+
+# Время хранения элементов корзины (сек)
+TRASH_TTL = 7 * 24 * 60 * 60
+# Максимальный размер корзины (байт)
+TRASH_MAX_SIZE = 4 * 1024 * 1024 * 1024
+# Префикс имени элемента корзины, выбранного для удаления
+PURGE_ITEM_PREFIX = '.purge-'
+
+# Блокировка выбора элементов корзины для удаления и восстановления
+_TRASH_LOCK = threading.Lock()
+
+
+def get_trash_dir(sPackagePath):
+    """
+    Папка корзины для папки пакета.
+    @param sPackagePath: Папка пакета.
+    """
+    return os.path.join(os.path.dirname(os.path.normpath(sPackagePath)), TRASH_DIR_NAME)
+
+
+def _get_item_prefix(sPackageName):
+    return urllib.parse.quote(sPackageName.strip(), safe='') + '.'
+
+
+def load_item_info(sItemPath):
+    """
+    Описание элемента корзины.
+    @param sItemPath: Папка элемента корзины.
+    @return: Словарь описания или None, если описание не доступно.
+    """
+    try:
+        with open(os.path.join(sItemPath, TRASH_INFO_NAME), 'rt') as info_file:
+            return json.load(info_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_item_info(sItemPath, dInfo):
+    tmp_file_name = os.path.join(sItemPath, TRASH_INFO_NAME + '.tmp')
+    with open(tmp_file_name, 'wt') as info_file:
+        json.dump(dInfo, info_file, indent=1)
+    os.replace(tmp_file_name, os.path.join(sItemPath, TRASH_INFO_NAME))
+
+
+def move_to_trash(sPackageName, sPackagePath, dArchiveFingerprint=None, sManifestFileName=None,
+                  iSize=None, bComplete=True):
+    """
+    Перенести папку пакета в корзину.
+    @param sPackageName: Имя пакета.
+    @param sPackagePath: Папка пакета.
+    @param dArchiveFingerprint: Отпечаток архива, из которого установлен пакет.
+    @param sManifestFileName: Полное имя файла манифеста пакета.
+        Файл переносится в элемент корзины.
+    @param iSize: Размер пакета, если известен (например, по манифесту).
+    @param bComplete: Все файлы пакета находятся в папке пакета?
+        Только такой пакет может быть восстановлен из корзины.
+    @return: Папка элемента корзины или None, если папку пакета
+        нельзя перенести в корзину (например, другая файловая система).
+    """
+    package_path = os.path.normpath(sPackagePath)
+    if not os.path.isdir(package_path) or os.path.islink(package_path):
+        return None
+    trash_dir = get_trash_dir(package_path)
+    try:
+        if not os.path.isdir(trash_dir):
+            os.makedirs(trash_dir)
+        item_path = tempfile.mkdtemp(prefix=_get_item_prefix(sPackageName) + '%d.' % int(time.time() * 1000),
+                                     dir=trash_dir)
+    except OSError as err:
+        log.warning(u'Не доступна корзина <%s>: %s' % (trash_dir, err))
+        return None
+    try:
+        os.rename(package_path, os.path.join(item_path, TRASH_DATA_NAME))
+    except OSError as err:
+        log.warning(u'Папка пакета <%s> не может быть перенесена в корзину: %s' % (package_path, err))
+        os.rmdir(item_path)
+        return None
+    if sManifestFileName and os.path.exists(sManifestFileName):
+        os.replace(sManifestFileName, os.path.join(item_path, TRASH_MANIFEST_NAME))
+    _save_item_info(item_path, dict(name=sPackageName.strip(), path=package_path, time=time.time(),
+                                    archive=dArchiveFingerprint, complete=bComplete, size=iSize))
+    log.info(u'Пакет <%s> перенесен в корзину <%s>' % (sPackageName, item_path))
+    return item_path
+
+
+def find_trash_item(sPackageName, sPackagePath, dArchiveFingerprint):
+    """
+    Найти в корзине пакет, установленный из того же архива в ту же папку.
+    @param sPackageName: Имя пакета.
+    @param sPackagePath: Папка пакета.
+    @param dArchiveFingerprint: Отпечаток архива.
+    @return: Папка элемента корзины (самого нового из подходящих) или None.
+    """
+    if not dArchiveFingerprint:
+        return None
+    package_path = os.path.normpath(sPackagePath)
+    for item_path in reversed(get_trash_items(get_trash_dir(package_path), sPackageName)):
+        info = load_item_info(item_path)
+        if info and info.get('complete', False) and info.get('path', None) == package_path and \
+                info.get('archive', None) == dArchiveFingerprint:
+            return item_path
+    return None
+
+
+def get_trash_items(sTrashDir, sPackageName=None):
+    """
+    Папки элементов корзины в порядке деинсталляции.
+    @param sTrashDir: Папка корзины.
+    @param sPackageName: Имя пакета. Если не указано, то все элементы.
+    """
+    try:
+        names = os.listdir(sTrashDir)
+    except OSError:
+        return []
+    prefix = _get_item_prefix(sPackageName) if sPackageName is not None else None
+    items = []
+    for name in names:
+        if name.startswith(PURGE_ITEM_PREFIX):
+            continue
+        # Имя элемента: <Имя пакета>.<Время деинсталляции (мс)>.<Суффикс>
+        parts = name.rsplit('.', 2)
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        if prefix is not None and parts[0] + '.' != prefix:
+            continue
+        items.append((int(parts[1]), os.path.join(sTrashDir, name)))
+    return [item_path for item_time, item_path in sorted(items)]
+
+
+def has_trash_items(sPackageName, sPackagePath):
+    """
+    Есть ли в корзине элементы пакета?
+    Проверка не требует вычисления отпечатка архива.
+    """
+    return bool(get_trash_items(get_trash_dir(sPackagePath), sPackageName))
+
+
+def restore_from_trash(sItemPath, sManifestFileName=None):
+    """
+    Восстановить пакет из корзины.
+    @param sItemPath: Папка элемента корзины.
+    @param sManifestFileName: Полное имя файла, в который восстанавливается манифест пакета.
+    @return: True/False.
+    """
+    with _TRASH_LOCK:
+        info = load_item_info(sItemPath)
+        if not info:
+            return False
+        package_path = info['path']
+        if os.path.lexists(package_path):
+            log.warning(u'Папка пакета <%s> уже существует. Восстановление из корзины не возможно' % package_path)
+            return False
+        parent_dir = os.path.dirname(package_path)
+        if not os.path.isdir(parent_dir):
+            os.makedirs(parent_dir)
+        os.rename(os.path.join(sItemPath, TRASH_DATA_NAME), package_path)
+        manifest_file_name = os.path.join(sItemPath, TRASH_MANIFEST_NAME)
+        if sManifestFileName and os.path.exists(manifest_file_name):
+            manifest_dir = os.path.dirname(sManifestFileName)
+            if not os.path.isdir(manifest_dir):
+                os.makedirs(manifest_dir)
+            os.replace(manifest_file_name, sManifestFileName)
+    remove.remove_tree(sItemPath)
+    log.info(u'Пакет <%s> восстановлен из корзины в <%s>' % (info['name'], package_path))
+    return True
+
+
+def _get_tree_size(sPath):
+    """
+    Размер файлов папки.
+    """
+    size = 0
+    for root, dirs, files in os.walk(sPath):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return size
+
+
+def purge_trash(sTrashDir, fTTL=TRASH_TTL, iMaxSize=TRASH_MAX_SIZE):
+    """
+    Удалить устаревшие элементы корзины.
+    Сначала удаляются элементы старше fTTL, затем самые старые элементы,
+    пока размер корзины превышает iMaxSize.
+    @param sTrashDir: Папка корзины.
+    @param fTTL: Время хранения элементов (сек).
+    @param iMaxSize: Максимальный размер корзины (байт).
+    @return: Список удаленных элементов.
+    """
+    now = time.time()
+    purged = []
+    items = []
+    for item_path in get_trash_items(sTrashDir):
+        info = load_item_info(item_path)
+        if info is None or now - info.get('time', 0) > fTTL:
+            purged.append(item_path)
+            continue
+        if info.get('size', None) is None:
+            info['size'] = _get_tree_size(os.path.join(item_path, TRASH_DATA_NAME))
+            _save_item_info(item_path, info)
+        items.append((item_path, info['size']))
+
+    total_size = sum([size for item_path, size in items])
+    for item_path, size in items:
+        if total_size <= iMaxSize:
+            break
+        purged.append(item_path)
+        total_size -= size
+
+    for item_path in purged:
+        # Элемент переименовывается, чтобы его нельзя было восстановить во время удаления
+        purge_path = os.path.join(sTrashDir, PURGE_ITEM_PREFIX + os.path.basename(item_path))
+        with _TRASH_LOCK:
+            if not os.path.exists(item_path):
+                continue
+            os.rename(item_path, purge_path)
+        log.info(u'Удаление элемента корзины <%s>' % item_path)
+        remove.remove_tree(purge_path)
+    return purged
+
+
+class icTrashPurger:
+    """
+    Очистка корзин в фоновом потоке.
+    Перед завершением инсталлятора ожидается очистка всех корзин очереди.
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            trash_dir = self._queue.get()
+            try:
+                purge_trash(trash_dir)
+            except OSError as err:
+                log.warning(u'Ошибка очистки корзины <%s>: %s' % (trash_dir, err))
+            finally:
+                self._queue.task_done()
+
+    def purge(self, sTrashDir):
+        """
+        Поставить корзину в очередь очистки.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                atexit.register(self.wait)
+        self._queue.put(sTrashDir)
+
+    def wait(self):
+        """
+        Дождаться очистки всех корзин очереди.
+        """
+        self._queue.join()
+
+
+TRASH_PURGER = icTrashPurger()
+
+
+def purge_background(sTrashDir):
+    """
+    Очистить корзину в фоновом потоке.
+    """
+    TRASH_PURGER.purge(sTrashDir)
@@ -19,6 +19,15 @@ import subprocess
 import tempfile
 
 from . import log
+from . import watchdog
+from . import extract
+from . import archive_format
+from . import checksum
+from . import staging
+from . import manifest
+from . import trash
+from . import dedup
+from . import fastcopy
 
 __version__ = (0, 1, 1, 1)
 
@@ -103,6 +112,62 @@ def check_python_labraries(**kwargs):
     return result
 
 
+def check_packages(dPackages):
+    """
+    Проверка установленных пакетов и их версий.
+    @param dPackages: Описательная структура проверки наличия пакетов.
+        Формат:
+        {
+        'имя пакета':{
+            'type':'py' или 'pkg',
+            'ver':'версия',
+            'compare':'условие проверки',
+            'auto':'tar.gz архив для автоматической установки python пакета',
+            }
+        }
+    @return: Кортеж (Общий результат проверки True/False,
+        Список [имя пакета, версия/сообщение, результат, ...]).
+    """
+    package_list = []
+    result = True
+    if dPackages:
+        log.debug(u'Список контролируемых пакетов:')
+        for package_name, package_misc in dPackages.items():
+            if 'type' in package_misc:
+                package_type = package_misc['type']
+            else:
+                package_type = 'py'
+
+            # Определение версии
+            if 'ver' in package_misc:
+                package_ver = package_misc['ver']
+            else:
+                package_ver = ''
+            if 'compare' in package_misc:
+                package_compare = package_misc['compare']
+            else:
+                package_compare = '=='
+
+            # Проверка наличия пакетов
+            package_result = False
+            if package_type == 'py':
+                package_result = check_python_library_version(package_name, package_ver, package_compare)
+                # Если пакет не установлен,
+                # то попытаться поставить его из пакетов инсталлятора
+                if not package_result:
+                    autoinstall_pack = package_misc.get('auto', None)
+                    package_result = targz_install_python_package(autoinstall_pack)
+            elif package_type == 'pkg':
+                package_result = check_linux_package(package_name, package_ver, package_compare)
+
+            result = result and package_result
+            check_package_ver = package_ver if package_result else u'Не установлен/Не сооответствует версии %s' % package_ver
+            line = (package_name, check_package_ver, package_result)
+            log.debug(u'\t%s\tver: (%s)\t[%s]' % (package_name, check_package_ver, package_result))
+            package_list += list(line)
+    return result, package_list
+
+
 def check_linux_package(PackageName_, Version_=None, Compare_='=='):
     """
     Проверка установленного пакета Linux.
@@ -346,84 +411,55 @@ def create_pth_file(PthFileName_, Path_, stdlib_path=None):
 def unzip_to_dir(ZipFileName_, Dir_, bOverwrite=True, bConsole=True):
     """
     Распаковать *.zip архив в папку.
+    Разархивирование выполняется параллельно в процессе инсталлятора (см. extract).
     @param ZipFileName_: Полное имя *.zip архива.
     @param Dir_: Указание папки, в которую будет архив разворачиваться.
     @param bOverwrite: Перезаписать существующие файлы без запроса?
-    @param bConsole: Вывод в консоль?
+    @param bConsole: Вывод имен разархивируемых элементов в консоль?
     @return: Возвращает результат выполнения операции True/False.
     """
-    unzip_cmd = u''
-    try:
-        overwrite = ''
-        if bOverwrite:
-            overwrite = '-o'
-        unzip_cmd = 'unzip %s %s -d %s' % (overwrite, ZipFileName_, Dir_)
-        log.info(u'Unzip. Комманда разархивирования <%s>' % unzip_cmd)
-        if bConsole:
-            os.system(unzip_cmd)
-            return None
-        else:
-            process = subprocess.Popen(unzip_cmd, shell=True,
-                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                       close_fds=True)
-            # txt = process.stdout.readline().decode()
-            return True
-    except:
-        log.error(u'Unzip. Ошибка разархивирования <%s>' % unzip_cmd)
-        raise
-    return None
+    log.info(u'Unzip. Разархивирование <%s> в <%s>' % (ZipFileName_, Dir_))
+    progress = print if bConsole else None
+    return extract.zip_extract(ZipFileName_, [Dir_], bOverwrite, fProgress=progress).is_ok()
 
 
-CLI_PROGRESS_BAR_TOOL = '/bar-1.4/bar'
-
-
-def targz_extract_to_dir(TarFileName_, Dir_, bConsole=True):
+def targz_extract_to_dir(TarFileName_, Dir_, bConsole=True, bAsync=False, sDecompress=None):
     """
     Распаковать *.tar архив в папку.
+    Разархивирование выполняется потоково в процессе инсталлятора (см. extract).
     @param TarFileName_: Полное имя *.tar архива.
     @param Dir_: Указание папки, в которую будет архив разворачиваться.
-    @param bConsole: Вывод в консоль?
-    @return: Возвращает результат выполнения операции True/False.
-    """
-    targz_extract_cmd = ''
-    try:
-        progress_bar = '%s%s' % (os.path.dirname(__file__), CLI_PROGRESS_BAR_TOOL)
-        if os.path.exists(progress_bar):
-            targz_extract_cmd = '%s %s | tar --extract --gzip --directory="%s" --file=-' % (progress_bar,
-                                                                                          TarFileName_, Dir_)
-        else:
-            targz_extract_cmd = 'tar --extract --verbose --directory="%s" --file=%s' % (Dir_, TarFileName_)
-        log.info(u'TarGz. Комманда разархивирования <%s>. Проверка наличия <%s>' % (targz_extract_cmd, os.path.exists(TarFileName_)))
-        if bConsole:
-            os.system(targz_extract_cmd)
-            return None
-        else:
-            # ВНИМАНИЕ! В данном случае запуск разархивирования
-            # происходит в другом процессе
-            # Программа не дожидается выполнения разархивирования
-            # и работает дальше. В случае с <os.system> программа
-            # дожидается процесса разархивирования
-            process = subprocess.Popen(targz_extract_cmd, shell=True,
-                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                       close_fds=True)
-            # txt = process.stdout.readline().decode()
-            return True
-    except:
-        log.fatal(u'TarGz. Ошибка разархивирования <%s>' % targz_extract_cmd)
-        # raise
-    return None
-
-
-def deb_pkg_install(sDEBFileName):
+    @param bConsole: Вывод имен разархивируемых элементов в консоль?
+    @param bAsync: Асинхронное разархивирование.
+        Функция не дожидается завершения разархивирования и возвращает
+        объект extract.icExtractHandle. Завершения можно дождаться методом wait().
+    @param sDecompress: Способ распаковки сжатого gzip архива
+        ('builtin', 'pigz', 'bgzf', 'pipelined' см. decompress).
+        Если не указан, то выбирается автоматически по размеру архива и количеству ядер.
+    @return: Возвращает результат выполнения операции True/False
+        или объект асинхронного разархивирования.
+    """
+    log.info(u'TarGz. Разархивирование <%s> в <%s>. Проверка наличия <%s>' % (TarFileName_, Dir_,
+                                                                              os.path.exists(TarFileName_)))
+    progress = print if bConsole else None
+    if bAsync:
+        return extract.tar_extract_async(TarFileName_, [Dir_], fProgress=progress, sDecompress=sDecompress)
+    return extract.tar_extract(TarFileName_, [Dir_], fProgress=progress, sDecompress=sDecompress).is_ok()
+
+
+def deb_pkg_install(sDEBFileName, sRoot=None):
     """
     Установить deb пакет.
     @param sDEBFileName: Полное имя *.deb пакета.
+    @param sRoot: Корневая папка установки (chroot). Если не указана, то установка в систему.
     @return: Возвращает результат выполнения операции True/False.
     """
     deb_install_cmd = 'dpkg --install %s' % sDEBFileName
+    if sRoot:
+        deb_install_cmd = 'dpkg --root=%s --install %s' % (sRoot, sDEBFileName)
     try:
         log.info(u'Комманда инсталяции DEB пакета <%s>. Проверка наличия <%s>' % (deb_install_cmd, os.path.exists(sDEBFileName)))
-        os.system(deb_install_cmd)
+        watchdog.system(deb_install_cmd)
         return True
     except:
         log.error(u'Ошибка инсталляции DEB пакета <%s>' % deb_install_cmd)
@@ -431,18 +467,21 @@ def deb_pkg_install(sDEBFileName):
     return None
 
 
-def deb_pkg_uninstall(sDEBPackageName):
+def deb_pkg_uninstall(sDEBPackageName, sRoot=None):
     """
     Деинсталлировать DEB пакет.
     @param sDEBPackageName: Имя пакета. Например dosemu.
+    @param sRoot: Корневая папка установки (chroot). Если не указана, то удаление из системы.
     @return: Возвращает .
     """
     deb_uninstall_cmd = u''
     try:
         if check_deb_package_install:
             deb_uninstall_cmd = 'dpkg --remove %s' % sDEBPackageName
+            if sRoot:
+                deb_uninstall_cmd = 'dpkg --root=%s --remove %s' % (sRoot, sDEBPackageName)
             log.info(u'Комманда реинсталляции DEB пакета <%s>' % deb_uninstall_cmd)
-            os.system(deb_uninstall_cmd)
+            watchdog.system(deb_uninstall_cmd)
             return deb_uninstall_cmd
         else:
             log.warning('Package <%s> not installed' % sDEBPackageName)
@@ -616,13 +655,29 @@ def copy_file_to(SrcFileName_, DstPath_, ReWrite_=True):
         if ReWrite_:
             if os.path.exists(dst_file_name):
                 os.remove(dst_file_name)
-        shutil.copyfile(SrcFileName_, dst_file_name)
+        fastcopy.copy_file(SrcFileName_, dst_file_name)
         return True
     except:
         log.fatal(u'Ошибка копирования файла <%s> в <%s>' % (SrcFileName_, DstPath_))
         return False
 
 
+def copy_dir_to(SrcDir_, DstPath_, iWorkers=None):
+    """
+    Копировать содержимое папки в указанную папку.
+    Файлы копируются параллельно с сохранением режима доступа и владельца.
+    @param SrcDir_: Папка-источник.
+    @param DstPath_: Папка-назначение.
+    @param iWorkers: Количество потоков копирования.
+    @return: True/False.
+    """
+    try:
+        return fastcopy.copy_tree(normpath(SrcDir_), normpath(DstPath_), iWorkers).is_ok()
+    except:
+        log.fatal(u'Ошибка копирования папки <%s> в <%s>' % (SrcDir_, DstPath_))
+        return False
+
+
 def set_chown_login(sPath):
     """
     Установить владельца файла/папки залогиненного пользователя.
@@ -698,8 +753,10 @@ def set_public_chmod_tree_cmd(sPath):
             #    path = path.encode(sys.getfilesystemencoding())
             cmd = 'sudo chmod --recursive 777 "%s"' % path
             log.info(u'Запуск комманды ОС <%s>' % cmd)   # sys.getfilesystemencoding()))
-            os.system(cmd)
+            watchdog.system(cmd)
             return True
+        except watchdog.icStepInterrupt:
+            raise
         except:
             log.fatal(u'Ошибка установки прав доступа')
     else:
@@ -1041,10 +1098,57 @@ PUBLIC_MODE = 'public'
 PROTECT_MODE = 'protect'
 
 
+def get_programm_install_dir(dProgramm):
+    """
+    Инсталляционная папка программы.
+    @param dProgramm: Структура описания инсталируемой программы.
+    @return: Полный путь инсталляционной папки.
+    """
+    prg_name = dProgramm.get('programm', dProgramm.get('name', '-'))
+    install_dir = os.getcwd()
+    if 'dir' in dProgramm:
+        if dProgramm['dir'] is None:
+            install_dir = os.path.join(get_temp_dir(), prg_name)
+        else:
+            install_dir = normpath(dProgramm['dir'])
+    return install_dir
+
+
+def get_programm_target_dir(dProgramm):
+    """
+    Папка, в которую разворачивается архив программы.
+    Используется для контроля изменений инсталлированной программы.
+    @param dProgramm: Структура описания инсталируемой программы.
+    @return: Полный путь папки или None, если папка не определена (например DEB пакет).
+    """
+    programm = (dProgramm.get('programm', None) or '').lower()
+    if programm.endswith('.deb') or not dProgramm.get('dir', None):
+        return None
+    install_dir = get_programm_install_dir(dProgramm)
+    if 'package_dir' in dProgramm:
+        return install_dir + '/' + dProgramm['package_dir']
+    return install_dir
+
+
 def install_programm(dProgramm=None, LogManager=None):
     """
     Запуск инсталяции программы.
+    Если программа уже была инсталлирована, то она переустанавливается
+    только в случае изменения ее архива или инсталляционной папки
+    (см. fingerprint).
     @param Programm_: Структура описания инсталируемой программы.
+        Необязательный ключ 'fingerprint_hash' - имя алгоритма хеширования
+        (например 'sha256') для контроля изменения содержимого архива.
+        Необязательные ключи 'sha256'/'blake2b' - ожидаемая контрольная сумма
+        архива, проверяемая при разархивировании (см. extract_programm_archive)
+        или до установки DEB пакета (см. deb_install_programm).
+        Ключи инсталляции в несколько корневых папок (см. multi_root):
+        'root' - корневая папка, 'log_manager' - менеджер журналирования корневой папки,
+        'mirror_dirs' - папки других корневых папок, в которые одновременно разворачивается архив,
+        'mirror_extracted' - общее для шагов программы множество папок, в которые архив уже развернут,
+        'mirror_manifest' - общий для шагов программы манифест пакета.
+        Манифест файлов архива сохраняется менеджером журналирования (см. manifest).
+        Необязательный ключ 'dedup' - дедуплицировать файлы через хранилище (см. dedup).
     @param LogManager: Менеджер журналирования инсталляции.
     @return: True/False
     """
@@ -1052,22 +1156,41 @@ def install_programm(dProgramm=None, LogManager=None):
         log.warning(u'Не определены програмы для инсталляции')
         return False
 
+    # Менеджер журналирования корневой папки инсталляции
+    LogManager = dProgramm.get('log_manager', None) or LogManager
+
     # Имя программы
     prg_name = dProgramm.get('programm', dProgramm.get('name', '-'))
 
     # Не инсталлировать уже инсталлированные пакеты
     is_installed = LogManager.is_installed_package(prg_name) if LogManager else False
+
+    # Кеш отпечатков инсталлированных программ
+    fingerprint_cache = None
+    if LogManager and hasattr(LogManager, 'get_fingerprint_cache'):
+        fingerprint_cache = LogManager.get_fingerprint_cache()
+    archive_fingerprint = None
+    if is_installed and fingerprint_cache and fingerprint_cache.has_programm(prg_name):
+        archive_fingerprint = fingerprint_cache.get_archive_fingerprint(get_programm_filename(dProgramm),
+                                                                        dProgramm.get('fingerprint_hash', None))
+        if fingerprint_cache.is_unchanged(prg_name, archive_fingerprint, get_programm_target_dir(dProgramm),
+                                          get_installed_programm_manifest(prg_name, LogManager)):
+            log.info(u'Инсталляция <%s>. Архив и инсталляционная папка не изменились' % prg_name)
+            watchdog.mark_skipped()
+            return True
+        # Архив или инсталляционная папка изменились. Необходимо переустановить программу
+        # Запись install.log заменяется только после успешной переустановки
+        log.info(u'Инсталляция <%s>. Архив или инсталляционная папка изменились' % prg_name)
+        is_installed = False
+
     log.info(u'Инсталляция <%s> ... %s' % (prg_name, not is_installed))
     if not is_installed:
 
-        install_dir = os.getcwd()
-
+        install_dir = get_programm_install_dir(dProgramm)
         if 'dir' in dProgramm:
             if dProgramm['dir'] is None:
-                install_dir = os.path.join(get_temp_dir(), prg_name)
                 log.warning(u'Не определена инсталляционная директория. Используется <%s>' % install_dir)
             else:
-                install_dir = normpath(dProgramm['dir'])
                 log.debug(u'Установка инсталляционной директории <%s>' % install_dir)
 
         # Если перед инсталяцией инсталляционная папка определена
@@ -1076,47 +1199,199 @@ def install_programm(dProgramm=None, LogManager=None):
             log.info(u'Создание инсалляционной директории <%s>' % install_dir)
             os.makedirs(install_dir)
 
-        # Определить папку пакета
+        # Архив уже развернут в инсталляционную папку шагом другой корневой папки
+        mirror_extracted = dProgramm.get('mirror_extracted', None)
+        is_extracted = mirror_extracted is not None and install_dir in mirror_extracted
+        mirror_dirs = get_programm_mirror_dirs(dProgramm)
+
+        # Манифест файлов пакета заполняется при разархивировании
+        package_manifest = dProgramm.get('mirror_manifest', None)
+        if package_manifest is None:
+            package_manifest = manifest.icPackageManifest(prg_name, install_dir)
+        is_manifest = is_extracted
+        # Хранилище содержимого файлов
+        dedup_store = get_programm_dedup_store(dProgramm, LogManager)
+
+        # Определить папку пакета.
+        # Существующая папка пакета заменяется атомарно после разархивирования (см. staging)
         package_dir = install_dir
         if 'package_dir' in dProgramm:
             package_dir += '/'+dProgramm['package_dir']
-            # если папка пакета уже существует, то удалить ее
-            if os.path.exists(package_dir):
-                log.info(u'Удаление директории пакета <%s>' % package_dir)
-                shutil.rmtree(package_dir, 1)
-
-        if dProgramm.get('programm', None) is None:
-            log.warning(u'Не определенн инсталляционный пакет программы <%s>' % prg_name)
-        elif dProgramm['programm'][-4:].lower() == '.zip':
-            # Разархивировать ZIP файл
-            unzip_programm(dProgramm)
-        elif dProgramm['programm'][-7:].lower() == '.tar.gz':
-            # Разархивировать .tar.gz файл
-            targz_extract_programm(dProgramm)
-        elif dProgramm['programm'][-4:].lower() == '.deb':
-            deb_install_programm(dProgramm)
-            # Т.к. DEB пакеты не деинсталлируются удалением, то вместо директории
-            # пакета указываем имя пакета, которое потом будет использоваться
-            # в dpkg --remove комманде
-            package_dir = dProgramm['name']
-
-        if 'mode' in dProgramm:
-            if dProgramm['mode'].lower() == PUBLIC_MODE:
-                # Если режим установлен, как публичный, то установить режим для
-                # инсталляционной папки и поменять владельца на залогинненного
-                set_chown_login(install_dir)
-                set_public_chmod(install_dir)
-
-        # Если нужно, то создать pth файл
-        if 'pth' in dProgramm:
-            create_pth_file_programm(dProgramm['pth'], install_dir)
-
-        if LogManager:
-            LogManager.log_install_package(prg_name, package_dir)
+
+        # Замена папок пакета откатывается при ошибке инсталляции программы
+        transaction = staging.icInstallTransaction()
+        try:
+            if is_extracted:
+                log.info(u'Инсталляция <%s>. Архив уже развернут в <%s>' % (prg_name, install_dir))
+                watchdog.mark_skipped()
+            elif dProgramm.get('programm', None) is None:
+                log.warning(u'Не определенн инсталляционный пакет программы <%s>' % prg_name)
+                watchdog.mark_skipped()
+            elif fingerprint_cache and restore_programm_from_trash(dProgramm, package_dir, LogManager, fingerprint_cache):
+                # Программа деинсталлирована после инсталляции из того же архива
+                archive_fingerprint = fingerprint_cache.get_archive_fingerprint(get_programm_filename(dProgramm),
+                                                                                dProgramm.get('fingerprint_hash', None))
+                log.info(u'Инсталляция <%s>. Восстановлена из корзины' % prg_name)
+                watchdog.mark_skipped()
+            else:
+                # Формат пакета определяется по содержимому файла, а затем по расширению
+                package_format = archive_format.detect_format(get_programm_filename(dProgramm))
+                package_kind = archive_format.get_format_kind(package_format)
+                log.info(u'Инсталляция <%s>. Формат пакета <%s>' % (prg_name, package_format))
+                if package_kind == archive_format.ZIP_KIND:
+                    # Разархивировать ZIP файл
+                    if unzip_programm(dProgramm, Transaction=transaction, Manifest=package_manifest,
+                                      Store=dedup_store) is False:
+                        log.error(u'Инсталляция <%s>. Ошибка разархивирования' % prg_name)
+                        return False
+                    is_manifest = True
+                elif package_kind == archive_format.TAR_KIND:
+                    # Разархивировать tar архив (в том числе сжатый)
+                    if targz_extract_programm(dProgramm, Transaction=transaction, Manifest=package_manifest,
+                                              Store=dedup_store) is False:
+                        log.error(u'Инсталляция <%s>. Ошибка разархивирования' % prg_name)
+                        return False
+                    is_manifest = True
+                elif package_kind == archive_format.DEB_KIND:
+                    if not deb_install_programm(dProgramm):
+                        log.error(u'Инсталляция <%s>. Ошибка инсталляции DEB пакета' % prg_name)
+                        return False
+                    # Т.к. DEB пакеты не деинсталлируются удалением, то вместо директории
+                    # пакета указываем имя пакета, которое потом будет использоваться
+                    # в dpkg --remove комманде
+                    package_dir = dProgramm['name']
+                else:
+                    log.error(u'Инсталляция <%s>. Не поддерживаемый формат пакета <%s>' % (prg_name,
+                                                                                           dProgramm['programm']))
+                    return False
+
+            if dedup_store is not None:
+                dedup_store.log_statistics(prg_name)
+
+            if 'mode' in dProgramm:
+                if dProgramm['mode'].lower() == PUBLIC_MODE:
+                    # Если режим установлен, как публичный, то установить режим для
+                    # инсталляционной папки и поменять владельца на залогинненного
+                    set_chown_login(install_dir)
+                    set_public_chmod(install_dir)
+
+            # Если нужно, то создать pth файл
+            if 'pth' in dProgramm:
+                create_pth_file_programm(dProgramm['pth'], install_dir)
+
+            if mirror_extracted is not None and not is_extracted:
+                mirror_extracted.update(mirror_dirs)
+
+            if LogManager:
+                LogManager.log_install_package(prg_name, package_dir)
+                if is_manifest and hasattr(LogManager, 'save_package_manifest'):
+                    LogManager.save_package_manifest(prg_name, package_manifest, install_dir)
+        except:
+            transaction.rollback()
+            raise
+        transaction.finish()
+
+        if fingerprint_cache:
+            if archive_fingerprint is None:
+                archive_fingerprint = fingerprint_cache.get_archive_fingerprint(get_programm_filename(dProgramm),
+                                                                                dProgramm.get('fingerprint_hash', None))
+            fingerprint_cache.update(prg_name, archive_fingerprint, get_programm_target_dir(dProgramm),
+                                     get_installed_programm_manifest(prg_name, LogManager))
         return True
+    # Программа уже инсталлирована
+    watchdog.mark_skipped()
     return False
 
 
+def get_installed_programm_manifest(sPrgName, LogManager=None):
+    """
+    Сохраненный манифест пакета инсталлированной программы.
+    @param sPrgName: Имя программы.
+    @param LogManager: Менеджер журналирования инсталляции.
+    @return: Объект manifest.icPackageManifest или None, если манифеста нет.
+    """
+    if LogManager and hasattr(LogManager, 'get_package_manifest'):
+        return LogManager.get_package_manifest(sPrgName)
+    return None
+
+
+def restore_programm_from_trash(dProgramm, sPackagePath, LogManager=None, FingerprintCache=None):
+    """
+    Восстановить папку пакета программы из корзины (см. trash),
+    если программа была деинсталлирована после инсталляции из того же архива.
+    @param dProgramm: Структура описания инсталируемой программы.
+    @param sPackagePath: Папка пакета.
+    @param LogManager: Менеджер журналирования инсталляции.
+        В его папку манифестов восстанавливается манифест пакета.
+    @param FingerprintCache: Кеш отпечатков (fingerprint.icFingerprintCache)
+        для определения отпечатка архива.
+    @return: True - папка пакета восстановлена, False - нет.
+    """
+    prg_name = dProgramm.get('programm', dProgramm.get('name', '-'))
+    # Архив, разворачиваемый сразу в несколько корневых папок, не восстанавливается
+    if FingerprintCache is None or dProgramm.get('mirror_dirs', None):
+        return False
+    # Отпечаток архива вычисляется только если в корзине есть элементы пакета
+    if os.path.lexists(sPackagePath) or not trash.has_trash_items(prg_name, sPackagePath):
+        return False
+    archive_fingerprint = FingerprintCache.get_archive_fingerprint(get_programm_filename(dProgramm),
+                                                                   dProgramm.get('fingerprint_hash', None))
+    item_path = trash.find_trash_item(prg_name, sPackagePath, archive_fingerprint)
+    if item_path is None:
+        return False
+    manifest_file_name = None
+    if LogManager and hasattr(LogManager, 'get_package_manifest_file_name'):
+        manifest_file_name = LogManager.get_package_manifest_file_name(prg_name)
+    return trash.restore_from_trash(item_path, manifest_file_name)
+
+
+def get_programm_dedup_store(dProgramm, LogManager=None):
+    """
+    Хранилище содержимого файлов программы (см. dedup).
+    Дедупликация включается ключом 'dedup' описания программы
+    или переменной DEDUP_STORE (параметр --dedup инсталлятора или config).
+    @param dProgramm: Структура описания инсталируемой программы.
+    @param LogManager: Менеджер журналирования инсталляции.
+    @return: Объект dedup.icDedupStore или None, если дедупликация не включена.
+    """
+    is_dedup = dProgramm.get('dedup', None)
+    if is_dedup is None:
+        from . import utils
+        is_dedup = utils.get_var('DEDUP_STORE')
+    if not is_dedup or not LogManager or not hasattr(LogManager, 'get_dedup_store_dir'):
+        return None
+    manifests_dir = LogManager.get_manifests_dir() if hasattr(LogManager, 'get_manifests_dir') else None
+    return dedup.icDedupStore(LogManager.get_dedup_store_dir(), manifests_dir)
+
+
+def get_programm_filename(dProgramm, sPackageDir=INSTALL_PACKAGES_DIR_DEFAULT):
+    """
+    Полное имя инсталляционного файла программы.
+    @param dProgramm: Структура описания инсталируемой программы.
+    @param sPackageDir: Папка инсталляционных пакетов.
+    @return: Полное имя файла или None, если файл не определен.
+    """
+    if not dProgramm or not dProgramm.get('programm', None):
+        return None
+    return normpath(os.path.join('.', sPackageDir, dProgramm['programm']))
+
+
+def get_file_identity(sFileName):
+    """
+    Идентификация файла по имени, размеру и времени изменения.
+    @param sFileName: Полное имя файла.
+    @return: Словарь {'path': Абсолютный путь, 'size': Размер, 'mtime': Время изменения в нс}
+        или None, если файл не найден.
+    """
+    if not sFileName:
+        return None
+    try:
+        file_stat = os.stat(sFileName)
+    except OSError:
+        return None
+    return dict(path=os.path.abspath(sFileName), size=file_stat.st_size, mtime=file_stat.st_mtime_ns)
+
+
 def create_pth_file_programm(dPth, sInstallDir):
     """
     Создать pth файл.
@@ -1134,6 +1409,22 @@ def create_pth_file_programm(dPth, sInstallDir):
                            stdlib_path=dPth.get('stdlib_path', None))
 
 
+def get_programm_mirror_dirs(dProgramm):
+    """
+    Папки, в которые одновременно с инсталляционной папкой
+    разворачивается архив программы (ключ 'mirror_dirs').
+    Папки создаются, если их нет.
+    @param dProgramm: Структура описания инсталируемой программы.
+    @return: Список папок.
+    """
+    mirror_dirs = [normpath(mirror_dir) for mirror_dir in dProgramm.get('mirror_dirs', None) or ()]
+    for mirror_dir in mirror_dirs:
+        if not os.path.exists(mirror_dir):
+            log.info(u'Создание инсталляционной директории <%s>' % mirror_dir)
+            os.makedirs(mirror_dir)
+    return mirror_dirs
+
+
 def remove_programm(dProgramm=None):
     """
     Произвести дополнительные удаления перед установкой.
@@ -1150,15 +1441,19 @@ def remove_programm(dProgramm=None):
             elif os.path.sep not in remove_name:
                 # Если нет разделителей папок в имени, значит это указание
                 # DEB пакета
-                cmd = deb_pkg_uninstall(remove_name)
+                cmd = deb_pkg_uninstall(remove_name, dProgramm.get('root', None))
                 log.info(u'Деинсталяция DEB пакета <%s>. Комманда <%s>' % (remove_name, cmd))
             else:
                 log.warning(u'Не удален <%s>' % remove_name)
 
 
-def unzip_programm(dProgramm=None, sPackageDir=INSTALL_PACKAGES_DIR_DEFAULT):
+def unzip_programm(dProgramm=None, sPackageDir=INSTALL_PACKAGES_DIR_DEFAULT, Transaction=None, Manifest=None,
+                   Store=None):
     """
     Распаковать zip архив.
+    @param Transaction: Объект staging.icInstallTransaction (см. extract_programm_archive).
+    @param Manifest: Манифест пакета (см. extract_programm_archive).
+    @param Store: Хранилище содержимого файлов (см. extract_programm_archive).
     """
     if dProgramm is None:
         log.warning(u'Unzip. Не определен пакет дял разархивирования')
@@ -1179,14 +1474,18 @@ def unzip_programm(dProgramm=None, sPackageDir=INSTALL_PACKAGES_DIR_DEFAULT):
         os.makedirs(install_dir)
 
     zip_file_name = normpath(os.path.join('.', sPackageDir, dProgramm['programm']))
+    return extract_programm_archive(dProgramm, zip_file_name, install_dir, Transaction, Manifest, Store)
 
-    console = dProgramm.get('console', True)
-    return unzip_to_dir(zip_file_name, install_dir, bConsole=console)
 
-
-def targz_extract_programm(dProgramm=None, sPackageDir=INSTALL_PACKAGES_DIR_DEFAULT):
+def targz_extract_programm(dProgramm=None, sPackageDir=INSTALL_PACKAGES_DIR_DEFAULT, Transaction=None,
+                           Manifest=None, Store=None):
     """
-    Распаковать tar архив.
+    Распаковать tar архив (не сжатый или сжатый gzip, xz, bzip2, zstd, lz4).
+    Способ распаковки сжатого архива может быть указан ключом 'decompress'
+    описания программы (см. decompress).
+    @param Transaction: Объект staging.icInstallTransaction (см. extract_programm_archive).
+    @param Manifest: Манифест пакета (см. extract_programm_archive).
+    @param Store: Хранилище содержимого файлов (см. extract_programm_archive).
     """
     if dProgramm is None:
         log.warning(u'Targz. Не определен пакет для разархивирования')
@@ -1210,24 +1509,85 @@ def targz_extract_programm(dProgramm=None, sPackageDir=INSTALL_PACKAGES_DIR_DEFA
     tar_file_name = normpath(tar_filename)
     log.info(u'Полное имя файла TaGz <%s> программы для разархивирования (%s)' % (tar_file_name, tar_filename))
 
-    console = dProgramm.get('console', True)
-    return targz_extract_to_dir(tar_file_name, install_dir, bConsole=console)
+    return extract_programm_archive(dProgramm, tar_file_name, install_dir, Transaction, Manifest, Store)
+
+
+def extract_programm_archive(dProgramm, sArchiveFileName, sInstallDir, Transaction=None, Manifest=None, Store=None):
+    """
+    Разархивировать архив программы в инсталляционную папку
+    (и одновременно в папки других корневых папок, см. multi_root).
+    Архив разворачивается в промежуточные папки и переносится
+    в инсталляционные папки только после успешного разархивирования
+    и проверки контрольной суммы (ключ 'sha256' или 'blake2b', см. checksum).
+    Папка пакета ('package_dir') заменяется атомарно (см. staging).
+    @param dProgramm: Описание программы.
+    @param sArchiveFileName: Полное имя архива.
+    @param sInstallDir: Инсталляционная папка.
+    @param Transaction: Объект staging.icInstallTransaction для отката замены
+        папок пакета. Если не указан, то прежние папки пакета удаляются сразу.
+    @param Manifest: Манифест пакета (manifest.icPackageManifest), заполняемый
+        при разархивировании. Пути элементов - относительно инсталляционной папки.
+    @param Store: Хранилище содержимого файлов (dedup.icDedupStore). Если указано, то
+        одинаковое содержимое файлов не записывается повторно (см. dedup).
+    @return: True/False.
+    """
+    dirs = [sInstallDir] + get_programm_mirror_dirs(dProgramm)
+    archive_checksum = checksum.get_programm_checksum(dProgramm)
+    progress = print if dProgramm.get('console', True) and len(dirs) == 1 else None
+    is_zip = archive_format.get_format_kind(archive_format.detect_format(sArchiveFileName)) == archive_format.ZIP_KIND
+    transaction = Transaction or staging.icInstallTransaction()
+
+    stage_dirs = [staging.create_stage_dir(path) for path in dirs]
+    committed = 0
+    try:
+        if is_zip:
+            result = extract.zip_extract(sArchiveFileName, stage_dirs, fProgress=progress, Checksum=archive_checksum,
+                                         Manifest=Manifest, Store=Store)
+        else:
+            result = extract.tar_extract(sArchiveFileName, stage_dirs, fProgress=progress,
+                                         sDecompress=dProgramm.get('decompress', None), Checksum=archive_checksum,
+                                         Manifest=Manifest, Store=Store)
+        if not result.is_ok():
+            return False
+        for stage_dir, path in zip(stage_dirs, dirs):
+            transaction.commit(stage_dir, path, dProgramm.get('package_dir', None))
+            committed += 1
+    except:
+        if Transaction is None:
+            transaction.rollback()
+        raise
+    finally:
+        for stage_dir in stage_dirs[committed:]:
+            staging.discard_stage_dir(stage_dir)
+    if Transaction is None:
+        transaction.finish()
+    return True
 
 
 def deb_install_programm(dProgramm=None, sPackageDir=INSTALL_PACKAGES_DIR_DEFAULT):
     """
     Установить DEB пакет.
+    Контрольная сумма пакета (ключ 'sha256' или 'blake2b', см. checksum)
+    проверяется до удаления пакетов и вызова dpkg.
+    @return: True/False.
     """
     if dProgramm is None:
         log.warning(u'Deb. Не определен пакет для инсталляции')
         return False
 
+    deb_file_name = normpath(os.path.join('.', sPackageDir, dProgramm['programm']))
+
+    deb_checksum = checksum.get_programm_checksum(dProgramm)
+    if deb_checksum is not None:
+        if not deb_checksum.check_file(deb_file_name):
+            log.error(u'Deb. Не совпадает контрольная сумма %s пакета <%s>' % (deb_checksum.algorithm, deb_file_name))
+            return False
+        log.info(u'Deb. Пакет <%s>. Контрольная сумма %s проверена' % (deb_file_name, deb_checksum.algorithm))
+
     # Если необходимо. то деинсталлировать пакеты
     remove_programm(dProgramm)
 
-    deb_file_name = normpath(os.path.join('.', sPackageDir, dProgramm['programm']))
-
-    return deb_pkg_install(deb_file_name)
+    return deb_pkg_install(deb_file_name, dProgramm.get('root', None))
 
 
 def uninstall_programms(lProgramms=None, LogManager=None):
@@ -1283,7 +1643,7 @@ def exec_sys_command(sCommand):
     @param sCommand: Текст команды.
     """
     try:
-        os.system(sCommand)
+        watchdog.system(sCommand)
         log.info(u'Выполнение команды ОС <%s>' % sCommand)
     except:
         log.error(u'Ошибка выполнения команды %s' % sCommand)
@@ -1316,12 +1676,12 @@ def targz_install_python_package(targz_package_filename=None):
     if os.path.exists(setup_filename):
         cmd = 'cd %s; sudo python setup.py install' % setup_dir
         log.info(u'Инсталяция библиотеки <%s>. Команда <%s>' % (targz_basename, cmd))
-        os.system(cmd)
+        watchdog.system(cmd)
         # Удалить после инсталляции распакованный архив
         if os.path.exists(setup_dir):
             cmd = 'sudo rm -R %s' % setup_dir
             log.info(u'Удаление директории <%s>. Комманда <%s>' % (setup_dir, cmd))
-            os.system(cmd)
+            watchdog.system(cmd)
         return True
     else:
         log.warning(u'Не существует setup.py файл <%s>' % setup_filename)
@@ -8,7 +8,6 @@
 import sys
 import os
 import os.path
-import shutil
 import datetime
 import uuid
 
@@ -18,6 +17,7 @@ except Exception:
     from config import *
 
 from . import log
+from . import fastcopy
 
 7
 __version__ = (0, 1, 1, 1)
@@ -142,7 +142,7 @@ def copyFile(sFileName, sNewFileName, bRewrite=True):
         dir = os.path.dirname(sNewFileName)
         if not os.path.exists(dir):
             os.makedirs(dir)
-        shutil.copyfile(sFileName, sNewFileName)
+        fastcopy.copy_file(sFileName, sNewFileName)
         return True
     except IOError:
         log.fatal(u'Ошибка копирования файла <%s>' % sFileName)
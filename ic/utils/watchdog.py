@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+"""
+Контроль выполнения внешних команд шагов сценария.
+
+Шаг сценария выполняется в контексте (icStepContext), в котором
+регистрируются запущенные шагом внешние процессы.
+При истечении времени выполнения шага или отмене сценария
+дерево процессов шага принудительно завершается:
+сначала сигналом SIGTERM, затем через KILL_GRACE_TIME секунд SIGKILL.
+
+Для регистрации процессов внешние команды необходимо запускать
+функциями system/popen этого модуля вместо os.system/subprocess.Popen.
+"""
+
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from . import log
+
+__version__ = (0, 1, 1, 1)
+
+# Время ожидания завершения процессов после SIGTERM (сек)
+KILL_GRACE_TIME = 3.0
+
+# Причины прерывания шага
+TIMEOUT_REASON = 'timeout'
+CANCEL_REASON = 'cancel'
+
+# Текущие контексты потоков
+_THREAD_LOCAL = threading.local()
+
+# Процессы, зарегистрированные во всех контекстах {pid: Контекст}
+_PROCESSES = {}
+_PROCESSES_LOCK = threading.Lock()
+
+
+class icStepInterrupt(Exception):
+    """
+    Выполнение шага прервано.
+    """
+    def __init__(self, sName, sReason):
+        Exception.__init__(self, u'Шаг <%s> прерван (%s)' % (sName, sReason))
+        self.name = sName
+        self.reason = sReason
+
+
+def get_child_pids(iPid):
+    """
+    Идентификаторы всех потомков процесса.
+    @param iPid: Идентификатор процесса.
+    @return: Список идентификаторов процессов-потомков.
+    """
+    children = {}
+    try:
+        proc_pids = [int(name) for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return []
+    for pid in proc_pids:
+        try:
+            with open('/proc/%d/stat' % pid, 'rt') as stat_file:
+                stat = stat_file.read()
+            # Имя процесса может содержать пробелы и скобки
+            ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(pid)
+
+    result = []
+    parents = [iPid]
+    while parents:
+        for pid in children.get(parents.pop(), ()):
+            if pid not in result:
+                result.append(pid)
+                parents.append(pid)
+    return result
+
+
+def _send_signal(lPids, iSignal):
+    """
+    Послать сигнал процессам.
+    @return: Список процессов, которым сигнал отправлен.
+    """
+    alive = []
+    for pid in lPids:
+        try:
+            os.kill(pid, iSignal)
+            alive.append(pid)
+        except OSError:
+            pass
+    return alive
+
+
+def _is_alive(iPid):
+    """
+    Процесс еще выполняется?
+    Процессы-зомби считаются завершенными.
+    """
+    try:
+        with open('/proc/%d/stat' % iPid, 'rt') as stat_file:
+            stat = stat_file.read()
+        return stat[stat.rindex(')') + 2:].split()[0] != 'Z'
+    except (OSError, ValueError, IndexError):
+        return False
+
+
+def kill_process_tree(iPid, bKillRoot=True, fGraceTime=KILL_GRACE_TIME):
+    """
+    Принудительно завершить дерево процессов.
+    @param iPid: Идентификатор корневого процесса.
+    @param bKillRoot: Завершать корневой процесс?
+    @param fGraceTime: Время ожидания завершения после SIGTERM.
+    @return: Список идентификаторов процессов, которым были отправлены сигналы.
+    """
+    pids = get_child_pids(iPid)
+    if bKillRoot:
+        pids.insert(0, iPid)
+    killed = _send_signal(pids, signal.SIGTERM)
+    deadline = time.time() + fGraceTime
+    while time.time() < deadline and any([_is_alive(pid) for pid in killed]):
+        time.sleep(0.1)
+    # Процессы могли породить новых потомков
+    pids = [pid for pid in killed if _is_alive(pid)]
+    for pid in list(pids):
+        pids += [child_pid for child_pid in get_child_pids(pid) if child_pid not in pids]
+    _send_signal(pids, signal.SIGKILL)
+    return killed
+
+
+class icStepContext:
+    """
+    Контекст выполнения шага сценария.
+    """
+    def __init__(self, sName, fTimeout=None):
+        """
+        Конструктор.
+        @param sName: Идентификатор шага.
+        @param fTimeout: Ограничение времени выполнения шага в секундах.
+            None - без ограничения.
+        """
+        self.name = sName
+        self.timeout = float(fTimeout) if fTimeout else None
+        self.start_time = None
+        self.deadline = None
+        # Причина прерывания шага или None
+        self.reason = None
+        # Шаг ничего не выполнил (например, программа уже инсталлирована).
+        # Длительность такого шага не регистрируется (см. step_durations)
+        self.skipped = False
+        self._processes = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Начать отсчет времени выполнения шага.
+        """
+        self.start_time = time.time()
+        self.deadline = self.start_time + self.timeout if self.timeout else None
+
+    def get_remaining_time(self):
+        """
+        Оставшееся время выполнения шага в секундах или None, если время не ограничено.
+        """
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.time(), 0.0)
+
+    def is_expired(self):
+        """
+        Время выполнения шага истекло?
+        """
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def is_interrupted(self):
+        """
+        Шаг прерван?
+        """
+        return self.reason is not None
+
+    def check(self):
+        """
+        Проверить не прерван ли шаг.
+        Если прерван, то генерируется исключение icStepInterrupt.
+        """
+        if self.reason is not None:
+            raise icStepInterrupt(self.name, self.reason)
+
+    def register_process(self, process):
+        """
+        Зарегистрировать процесс шага.
+        @param process: Объект subprocess.Popen.
+        """
+        with self._lock:
+            self._processes.append(process)
+        with _PROCESSES_LOCK:
+            _PROCESSES[process.pid] = self
+        if self.reason is not None:
+            # Шаг прерван во время запуска процесса
+            kill_process_tree(process.pid)
+
+    def unregister_process(self, process):
+        """
+        Отменить регистрацию завершившегося процесса шага.
+        """
+        with self._lock:
+            if process in self._processes:
+                self._processes.remove(process)
+        with _PROCESSES_LOCK:
+            if _PROCESSES.get(process.pid, None) is self:
+                del _PROCESSES[process.pid]
+
+    def get_processes(self):
+        """
+        Список выполняющихся процессов шага.
+        """
+        with self._lock:
+            return [process for process in self._processes if process.poll() is None]
+
+    def interrupt(self, sReason=CANCEL_REASON, bKillUnregistered=False):
+        """
+        Прервать выполнение шага.
+        Завершаются все процессы шага вместе с их потомками.
+        @param sReason: Причина прерывания.
+        @param bKillUnregistered: Завершить также все не зарегистрированные
+            в других контекстах процессы-потомки инсталлятора.
+            Применяется, если шаг выполняется один и мог запустить процессы
+            в обход функций этого модуля (например, os.system в скрипте).
+        @return: Список идентификаторов процессов, которым были отправлены сигналы.
+        """
+        self.reason = sReason
+        killed = []
+        for process in self.get_processes():
+            log.warning(u'Шаг <%s>. Завершение процесса <%s> %s' % (self.name, process.pid, process.args))
+            killed += kill_process_tree(process.pid)
+        if bKillUnregistered:
+            with _PROCESSES_LOCK:
+                foreign_pids = [pid for pid, context in _PROCESSES.items() if context is not self]
+            for pid in foreign_pids:
+                foreign_pids = foreign_pids + get_child_pids(pid)
+            for pid in get_child_pids(os.getpid()):
+                if pid not in foreign_pids and pid not in killed and _is_alive(pid):
+                    log.warning(u'Шаг <%s>. Завершение процесса <%s>' % (self.name, pid))
+                    killed += kill_process_tree(pid)
+        return killed
+
+
+def set_context(context):
+    """
+    Установить контекст шага текущего потока.
+    @param context: Объект icStepContext или None.
+    """
+    _THREAD_LOCAL.context = context
+
+
+def get_context():
+    """
+    Контекст шага текущего потока или None.
+    """
+    return getattr(_THREAD_LOCAL, 'context', None)
+
+
+def mark_skipped():
+    """
+    Отметить, что шаг текущего потока ничего не выполнил.
+    """
+    context = get_context()
+    if context is not None:
+        context.skipped = True
+
+
+def popen(sCommand, **kwargs):
+    """
+    Запустить внешнюю команду без ожидания завершения.
+    Процесс регистрируется в контексте шага текущего потока.
+    @param sCommand: Текст команды.
+    @param kwargs: Дополнительные параметры subprocess.Popen.
+    @return: Объект subprocess.Popen.
+    """
+    context = get_context()
+    if context is not None:
+        context.check()
+    kwargs.setdefault('shell', True)
+    process = subprocess.Popen(sCommand, **kwargs)
+    if context is not None:
+        context.register_process(process)
+    return process
+
+
+def system(sCommand):
+    """
+    Выполнить внешнюю команду с ожиданием завершения.
+    Аналог os.system с регистрацией процесса в контексте шага.
+    Если шаг был прерван во время выполнения команды,
+    то генерируется исключение icStepInterrupt.
+    @param sCommand: Текст команды.
+    @return: Код возврата команды.
+    """
+    context = get_context()
+    process = popen(sCommand)
+    try:
+        return_code = process.wait()
+    finally:
+        if context is not None:
+            context.unregister_process(process)
+    if context is not None:
+        context.check()
+    return return_code
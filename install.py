@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import sys
 import getopt
+import json
 
 try:
     from . import config
@@ -55,36 +57,73 @@ def main(*argv):
 
         --check=            - отметить секцию для установки
         --uncheck=          - снять отметку секции для установки
+
+        --threads=          - количество параллельно выполняемых шагов сценария
+        --io_lane_limit=    - количество параллельных разархивирований на одну файловую систему
+        --resume            - продолжить прерванную инсталляцию с первого не выполненного шага
+        --step_timeout=     - ограничение времени выполнения шага сценария в секундах
+        --root=             - корневая папка инсталляции (chroot). Может указываться несколько раз.
+                              Программы устанавливаются во все указанные корневые папки
+        --dedup             - не записывать повторно одинаковые файлы пакетов, а создавать их
+                              из хранилища содержимого (reflink или жесткая ссылка)
+
+        --batch             - пакетный режим без диалогов. Результат выводится в виде JSON отчета
+        --answers=          - INI файл ответов пакетного режима
+
+        --save_plan=        - сохранить план успешно выполненной инсталляции в файл
+        --plan=             - выполнить инсталляцию по сохраненному плану без диалогов.
+                              Если план устарел, то выполняется пакетная инсталляция
+                              и план сохраняется заново
+
+        --index_packages    - построить индексы tar архивов папки инсталляционных пакетов
+                              для выборочного разархивирования и завершить работу
+        --repair            - восстановить отсутствующие и поврежденные файлы инсталлированных
+                              пакетов по их манифестам без переинсталляции.
+                              Результат выводится в виде JSON отчета
     """
     log.init(config)
 
     log.info(config.TITLE_TXT)
 
-    # Проверка устанувки библиотеки pythondialog
-    if not util.check_python_library_version('dialog'):
-        from . import packages
-        packages.install_pythondialog()
-    # Проверка на устанвки библиотеки urwid
-    if not util.check_python_library_version('urwid'):
-        from . import packages
-        packages.install_urwid()
-
-    try:
-        from .ic.cui import install_wizard
-    except Exception:
-        from ic.cui import install_wizard
-
     # Разбираем аргументы командной строки
     try:
         options, args = getopt.getopt(argv, 'DL',
                                       ['debug', 'log', 'dialog', 'urwid',
                                        'dosemu_dir=', 'icservices_dir=',
-                                       'check=', 'uncheck='])
+                                       'check=', 'uncheck=', 'threads=', 'io_lane_limit=', 'resume',
+                                       'step_timeout=', 'root=', 'dedup',
+                                       'batch', 'answers=', 'plan=', 'save_plan=', 'index_packages', 'repair'])
     except getopt.error as err:
         log.error(u'Ошибка параметров коммандной строки %s' % err.msg, bForcePrint=True)
         log.warning(__doc__, bForcePrint=True)
         sys.exit(2)
 
+    # В пакетном режиме и при инсталляции по плану диалоговые библиотеки не используются
+    plan_filename = dict(options).get('--plan', None)
+    batch_mode = '--batch' in [option for option, arg in options] or bool(plan_filename)
+    repair_mode = '--repair' in [option for option, arg in options]
+    answers_filename = None
+
+    if '--index_packages' in [option for option, arg in options]:
+        try:
+            from .ic.utils import tar_index
+        except Exception:
+            from ic.utils import tar_index
+
+        indexed = tar_index.index_packages_dir(util.INSTALL_PACKAGES_DIR_DEFAULT)
+        print(json.dumps(indexed, ensure_ascii=False, indent=1))
+        return indexed
+
+    if not batch_mode and not repair_mode:
+        # Проверка устанувки библиотеки pythondialog
+        if not util.check_python_library_version('dialog'):
+            from . import packages
+            packages.install_pythondialog()
+        # Проверка на устанвки библиотеки urwid
+        if not util.check_python_library_version('urwid'):
+            from . import packages
+            packages.install_urwid()
+
     for option, arg in options:
         if option in ('--debug', '-D'):
             utils.set_var('SERVICES_DEBUG_MODE', True)
@@ -112,6 +151,79 @@ def main(*argv):
             section = int(arg) if arg.isdigit() else arg
             config.PROGRAMM = util.check_section(config.PROGRAMM, section, False)
 
+        elif option in ('--threads',):
+            utils.set_var('SCENARIO_THREADS', int(arg))
+            log.info(u'Количество потоков выполнения сценария <%s>' % arg)
+        elif option in ('--io_lane_limit',):
+            utils.set_var('SCENARIO_IO_LANE_LIMIT', int(arg))
+            log.info(u'Количество параллельных разархивирований на файловую систему <%s>' % arg)
+        elif option in ('--resume',):
+            utils.set_var('SCENARIO_RESUME', True)
+            log.info(u'Инсталяция. Продолжение прерванной инсталляции')
+        elif option in ('--root',):
+            roots = utils.get_var('INSTALL_ROOTS') or []
+            utils.set_var('INSTALL_ROOTS', roots + [arg])
+            log.info(u'Корневая папка инсталляции <%s>' % arg)
+        elif option in ('--dedup',):
+            utils.set_var('DEDUP_STORE', True)
+            log.info(u'Инсталяция. Дедупликация файлов пакетов')
+        elif option in ('--step_timeout',):
+            utils.set_var('SCENARIO_STEP_TIMEOUT', float(arg))
+            log.info(u'Ограничение времени выполнения шага сценария <%s> сек' % arg)
+        elif option in ('--answers',):
+            answers_filename = arg
+            log.info(u'Инсталяция. Файл ответов <%s>' % arg)
+        elif option in ('--save_plan',):
+            utils.set_var('SAVE_PLAN_FILENAME', arg)
+            log.info(u'Инсталяция. Файл сохранения плана <%s>' % arg)
+
+    if repair_mode:
+        try:
+            from .ic.cui import multi_root
+            from .ic.cui import uninstall_manager
+            from .ic.utils import repair
+        except Exception:
+            from ic.cui import multi_root
+            from ic.cui import uninstall_manager
+            from ic.utils import repair
+
+        roots = utils.get_var('INSTALL_ROOTS')
+        if roots:
+            log_managers = [multi_root.create_root_log_manager(root) for root in roots]
+        else:
+            log_managers = [uninstall_manager.icInstallLogManager()]
+        reports = [repair.repair_packages(log_manager) for log_manager in log_managers]
+        report = dict(result=all([root_report['result'] for root_report in reports]), roots=reports)
+        print(json.dumps(report, ensure_ascii=False, indent=1, default=str))
+        log.info(config.TITLE_TXT)
+        return report
+
+    if batch_mode:
+        try:
+            from .ic.cui import batch_wizard
+            from .ic.cui import install_plan
+        except Exception:
+            from ic.cui import batch_wizard
+            from ic.cui import install_plan
+
+        report = None
+        if plan_filename:
+            log.info(u'Инсталяция по плану <%s>' % plan_filename)
+            report = install_plan.install(plan_filename, config.PACKAGES)
+            if report is None:
+                # План устарел. Выполняется полная инсталляция с сохранением нового плана
+                utils.set_var('SAVE_PLAN_FILENAME', plan_filename)
+        if report is None:
+            report = batch_wizard.install(config.PROGRAMM, config.PACKAGES, answers_filename)
+        print(json.dumps(report, ensure_ascii=False, indent=1, default=str))
+        log.info(config.TITLE_TXT)
+        return report
+
+    try:
+        from .ic.cui import install_wizard
+    except Exception:
+        from ic.cui import install_wizard
+
     result = install_wizard.install(install_script, None, None)
 
     log.info(config.TITLE_TXT)
@@ -119,5 +231,7 @@ def main(*argv):
 
 
 if __name__ == '__main__':
-    import sys
-    main(*sys.argv[1:])
+    result = main(*sys.argv[1:])
+    if isinstance(result, dict):
+        # Пакетный режим. Код завершения определяется отчетом
+        sys.exit(0 if result.get('result', False) else 1)
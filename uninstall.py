@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 #  -*- coding: utf-8 -*-
 
+import sys
 import copy
 import getopt
+import json
 
 try:
     from . import config
@@ -33,26 +35,26 @@ def uninstall(*argv):
 
         --check=            - отметить секцию для установки
         --uncheck=          - снять отметку секции для установки
+
+        --batch             - пакетный режим без диалогов. Результат выводится в виде JSON отчета
+        --answers=          - INI файл ответов пакетного режима
     """
     log.init(config)
     log.info(config.TITLE_TXT)
 
-    try:
-        from .ic.cui import install_wizard
-    except Exception:
-        from ic.cui import install_wizard
-
     # Разбираем аргументы командной строки
     try:
         options, args = getopt.getopt(argv, 'DL',
                                       ['debug', 'log', 'dialog', 'urwid',
-                                       'check=', 'uncheck='])
+                                       'check=', 'uncheck=', 'batch', 'answers='])
     except getopt.error as msg:
         log.error(u'Ошибка параметров коммандной строки %s' % str(msg), bForcePrint=True)
         log.warning(__doc__, bForcePrint=True)
         sys.exit(2)
 
     programms = copy.deepcopy(config.UNINSTALL_PROGRAMM)
+    batch_mode = False
+    answers_filename = None
 
     for option, arg in options:
         if option in ('--debug', '-D'):
@@ -74,6 +76,28 @@ def uninstall(*argv):
             section = int(arg) if arg.isdigit() else arg
             programms = util.check_section(programms, section, False)
 
+        elif option in ('--batch',):
+            batch_mode = True
+        elif option in ('--answers',):
+            answers_filename = arg
+            log.info(u'Деинсталяция. Файл ответов <%s>' % arg)
+
+    if batch_mode:
+        try:
+            from .ic.cui import batch_wizard
+        except Exception:
+            from ic.cui import batch_wizard
+
+        report = batch_wizard.uninstall(programms, answers_filename)
+        print(json.dumps(report, ensure_ascii=False, indent=1, default=str))
+        log.info(config.TITLE_TXT)
+        return report
+
+    try:
+        from .ic.cui import install_wizard
+    except Exception:
+        from ic.cui import install_wizard
+
     result = install_wizard.uninstall(dProgramms=programms)
     log.info(config.TITLE_TXT)
 
@@ -81,5 +105,7 @@ def uninstall(*argv):
 
 
 if __name__ == '__main__':
-    import sys
-    uninstall(*sys.argv[1:])
+    result = uninstall(*sys.argv[1:])
+    if isinstance(result, dict):
+        # Пакетный режим. Код завершения определяется отчетом
+        sys.exit(0 if result.get('result', False) else 1)
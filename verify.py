@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#  -*- coding: utf-8 -*-
+
+import sys
+import getopt
+import json
+
+try:
+    from . import config
+    from .ic.utils import log
+    from .ic.utils import utils
+    from .ic.utils import integrity
+except Exception:
+    import config
+    from ic.utils import log
+    from ic.utils import utils
+    from ic.utils import integrity
+
+
+__version__ = (0, 1, 1, 1)
+
+
+def verify(*argv):
+    """
+    Главная функция проверки инсталлированных пакетов.
+    Файлы пакетов проверяются по манифестам, сохраненным при инсталляции.
+    Результат выводится в виде JSON отчета.
+    Код завершения: 0 - файлы всех пакетов соответствуют манифестам, 1 - есть отличия.
+
+    [Параметры]
+        --debug             - включить все сервисы в режиме отладки
+        --log               - включить все сервисы в режиме журналирования
+
+        --hash              - проверять хеш содержимого всех файлов.
+                              По умолчанию файлы проверяются только по атрибутам
+                              (тип, размер, время изменения, режим доступа)
+        --auto              - проверять хеш содержимого только файлов с измененным временем изменения
+        --threads=          - количество потоков проверки
+        --package=          - проверить только указанный пакет. Может указываться несколько раз
+        --root=             - корневая папка инсталляции (chroot). Может указываться несколько раз
+    """
+    log.init(config)
+    log.info(config.TITLE_TXT)
+
+    # Разбираем аргументы командной строки
+    try:
+        options, args = getopt.getopt(argv, 'DL',
+                                      ['debug', 'log', 'hash', 'auto', 'threads=', 'package=', 'root='])
+    except getopt.error as err:
+        log.error(u'Ошибка параметров коммандной строки %s' % err.msg, bForcePrint=True)
+        log.warning(__doc__, bForcePrint=True)
+        sys.exit(2)
+
+    mode = integrity.STAT_CHECK
+    workers = None
+    package_names = None
+    roots = []
+
+    for option, arg in options:
+        if option in ('--debug', '-D'):
+            utils.set_var('SERVICES_DEBUG_MODE', True)
+            log.info(u'Проверка. Установка режима отладки')
+        elif option in ('--log', '-L'):
+            utils.set_var('SERVICES_LOG_MODE', True)
+            log.info(u'Проверка. Установка режима журналирования')
+        elif option in ('--hash',):
+            mode = integrity.HASH_CHECK
+        elif option in ('--auto',):
+            mode = integrity.AUTO_CHECK
+        elif option in ('--threads',):
+            workers = int(arg)
+        elif option in ('--package',):
+            package_names = (package_names or []) + [arg]
+        elif option in ('--root',):
+            roots.append(arg)
+            log.info(u'Корневая папка инсталляции <%s>' % arg)
+
+    try:
+        from .ic.cui import multi_root
+        from .ic.cui import uninstall_manager
+    except Exception:
+        from ic.cui import multi_root
+        from ic.cui import uninstall_manager
+
+    if roots:
+        log_managers = [multi_root.create_root_log_manager(root) for root in roots]
+    else:
+        log_managers = [uninstall_manager.icInstallLogManager()]
+
+    log.info(u'Проверка инсталлированных пакетов. Режим <%s>' % mode)
+    reports = [integrity.verify_packages(log_manager, mode, workers, package_names) for log_manager in log_managers]
+    report = dict(result=all([root_report['result'] for root_report in reports]), roots=reports)
+    print(json.dumps(report, ensure_ascii=False, indent=1, default=str))
+    log.info(config.TITLE_TXT)
+    return report
+
+
+if __name__ == '__main__':
+    result = verify(*sys.argv[1:])
+    sys.exit(0 if result.get('result', False) else 1)